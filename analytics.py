@@ -0,0 +1,105 @@
+from datetime import date
+
+import numpy as np
+
+from loan_columns import LoanHistory, NO_DATE
+
+# day ordinal of numpy's datetime64 epoch
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+PERCENTILES = (50, 90, 99)
+
+
+def _column(values):
+    # a copy rather than a view: an array.array cannot grow while NumPy holds its buffer
+    return np.array(values, dtype=values.typecode)
+
+
+class LoanArrays:
+    # The loan history as NumPy columns: one entry per loan, books and members as integer codes
+    # into the isbns / emails tables.
+
+    def __init__(self, cols):
+        self.ids = list(cols.ids)
+        self.skipped = cols.skipped
+        self.isbns = list(cols.books)
+        self.emails = list(cols.members)
+        self.book = _column(cols.book_codes)
+        self.member = _column(cols.member_codes)
+        self.date_emprunt = _column(cols.date_emprunt)
+        self.date_due = _column(cols.date_due)
+        self.date_return = _column(cols.date_return)
+        status = _column(cols.status_codes)
+        self.ongoing = status == (cols.statuses.index("ongoing") if "ongoing" in cols.statuses else -1)
+        self.returned = self.date_return != NO_DATE
+
+    @classmethod
+    def from_manager(cls, mgr):
+        # the columns are built once per manager, then follow its changes
+        with LoanHistory.of(mgr).columns() as cols:
+            return cls(cols)
+
+    def __len__(self):
+        return len(self.book)
+
+    def book_counts(self):
+        return np.bincount(self.book, minlength=len(self.isbns))
+
+    def member_counts(self):
+        return np.bincount(self.member, minlength=len(self.emails))
+
+    def top_books(self, k=5):
+        return self._top(self.book_counts(), self.isbns, k)
+
+    def top_members(self, k=5):
+        return self._top(self.member_counts(), self.emails, k)
+
+    def _top(self, counts, names, k):
+        if k < len(counts):
+            idx = np.argpartition(-counts, k)[:k]
+        else:
+            idx = np.arange(len(counts))
+        idx = idx[np.argsort(-counts[idx], kind="stable")]
+        return [(names[i], int(counts[i])) for i in idx]
+
+    def durations(self):
+        # days between loan and return, returned loans only
+        return (self.date_return - self.date_emprunt)[self.returned]
+
+    def duration_distribution(self):
+        # [(days, number of loans)] in increasing duration
+        days, counts = np.unique(self.durations(), return_counts=True)
+        return list(zip(days.tolist(), counts.tolist()))
+
+    def return_delays(self):
+        # days past the due date at return; negative for an early return
+        return (self.date_return - self.date_due)[self.returned]
+
+    def return_delay_percentiles(self, percentiles=PERCENTILES):
+        delays = self.return_delays()
+        if not len(delays):
+            return {}
+        return dict(zip(percentiles, np.percentile(delays, percentiles).tolist()))
+
+    def months(self):
+        # months since 1970-01 of each loan date
+        return (self.date_emprunt - EPOCH_ORDINAL).astype("datetime64[D]").astype("datetime64[M]").astype(np.int64)
+
+    def overdue(self, today=None):
+        today = (today or date.today()).toordinal()
+        late_return = self.returned & (self.date_return > self.date_due)
+        late_open = self.ongoing & (self.date_due < today)
+        return late_return | late_open
+
+    def overdue_rate_by_month(self, today=None):
+        # [("YYYY-MM", overdue loans / loans made that month, loans made that month)]
+        months, inverse = np.unique(self.months(), return_inverse=True)
+        totals = np.bincount(inverse, minlength=len(months))
+        late = np.bincount(inverse, weights=self.overdue(today), minlength=len(months))
+        labels = np.datetime_as_string(months.astype("datetime64[M]"), unit="M")
+        return [(str(m), float(l / t), int(t)) for m, l, t in zip(labels, late, totals)]
+
+    def loans_by_month(self):
+        months, counts = np.unique(self.months(), return_counts=True)
+        labels = np.datetime_as_string(months.astype("datetime64[M]"), unit="M")
+        return [(str(m), int(c)) for m, c in zip(labels, counts)]
@@ -0,0 +1,336 @@
+import argparse
+import gc
+import multiprocessing
+import random
+import tempfile
+import threading
+import time
+import tracemalloc
+import uuid
+from datetime import date, timedelta
+
+from library import Book, Emprunt, LibraryManager, directory_storage
+from loan_columns import LoanColumns
+from search_index import SearchIndex
+
+
+class DictEmprunt:
+    # the loan record as it was before __slots__: a __dict__ and string dates
+    def __init__(self, emprunt_id, book_isbn, member_email, date_emprunt, date_due, date_return=None, status="ongoing"):
+        self.emprunt_id = emprunt_id
+        self.book_isbn = book_isbn
+        self.member_email = member_email
+        self.date_emprunt = date_emprunt
+        self.date_due = date_due
+        self.date_return = date_return
+        self.status = status
+
+
+def synthetic_loans(n, books=10000, members=5000, seed=0):
+    # yields fresh strings for every field, like json.load does
+    rnd = random.Random(seed)
+    start = date(2015, 1, 1).toordinal()
+    for _ in range(n):
+        d = date.fromordinal(start + rnd.randrange(3650))
+        returned = rnd.random() < 0.95
+        yield {
+            "emprunt_id": str(uuid.UUID(int=rnd.getrandbits(128))),
+            "book_isbn": f"ISBN_{rnd.randrange(books)}",
+            "member_email": f"member{rnd.randrange(members)}@example.com",
+            "date_emprunt": d.strftime("%Y-%m-%d"),
+            "date_due": (d + timedelta(days=14)).strftime("%Y-%m-%d"),
+            "date_return": (d + timedelta(days=rnd.randrange(20))).strftime("%Y-%m-%d") if returned else None,
+            "status": "returned" if returned else "ongoing",
+        }
+
+
+def measure(build, n):
+    gc.collect()
+    tracemalloc.start()
+    obj = build(n)
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del obj
+    return current / n
+
+
+def bench_memory(n):
+    builds = [
+        ("dict-based objects", lambda n: [DictEmprunt(**d) for d in synthetic_loans(n)]),
+        ("slotted Emprunt", lambda n: [Emprunt.from_dict(d) for d in synthetic_loans(n)]),
+        ("LoanColumns", lambda n: LoanColumns.from_dicts(synthetic_loans(n))),
+    ]
+    print(f"Memory per loan record ({n} loans)")
+    for name, build in builds:
+        print(f"  {name:<20} {measure(build, n):8.1f} bytes")
+
+
+def bench_analytics(n):
+    # numpy is only needed for this benchmark
+    from analytics import LoanArrays
+
+    rows = list(synthetic_loans(n))
+    print(f"Analytics over {n} loans")
+    # the first analysis of a session pays for the columns, later ones only for the copy to numpy
+    t0 = time.perf_counter()
+    cols = LoanColumns.from_dicts(rows)
+    t1 = time.perf_counter()
+    arrays = LoanArrays(cols)
+    t2 = time.perf_counter()
+    print(f"  {'build columns':<28} {(t1 - t0) * 1000:8.1f} ms")
+    print(f"  {'to numpy':<28} {(t2 - t1) * 1000:8.1f} ms")
+    metrics = [
+        ("per-member counts (loop)", lambda: _count_loop(cols.member_codes)),
+        ("per-member counts", arrays.member_counts),
+        ("top books", arrays.top_books),
+        ("duration distribution", arrays.duration_distribution),
+        ("overdue rate by month", arrays.overdue_rate_by_month),
+        ("return delay percentiles", arrays.return_delay_percentiles),
+    ]
+    for name, fn in metrics:
+        t0 = time.perf_counter()
+        fn()
+        print(f"  {name:<28} {(time.perf_counter() - t0) * 1000:8.1f} ms")
+
+
+def _count_loop(codes):
+    counts = {}
+    for c in codes:
+        counts[c] = counts.get(c, 0) + 1
+    return counts
+
+
+SEARCH_WORDS = ["voyage", "nuit", "jardin", "guerre", "paix", "roman", "histoire", "maison", "mer", "temps",
+                "amour", "route", "ville", "hiver", "secret", "ombre", "lumiere", "femme", "homme", "enfant"]
+SEARCH_QUERIES = ["a", "le", "mot12", "mot123456", "voy", "voyage", "le voyage", "le mot12", "hugo", "rom hug",
+                  "9780000123", "zzz"]
+
+
+def synthetic_books(n, seed=0):
+    # French-like titles: a few very common words, a unique "mot<i>" and a common author name
+    rnd = random.Random(seed)
+    articles = ["le", "la", "les", "un", "une", "l'", "à"]
+    authors = ["Victor Hugo", "Émile Zola", "Marcel Proust", "George Sand", "Jules Verne", "Albert Camus"]
+    for i in range(n):
+        title = f"{rnd.choice(articles)} {rnd.choice(SEARCH_WORDS)} de la {rnd.choice(SEARCH_WORDS)} mot{i}"
+        yield Book(title, f"{rnd.choice(authors)}{rnd.randrange(1000)}", f"978{i:010d}", "")
+
+
+def bench_search(n):
+    index = SearchIndex()
+    t0 = time.perf_counter()
+    for book in synthetic_books(n):
+        index.add(book)
+    t1 = time.perf_counter()
+    index.search("xxx", 1)
+    print(f"Search over {n} books: index built in {t1 - t0:.1f} s, vocabulary sorted in {time.perf_counter() - t1:.1f} s")
+    print(f"  {'query':<14} {'hits':>7} {'first ms':>9} {'then ms':>9}")
+    for query in SEARCH_QUERIES:
+        t0 = time.perf_counter()
+        hits = index.search(query, 50)
+        t1 = time.perf_counter()
+        for _ in range(5):
+            index.search(query, 50)
+        t2 = time.perf_counter()
+        print(f"  {query:<14} {len(hits):7d} {(t1 - t0) * 1000:9.2f} {(t2 - t1) / 5 * 1000:9.2f}")
+
+
+def temp_library(directory, books, members):
+    mgr = LibraryManager(directory_storage(directory))
+    mgr.import_books((i, {"title": f"Book {i}", "author": "Author", "isbn": f"ISBN_{i}"}) for i in range(books))
+    mgr.import_members((i, {"nom": "Nom", "prenom": "Prenom", "email": f"member{i}@example.com"})
+                       for i in range(members))
+    return mgr
+
+
+def bench_batch(n, sizes):
+    # per-item cost of checking out and returning n books, one call per item vs batches
+    print(f"Borrow + return of {n} books, per item")
+    for size in sizes:
+        with tempfile.TemporaryDirectory() as directory:
+            mgr = temp_library(directory, n, n)
+            items = [(f"ISBN_{i}", f"member{i}@example.com") for i in range(n)]
+            t0 = time.perf_counter()
+            if size == 1:
+                loans = [mgr.borrow_book(isbn, email) for isbn, email in items]
+            else:
+                loans = [e for i in range(0, n, size) for e in mgr.borrow_many(items[i:i + size])]
+            t1 = time.perf_counter()
+            ids = [e.emprunt_id for e in loans]
+            if size == 1:
+                for emprunt_id in ids:
+                    mgr.return_book(emprunt_id)
+            else:
+                for i in range(0, n, size):
+                    mgr.return_many(ids[i:i + size])
+            t2 = time.perf_counter()
+            mgr.close()
+        label = "borrow_book/return_book" if size == 1 else f"batches of {size}"
+        print(f"  {label:<28} borrow {(t1 - t0) / n * 1e6:8.1f} us   return {(t2 - t1) / n * 1e6:8.1f} us")
+
+
+def bench_threads(n, counts, reader=False):
+    # n borrow + return pairs on distinct books, split over threads of one process. The writers
+    # only meet under the write lock and share their fsyncs (group commit); with reader=True one
+    # more thread keeps calling stats() and search_books() meanwhile.
+    print(f"{n} borrow + return pairs spread over threads" + (", plus one reader thread" if reader else ""))
+    for threads in counts:
+        with tempfile.TemporaryDirectory() as directory:
+            mgr = temp_library(directory, n, n)
+            done = threading.Event()
+            reads = [0]
+
+            def write(part):
+                for i in part:
+                    e = mgr.borrow_book(f"ISBN_{i}", f"member{i}@example.com")
+                    mgr.return_book(e.emprunt_id)
+
+            def read():
+                while not done.is_set():
+                    mgr.stats()
+                    mgr.search_books("book 1", limit=10)
+                    reads[0] += 1
+
+            workers = [threading.Thread(target=write, args=(range(t, n, threads),)) for t in range(threads)]
+            if reader:
+                workers.append(threading.Thread(target=read))
+            fsyncs = mgr.storage.fsyncs
+            t0 = time.perf_counter()
+            for t in workers:
+                t.start()
+            for t in workers[:threads]:
+                t.join()
+            elapsed = time.perf_counter() - t0
+            done.set()
+            for t in workers[threads:]:
+                t.join()
+            fsyncs = mgr.storage.fsyncs - fsyncs
+            st = mgr.stats()
+            lost = st["total_emprunts"] != n or st["currently_borrowed"] or mgr.available_count() != n
+            mgr.close()
+        line = (f"  {threads:3d} threads   {2 * n / elapsed:8.0f} operations/s   "
+                f"{2 * n / max(fsyncs, 1):5.2f} operations per fsync")
+        if reader:
+            line += f"   {reads[0] / elapsed:8.0f} reads/s"
+        print(line + ("   LOST UPDATES" if lost else ""))
+
+
+def desk(directory, number, ops, books, seed):
+    # one desk process: asks for a random book, which either lends it or queues the member, or
+    # returns one of its own loans. Nothing is checked before borrow_book(), so two desks may race
+    # for the same book and only the library's own locking keeps them apart.
+    mgr = LibraryManager(directory_storage(directory))
+    rng = random.Random(seed)
+    email = f"member{number}@example.com"
+    mine = []
+    queued = set()
+    borrowed = returned = reserved = served = 0
+    for _ in range(ops):
+        if mine and rng.random() < 0.5:
+            mgr.return_book(mine.pop(rng.randrange(len(mine))))
+            returned += 1
+            continue
+        isbn = f"ISBN_{rng.randrange(books)}"
+        try:
+            result = mgr.borrow_book(isbn, email)
+        except ValueError:
+            # already queued for it, or the book is held for another member
+            continue
+        if isinstance(result, dict):
+            queued.add(isbn)
+            reserved += 1
+            continue
+        if isbn in queued:
+            queued.remove(isbn)
+            served += 1
+        mine.append(result.emprunt_id)
+        borrowed += 1
+    mgr.close()
+    return borrowed, returned, reserved, served, sorted(queued)
+
+
+def bench_desks(processes, ops, books):
+    # several processes sharing one data directory; every borrow and return must survive
+    with tempfile.TemporaryDirectory() as directory:
+        temp_library(directory, books, processes).close()
+        t0 = time.perf_counter()
+        with multiprocessing.Pool(processes) as pool:
+            counts = pool.starmap(desk, [(directory, i, ops, books, i) for i in range(processes)])
+        elapsed = time.perf_counter() - t0
+        borrowed = sum(c[0] for c in counts)
+        returned = sum(c[1] for c in counts)
+        reserved = sum(c[2] for c in counts)
+        served = sum(c[3] for c in counts)
+
+        mgr = LibraryManager(directory_storage(directory))
+        mgr.load_history()
+        loans = list(mgr.emprunts.values())
+        problems = []
+        if len(loans) != borrowed:
+            problems.append(f"{borrowed} borrows made, {len(loans)} loans stored")
+        stored_returns = sum(1 for e in loans if e.status == "returned")
+        if stored_returns != returned:
+            problems.append(f"{returned} returns made, {stored_returns} stored")
+        for isbn, book in mgr.books.items():
+            book_loans = [e for e in loans if e.book_isbn == isbn]
+            open_loans = [e for e in book_loans if e.status == "ongoing"]
+            if book.borrow_count != len(book_loans):
+                problems.append(f"{isbn}: borrow_count {book.borrow_count}, {len(book_loans)} loans")
+            if len(open_loans) > 1 or (book.disponibility or book.hold_ordinal is not None) == bool(open_loans):
+                problems.append(f"{isbn}: {len(open_loans)} open loans, disponibility {book.disponibility}")
+        # every reservation is still queued, or was turned into a loan by its member
+        for i, (_, _, _, _, queued) in enumerate(counts):
+            email = f"member{i}@example.com"
+            stored = sorted(isbn for isbn, book in mgr.books.items() if email in book.reservations)
+            if stored != queued:
+                problems.append(f"{email}: queued for {queued}, stored {stored}")
+    print(f"{processes} processes x {ops} operations on {books} books: {borrowed} borrows, {returned} returns, "
+          f"{reserved} reservations ({served} served) in {elapsed:.1f} s "
+          f"({(borrowed + returned + reserved) / elapsed:.0f} operations/s)")
+    if problems:
+        print(f"LOST UPDATES ({len(problems)}):")
+        for problem in problems[:20]:
+            print("  " + problem)
+        return False
+    print("no update lost")
+    return True
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Library benchmarks")
+    sub = parser.add_subparsers(dest="bench", required=True)
+    p = sub.add_parser("memory", help="bytes per loan record for each representation")
+    p.add_argument("-n", type=int, default=200000)
+    p = sub.add_parser("analytics", help="vectorized loan history metrics (needs numpy)")
+    p.add_argument("-n", type=int, default=1000000)
+    p = sub.add_parser("search", help="search_books latency on a large catalogue, 50 results per query")
+    p.add_argument("-n", type=int, default=1000000)
+    p = sub.add_parser("batch", help="per-item cost of borrow_many/return_many by batch size")
+    p.add_argument("-n", type=int, default=2000)
+    p.add_argument("--sizes", type=int, nargs="+", default=[1, 10, 100, 1000])
+    p = sub.add_parser("threads", help="desk operations from several threads of one process")
+    p.add_argument("-n", type=int, default=2000)
+    p.add_argument("--threads", type=int, nargs="+", default=[1, 2, 4, 8])
+    p.add_argument("--reader", action="store_true", help="also run stats() and searches in another thread")
+    p = sub.add_parser("desks", help="several processes borrowing and returning on the same files")
+    p.add_argument("-p", "--processes", type=int, default=4)
+    p.add_argument("--ops", type=int, default=500, help="operations per process")
+    p.add_argument("--books", type=int, default=50)
+    args = parser.parse_args(argv)
+    if args.bench == "memory":
+        bench_memory(args.n)
+    elif args.bench == "analytics":
+        bench_analytics(args.n)
+    elif args.bench == "search":
+        bench_search(args.n)
+    elif args.bench == "batch":
+        bench_batch(args.n, args.sizes)
+    elif args.bench == "threads":
+        bench_threads(args.n, args.threads, args.reader)
+    elif args.bench == "desks":
+        if not bench_desks(args.processes, args.ops, args.books):
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+import argparse
+import csv
+import gzip
+import json
+import sys
+
+from library import LibraryManager
+
+
+def open_text(path):
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8", newline="")
+    return open(path, "r", encoding="utf-8", newline="")
+
+
+def read_rows(path):
+    # yields (line, dict) from a CSV file with a header row or from JSON lines; a JSON line that
+    # does not parse yields (line, None) so it is reported with the other rejects
+    jsonl = path.endswith((".jsonl", ".jsonl.gz"))
+    with open_text(path) as f:
+        if not jsonl:
+            reader = csv.DictReader(f)
+            for row in reader:
+                yield reader.line_num, row
+            return
+        for line, text in enumerate(f, 1):
+            if not text.strip():
+                continue
+            try:
+                row = json.loads(text)
+            except ValueError:
+                row = None
+            yield line, row if isinstance(row, dict) else None
+
+
+def import_file(mgr, kind, path, strict=False, progress=None):
+    if kind == "books":
+        return mgr.import_books(read_rows(path), strict, progress)
+    if kind == "members":
+        return mgr.import_members(read_rows(path), strict, progress)
+    raise KeyError(f"Unknown table: {kind}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bulk import books or members from CSV or JSON lines")
+    parser.add_argument("table", choices=["books", "members"])
+    parser.add_argument("path", help=".csv or .jsonl, optionally .gz")
+    parser.add_argument("--strict", action="store_true", help="import nothing if any row is rejected")
+    parser.add_argument("--rejects", help="write every rejected line and its reason to this CSV file")
+    args = parser.parse_args(argv)
+
+    mgr = LibraryManager()
+    count, rejects = import_file(mgr, args.table, args.path, args.strict,
+                                 lambda n: print(f"{n} rows read", end="\r", file=sys.stderr, flush=True))
+    print(file=sys.stderr)
+    mgr.close()
+    print(f"Imported {count} {args.table}, {len(rejects)} rejected")
+    if args.rejects:
+        with open(args.rejects, "w", encoding="utf-8", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["line", "reason"])
+            writer.writerows(rejects)
+    else:
+        for line, reason in rejects[:20]:
+            print(f"  line {line}: {reason}")
+        if len(rejects) > 20:
+            print(f"  ... {len(rejects) - 20} more, use --rejects to save them all")
+    if rejects and args.strict:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+import argparse
+import sys
+
+from library import LibraryManager, directory_storage
+import reports
+
+
+def open_library(args):
+    if args.sqlite:
+        from sqlite_storage import SqliteStorage
+        return LibraryManager(SqliteStorage(args.sqlite))
+    return LibraryManager(directory_storage(args.data) if args.data else None)
+
+
+def cmd_stats(mgr, args):
+    st = mgr.stats()
+    print(f"Books:   {st['total_books']} ({mgr.available_count()} available)")
+    print(f"Members: {st['total_members']}")
+    print(f"Loans:   {st['total_emprunts']} ({len(st['currently_borrowed'])} ongoing, {mgr.overdue_count()} overdue)")
+    print("Top books:")
+    for b in st["top_books"]:
+        print(f"  {b.borrow_count:6d}  {b.title} ({b.isbn})")
+    print("Top members:")
+    for email, count in st["top_members"]:
+        print(f"  {count:6d}  {reports.member_name(mgr, email)} <{email}>")
+
+
+def cmd_overdue(mgr, args):
+    if args.csv:
+        from export import export_table
+        count = export_table(mgr, "overdue", args.csv)
+        print(f"{count} overdue loans written to {args.csv}")
+        return
+    print("".join(reports.overdue_lines(mgr)), end="")
+
+
+def cmd_report(mgr, args):
+    if args.csv:
+        reports.write_report_csv(mgr, args.csv)
+    else:
+        print("\n".join(reports.report_lines(mgr)))
+
+
+def cmd_export(mgr, args):
+    from export import export_table
+    count = export_table(mgr, args.table, args.path, args.gzip)
+    print(f"Exported {count} rows to {args.path}")
+
+
+def cmd_import(mgr, args):
+    from bulk_import import import_file
+    count, rejects = import_file(mgr, args.table, args.path, args.strict)
+    for line, reason in rejects:
+        print(f"line {line}: {reason}", file=sys.stderr)
+    print(f"Imported {count} {args.table}, {len(rejects)} rejected")
+    mgr.close()
+    if rejects and args.strict:
+        sys.exit(1)
+
+
+def cmd_compact(mgr, args):
+    mgr.close()
+    print("Snapshot up to date")
+
+
+def cmd_expire_holds(mgr, args):
+    expired = mgr.expire_holds()
+    for isbn, no_show, held_for in expired:
+        if no_show is None:
+            print(f"{isbn}: held for {held_for} until {mgr.books[isbn].hold_until}")
+        elif held_for is None:
+            print(f"{isbn}: {no_show} did not come, now available")
+        else:
+            print(f"{isbn}: {no_show} did not come, now held for {held_for} until {mgr.books[isbn].hold_until}")
+    print(f"{len(expired)} holds updated")
+    mgr.close()
+
+
+def cmd_serve(mgr, args):
+    import asyncio
+    from service import serve
+    try:
+        asyncio.run(serve(mgr, args.host, args.port,
+                          lambda port: print(f"Listening on http://{args.host}:{port}", flush=True)))
+    except KeyboardInterrupt:
+        pass
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Library management without the GUI")
+    parser.add_argument("--sqlite", metavar="DB", help="use a SQLite database instead of the JSON files")
+    parser.add_argument("--data", metavar="DIR", help="data directory (default: the current one)")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    sub.add_parser("stats", help="totals and most borrowed books / most active members")
+    p = sub.add_parser("overdue", help="list overdue loans")
+    p.add_argument("--csv", metavar="PATH", help="write them to a CSV file instead")
+    p = sub.add_parser("report", help="the report of the Rapports tab")
+    p.add_argument("--csv", metavar="PATH", help="write it as CSV instead")
+    p = sub.add_parser("export", help="export a full table to CSV")
+    p.add_argument("table", choices=["books", "members", "emprunts", "overdue"])
+    p.add_argument("path", help="output file; a .gz name is gzip-compressed")
+    p.add_argument("--gzip", action="store_true", default=None)
+    p = sub.add_parser("import", help="bulk import books or members from CSV or JSON lines")
+    p.add_argument("table", choices=["books", "members"])
+    p.add_argument("path")
+    p.add_argument("--strict", action="store_true", help="import nothing if any row is rejected")
+    sub.add_parser("compact", help="fold the journal into the snapshot files")
+    sub.add_parser("expire-holds", help="release the returned books nobody came for (run it daily, e.g. from cron)")
+    p = sub.add_parser("serve", help="HTTP/JSON service for kiosks and the web catalogue")
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--port", type=int, default=8080)
+    p = sub.add_parser("bench", help="run bench.py with the remaining arguments")
+    p.add_argument("bench_args", nargs=argparse.REMAINDER)
+
+    args = parser.parse_args(argv)
+    if args.command == "bench":
+        import bench
+        bench.main(args.bench_args)
+        return
+    commands = {"stats": cmd_stats, "overdue": cmd_overdue, "report": cmd_report, "export": cmd_export,
+                "import": cmd_import, "compact": cmd_compact, "expire-holds": cmd_expire_holds, "serve": cmd_serve}
+    commands[args.command](open_library(args), args)
+
+
+if __name__ == "__main__":
+    main()
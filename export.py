@@ -0,0 +1,93 @@
+import argparse
+import csv
+import gzip
+import os
+
+from library import LibraryManager, fsync_dir
+
+# rows between two progress callbacks
+PROGRESS_EVERY = 10000
+
+BOOK_HEADER = ["isbn", "title", "author", "year", "disponibility", "borrow_count", "reservations"]
+MEMBER_HEADER = ["email", "nom", "prenom", "phone", "date_inscription"]
+EMPRUNT_HEADER = ["emprunt_id", "book_isbn", "member_email", "date_emprunt", "date_due", "date_return", "status"]
+
+
+# exports run on worker threads: iterate over a copy, the desk may change the tables meanwhile
+def book_rows(mgr):
+    for b in list(mgr.books.values()):
+        yield [b.isbn, b.title, b.author, b.year, b.disponibility, b.borrow_count, ";".join(b.reservations)]
+
+
+def member_rows(mgr):
+    for m in list(mgr.members.values()):
+        yield [m.email, m.nom, m.prenom, m.phone, m.date_inscription]
+
+
+def emprunt_rows(mgr):
+    # returned loans are streamed from storage, the history is never loaded as a whole
+    for e in mgr.emprunt_rows():
+        yield [e.get(c) or "" for c in EMPRUNT_HEADER]
+
+
+def overdue_rows(mgr):
+    for e in mgr.overdue_emprunts():
+        yield [e.emprunt_id, e.book_isbn, e.member_email, e.date_emprunt, e.date_due, "", e.status]
+
+
+# table -> (header, rows(mgr), expected row count(mgr) for progress)
+TABLES = {
+    "books": (BOOK_HEADER, book_rows, lambda mgr: len(mgr.books)),
+    "members": (MEMBER_HEADER, member_rows, lambda mgr: len(mgr.members)),
+    "emprunts": (EMPRUNT_HEADER, emprunt_rows, lambda mgr: mgr.stats()["total_emprunts"]),
+    "overdue": (EMPRUNT_HEADER, overdue_rows, lambda mgr: mgr.overdue_count()),
+}
+
+
+def open_csv(path, compress=None):
+    # gzip when asked, or when the file name ends in .gz
+    if compress is None:
+        compress = path.endswith(".gz")
+    if compress:
+        return gzip.open(path, "wt", encoding="utf-8", newline="")
+    return open(path, "w", encoding="utf-8", newline="")
+
+
+def export_table(mgr, table, path, compress=None, progress=None):
+    # Writes one table row by row, so memory does not grow with its size. progress(done, total) is
+    # called every PROGRESS_EVERY rows. Returns the number of rows written.
+    if table not in TABLES:
+        raise KeyError(f"Unknown table: {table}")
+    header, rows, expected = TABLES[table]
+    total = expected(mgr) if progress else None
+    if compress is None:
+        compress = path.endswith(".gz")
+    tmp = path + ".tmp"
+    count = 0
+    with open_csv(tmp, compress) as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        for row in rows(mgr):
+            writer.writerow(row)
+            count += 1
+            if progress and count % PROGRESS_EVERY == 0:
+                progress(count, total)
+    os.replace(tmp, path)
+    fsync_dir(path)
+    return count
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export library tables to CSV")
+    parser.add_argument("table", choices=sorted(TABLES))
+    parser.add_argument("path", help="output file; a .gz name is gzip-compressed")
+    parser.add_argument("--gzip", action="store_true", default=None, help="compress whatever the file name")
+    args = parser.parse_args(argv)
+    mgr = LibraryManager()
+    count = export_table(mgr, args.table, args.path, args.gzip,
+                         lambda done, total: print(f"{done}/{total} rows", end="\r", flush=True))
+    print(f"Exported {count} rows to {args.path}")
+
+
+if __name__ == "__main__":
+    main()
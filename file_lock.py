@@ -0,0 +1,66 @@
+import os
+import threading
+
+try:
+    import fcntl
+except ImportError:
+    # Windows
+    fcntl = None
+    import msvcrt
+
+
+class FileLock:
+    # Advisory exclusive lock on a file, shared by every process using the same data directory.
+    # Inside one process it is shared: the file stays locked while any thread holds it, and the
+    # threads exclude each other with their own locks (see LibraryManager). It is reentrant.
+
+    def __init__(self, path):
+        self.path = path
+        self._mutex = threading.Lock()
+        self._holders = 0
+        self._fd = None
+        # times the file was locked: while it stays the same no other process can have written
+        self.taken = 0
+
+    def __enter__(self):
+        with self._mutex:
+            if not self._holders:
+                self._lock_file()
+                self.taken += 1
+            self._holders += 1
+        return self
+
+    def __exit__(self, *exc):
+        with self._mutex:
+            self._holders -= 1
+            if not self._holders:
+                self._unlock_file()
+
+    def _lock_file(self):
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if fcntl:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+            else:
+                # LK_LOCK gives up after about ten seconds; a desk waits as long as it takes
+                while True:
+                    try:
+                        msvcrt.locking(fd, msvcrt.LK_LOCK, 1)
+                        break
+                    except OSError:
+                        continue
+        except BaseException:
+            os.close(fd)
+            raise
+        self._fd = fd
+
+    def _unlock_file(self):
+        fd, self._fd = self._fd, None
+        try:
+            if fcntl:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+            else:
+                os.lseek(fd, 0, os.SEEK_SET)
+                msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+        finally:
+            os.close(fd)
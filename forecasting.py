@@ -0,0 +1,231 @@
+from datetime import date
+
+from library import parse_date
+from search_index import fold
+
+SEASON = 12
+
+# smoothing factors for level, trend and season
+ALPHA = 0.3
+BETA = 0.1
+GAMMA = 0.2
+
+
+def month_index(d):
+    return d.year * 12 + d.month - 1
+
+
+def month_label(index):
+    return f"{index // 12:04d}-{index % 12 + 1:02d}"
+
+
+def label_index(label):
+    year, month = label.split("-")
+    return int(year) * 12 + int(month) - 1
+
+
+class HoltWinters:
+    # Additive Holt-Winters. With fewer than two seasons of data it falls back to Holt's linear
+    # trend, and to the mean below two points. update() folds in one more month in O(1).
+
+    def __init__(self, season=SEASON, alpha=ALPHA, beta=BETA, gamma=GAMMA):
+        self.season = season
+        self.alpha = alpha
+        self.beta = beta
+        self.gamma = gamma
+        self.level = 0.0
+        self.trend = 0.0
+        self.seasonals = None
+        self.n = 0
+
+    def fit(self, series):
+        m = self.season
+        self.n = 0
+        self.trend = 0.0
+        self.seasonals = None
+        if len(series) >= 2 * m:
+            first = sum(series[:m]) / m
+            second = sum(series[m:2 * m]) / m
+            self.level = first
+            self.trend = (second - first) / m
+            self.seasonals = [y - first for y in series[:m]]
+            self.n = m
+            rest = series[m:]
+        elif len(series) >= 2:
+            self.level = series[0]
+            self.trend = series[1] - series[0]
+            self.n = 1
+            rest = series[1:]
+        else:
+            self.level = sum(series) / len(series) if series else 0.0
+            self.n = len(series)
+            rest = []
+        for y in rest:
+            self.update(y)
+        return self
+
+    def update(self, y):
+        if self.n == 0:
+            self.level = y
+        elif self.seasonals is None:
+            level = self.alpha * y + (1 - self.alpha) * (self.level + self.trend)
+            self.trend = self.beta * (level - self.level) + (1 - self.beta) * self.trend
+            self.level = level
+        else:
+            i = self.n % self.season
+            s = self.seasonals[i]
+            level = self.alpha * (y - s) + (1 - self.alpha) * (self.level + self.trend)
+            self.trend = self.beta * (level - self.level) + (1 - self.beta) * self.trend
+            self.seasonals[i] = self.gamma * (y - level) + (1 - self.gamma) * s
+            self.level = level
+        self.n += 1
+
+    def forecast(self, horizon):
+        out = []
+        for h in range(1, horizon + 1):
+            y = self.level + h * self.trend
+            if self.seasonals is not None:
+                y += self.seasonals[(self.n + h - 1) % self.season]
+            out.append(max(0.0, y))
+        return out
+
+
+class DemandForecaster:
+    # Monthly loan forecasts for the whole library, one book or one title.
+    # Models are fitted on complete months only and cached; when a month closes the cached
+    # model is stepped forward instead of being refitted. New loans only touch the counts.
+
+    def __init__(self, mgr, model=HoltWinters):
+        self.mgr = mgr
+        self.model = model
+        self._book_months = None   # isbn -> {month index: loans}, built on first per-book request
+        self._titles = None        # folded title -> {isbn}, built on first per-title request
+        self._title_of = {}        # isbn -> its key in _titles
+        self._models = {}          # key -> (model, first month, last month fitted)
+        self._stale = set()        # keys whose already-fitted months changed
+        mgr.subscribe(self._on_changes)
+
+    def close(self):
+        self.mgr.unsubscribe(self._on_changes)
+
+    def _on_changes(self, events):
+        for action, kind, key in events:
+            if action == "reloaded":
+                self._book_months = None
+                self._titles = None
+                self._title_of = {}
+                self._models = {}
+                self._stale = set()
+                return
+            if kind == "books" and self._titles is not None:
+                self._index_title(key)
+            if kind != "emprunts" or action != "added":
+                continue
+            empr = self.mgr.emprunts.get(key)
+            if empr is not None:
+                self._count(empr.book_isbn, empr.date_emprunt)
+
+    def _count(self, isbn, date_emprunt):
+        try:
+            month = month_index(parse_date(date_emprunt))
+        except (TypeError, ValueError):
+            return
+        if self._book_months is not None:
+            months = self._book_months.setdefault(isbn, {})
+            months[month] = months.get(month, 0) + 1
+        for key in (("book", isbn), ("title", self._title_key(isbn)), ("total", None)):
+            fitted = self._models.get(key)
+            if fitted is not None and month <= fitted[2]:
+                self._stale.add(key)
+
+    def _title_key(self, isbn):
+        book = self.mgr.books.get(isbn)
+        return fold(book.title) if book else None
+
+    def _load_titles(self):
+        if self._titles is None:
+            self._titles = {}
+            self._title_of = {}
+            for isbn in list(self.mgr.books):
+                self._index_title(isbn)
+        return self._titles
+
+    def _index_title(self, isbn):
+        # a book added, removed or renamed: the forecasts of its old and new titles are refitted
+        old = self._title_of.pop(isbn, None)
+        if old is not None:
+            isbns = self._titles[old]
+            isbns.discard(isbn)
+            if not isbns:
+                del self._titles[old]
+        book = self.mgr.books.get(isbn)
+        new = fold(book.title) if book else None
+        if new is not None:
+            self._title_of[isbn] = new
+            self._titles.setdefault(new, set()).add(isbn)
+        if old != new:
+            for title in (old, new):
+                if ("title", title) in self._models:
+                    self._stale.add(("title", title))
+
+    def _load_book_months(self):
+        if self._book_months is None:
+            self._book_months = {}
+            for e in self.mgr.emprunt_rows():
+                try:
+                    month = month_index(parse_date(e["date_emprunt"]))
+                except (TypeError, ValueError):
+                    continue
+                months = self._book_months.setdefault(e["book_isbn"], {})
+                months[month] = months.get(month, 0) + 1
+        return self._book_months
+
+    def _counts(self, key):
+        kind, value = key
+        if kind == "total":
+            return {label_index(label): n for label, n in self.mgr.loans_by_month()}
+        book_months = self._load_book_months()
+        if kind == "book":
+            return book_months.get(value, {})
+        counts = {}
+        for isbn in self._load_titles().get(value, ()):
+            for month, n in book_months.get(isbn, {}).items():
+                counts[month] = counts.get(month, 0) + n
+        return counts
+
+    def _fitted(self, key, today):
+        last = month_index(today or date.today()) - 1
+        cached = self._models.get(key)
+        if cached is not None and key not in self._stale:
+            model, first, fitted_to = cached
+            if fitted_to <= last and (model.seasonals is not None or last - first + 1 < 2 * model.season):
+                counts = self._counts(key) if fitted_to < last else None
+                for month in range(fitted_to + 1, last + 1):
+                    model.update(counts.get(month, 0))
+                self._models[key] = (model, first, last)
+                return model, last
+        self._stale.discard(key)
+        counts = self._counts(key)
+        first = min(counts) if counts else last
+        series = [counts.get(month, 0) for month in range(first, last + 1)]
+        model = self.model().fit(series)
+        self._models[key] = (model, first, last)
+        return model, last
+
+    def _forecast(self, key, horizon, today):
+        model, last = self._fitted(key, today)
+        return [(month_label(last + h), y) for h, y in enumerate(model.forecast(horizon), 1)]
+
+    def forecast_total(self, horizon=1, today=None):
+        # [("YYYY-MM", expected loans)] for the months after the last complete one
+        return self._forecast(("total", None), horizon, today)
+
+    def forecast_book(self, isbn, horizon=1, today=None):
+        return self._forecast(("book", isbn), horizon, today)
+
+    def forecast_title(self, title, horizon=1, today=None):
+        return self._forecast(("title", fold(title)), horizon, today)
+
+    def forecast_catalogue(self, horizon=1, today=None):
+        # {isbn: expected loans over the horizon}, for deciding which titles need more copies
+        return {isbn: sum(y for _, y in self.forecast_book(isbn, horizon, today)) for isbn in self.mgr.books}
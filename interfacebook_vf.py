@@ -1,23 +1,42 @@
 
 
+import time
+STARTUP_T0 = time.perf_counter()
+
+import sys
 import tkinter as tk
 from tkinter import ttk,  simpledialog
-from tkcalendar import DateEntry  
 from library import LibraryManager, BOOKS_FILE, MEMBERS_FILE, EMPRUNTS_FILE, DATEFMT
-from datetime import datetime,timedelta
-import csv
+from virtual_table import VirtualTable
+from reports import (format_book_row, format_member_row, format_emprunt_row, format_reservation_row,
+                     report_lines, analytics_lines, overdue_lines, write_report_csv, write_report_pdf)
+from task_runner import TaskRunner
+from datetime import datetime
 
 from tkinter import filedialog, messagebox
-from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
-from matplotlib.figure import Figure
-import matplotlib.pyplot as plt
 
 import os 
-from reportlab.lib.pagesizes import A4
-from reportlab.pdfgen import canvas as pdfcanvas
+
+# tkcalendar, matplotlib and reportlab are imported where they are first used:
+# together they cost more at startup than the rest of the application.
+
+startup_times = [("imports", time.perf_counter())]
+
+def mark_startup(phase):
+    startup_times.append((phase, time.perf_counter()))
+
+def print_startup_report():
+    # run with --startup-report; python -X importtime gives the per-module import breakdown
+    prev = STARTUP_T0
+    print("Startup timing:", file=sys.stderr)
+    for phase, t in startup_times:
+        print(f"  {phase:<22} {(t - prev) * 1000:8.1f} ms", file=sys.stderr)
+        prev = t
+    print(f"  {'total':<22} {(prev - STARTUP_T0) * 1000:8.1f} ms", file=sys.stderr)
 
 
 mgr = LibraryManager()
+mark_startup("load library")
 
 BUTTON_BG = "#2a6fdb" 
 BUTTON_FG = "white"   
@@ -26,28 +45,6 @@ HEADER_FG = "white"
 PRIMARY_COLOR = "#4CAF50" 
 DANGER_COLOR = "#E53935"
 
-def format_book_row(book):
-   
-    dispo_text = f"{book.disponibility} {'✔️' if book.disponibility else '❌'}"
-    return (
-        book.title,
-        book.author,
-        book.isbn,
-        book.year,
-        dispo_text,
-        book.borrow_count,
-        ", ".join(book.reservations)
-    )
-
-
-def format_member_row(member):
-    return (member.nom, member.prenom, member.email, member.phone, member.date_inscription)
-
-
-def format_emprunt_row(e):
-    return (e.emprunt_id, e.book_isbn, e.member_email, e.date_emprunt, e.date_due, e.date_return or "", e.status)
-
-
 app = tk.Tk()
 app.title("Gestion Bibliothèque")
 app.geometry("1000x650")
@@ -68,62 +65,89 @@ nb = ttk.Notebook(app)
 nb.pack(fill="both", expand=True)
 
 
-tab_books = ttk.Frame(nb)
-nb.add(tab_books, text="Livres")
+# Tabs are built and filled the first time they are selected.
+lazy_tabs = {}
+
+def add_lazy_tab(text, build, refresh):
+    frame = ttk.Frame(nb)
+    nb.add(frame, text=text)
+    lazy_tabs[str(frame)] = {"frame": frame, "build": build, "refresh": refresh, "built": False}
+    return frame
+
+def ensure_tab(name):
+    tab = lazy_tabs.get(name)
+    if tab and not tab["built"]:
+        tab["build"](tab["frame"])
+        tab["built"] = True
+        tab["refresh"]()
+
+def tab_built(frame):
+    return lazy_tabs[str(frame)]["built"]
+
+nb.bind("<<NotebookTabChanged>>", lambda e: ensure_tab(nb.select()))
+
 
-frame_counters_books = tk.Frame(tab_books)
-frame_counters_books.pack(fill="x", pady=5)
+def build_books_tab(tab_books):
+    global lbl_total_books, lbl_dispo_books, lbl_empruntes_books, books_table, tree_books, filter_var
 
-lbl_total_books = tk.Label(frame_counters_books, text="📘 Total livres : 0",
-                           font=("Arial", 11, "bold"), fg="#2196F3")
-lbl_total_books.pack(side="left", padx=20)
+    frame_counters_books = tk.Frame(tab_books)
+    frame_counters_books.pack(fill="x", pady=5)
 
-lbl_dispo_books = tk.Label(frame_counters_books, text="📕 Disponibles : 0",
-                           font=("Arial", 11, "bold"), fg="#4CAF50")
-lbl_dispo_books.pack(side="left", padx=20)
+    lbl_total_books = tk.Label(frame_counters_books, text="📘 Total livres : 0",
+                               font=("Arial", 11, "bold"), fg="#2196F3")
+    lbl_total_books.pack(side="left", padx=20)
 
-lbl_empruntes_books = tk.Label(frame_counters_books, text="🔒 Empruntés : 0",
-                               font=("Arial", 11, "bold"), fg="#E53935")
-lbl_empruntes_books.pack(side="left", padx=20)
+    lbl_dispo_books = tk.Label(frame_counters_books, text="📕 Disponibles : 0",
+                               font=("Arial", 11, "bold"), fg="#4CAF50")
+    lbl_dispo_books.pack(side="left", padx=20)
 
-books_cols = ("Titre", "Auteur", "ISBN", "Année", "Disponible", "N° Emprunte", "Réservations")
-tree_books = ttk.Treeview(tab_books, columns=books_cols, show="headings")
-for c in books_cols:
-    tree_books.heading(c, text=c, anchor="center")
-    tree_books.column(c, width=140, anchor="center")
-tree_books.pack(fill="both", expand=True, padx=10, pady=10)
+    lbl_empruntes_books = tk.Label(frame_counters_books, text="🔒 Empruntés : 0",
+                                   font=("Arial", 11, "bold"), fg="#E53935")
+    lbl_empruntes_books.pack(side="left", padx=20)
 
+    books_cols = ("Titre", "Auteur", "ISBN", "Année", "Disponible", "N° Emprunte", "Réservations")
+    books_table = VirtualTable(tab_books, books_cols, width=140)
+    tree_books = books_table.tree
+    books_table.pack(fill="both", expand=True, padx=10, pady=10)
 
-filter_frame = tk.Frame(tab_books)
-filter_frame.pack(pady=10)
 
-tk.Label(filter_frame, text="Filtrer par disponibilité :").pack(side="left", padx=6)
+    filter_frame = tk.Frame(tab_books)
+    filter_frame.pack(pady=10)
 
-filter_var = tk.StringVar()
-filter_combobox = ttk.Combobox(filter_frame, textvariable=filter_var, values=["Tous", "Disponible", "Emprunté"])
-filter_combobox.set("Tous")  
-filter_combobox.pack(side="left", padx=6)
+    tk.Label(filter_frame, text="Filtrer par disponibilité :").pack(side="left", padx=6)
+
+    filter_var = tk.StringVar()
+    filter_combobox = ttk.Combobox(filter_frame, textvariable=filter_var, values=["Tous", "Disponible", "Emprunté"])
+    filter_combobox.set("Tous")
+    filter_combobox.pack(side="left", padx=6)
+    filter_combobox.bind("<<ComboboxSelected>>", lambda e: filter_books())
+
+    btn_frame_books = tk.Frame(tab_books)
+    btn_frame_books.pack(pady=6)
+    tk.Button(btn_frame_books, text="📚 Ajouter livre", bg=PRIMARY_COLOR, fg=BUTTON_FG, command=add_book_window).pack(side="left", padx=6)
+    tk.Button(btn_frame_books, text="❌ Supprimer livre", bg=DANGER_COLOR, fg=BUTTON_FG, command=delete_book).pack(side="left", padx=6)
+    tk.Button(btn_frame_books, text="🔍 Rechercher", bg=BUTTON_BG, fg=BUTTON_FG, command=lambda: search_book_window()).pack(side="left", padx=6)
 
 
 def filter_books():
     selected_filter = filter_var.get()
     refresh_books(selected_filter)  
-filter_combobox.bind("<<ComboboxSelected>>", lambda e: filter_books()) 
 
 
 
+def book_matches_filter(book, selected_filter):
+    if selected_filter == "Disponible":
+        return book.disponibility
+    if selected_filter == "Emprunté":
+        return not book.disponibility
+    return True
+
 def refresh_books(selected_filter="Tous"):
-    for r in tree_books.get_children():
-        tree_books.delete(r)
-    
-    
-    for b in mgr.books.values():
-        if selected_filter == "Tous":
-            tree_books.insert("", "end", values=format_book_row(b))
-        elif selected_filter == "Disponible" and b.disponibility:
-            tree_books.insert("", "end", values=format_book_row(b))
-        elif selected_filter == "Emprunté" and not b.disponibility:
-            tree_books.insert("", "end", values=format_book_row(b))
+    if not tab_built(tab_books):
+        return
+    # only the rows on screen are built, see VirtualTable
+    keys = [isbn for isbn, b in mgr.books.items() if book_matches_filter(b, selected_filter)]
+    books_table.set_rows(keys, lambda isbn: format_book_row(mgr.books[isbn]))
 
 def add_book_window():
     w = tk.Toplevel(app)
@@ -138,7 +162,6 @@ def add_book_window():
     def on_add():
         try:
             mgr.add_book(entries["Titre"].get(), entries["Auteur"].get(), entries["ISBN"].get(), entries["Année"].get())
-            refresh_books()
             w.destroy()
         except Exception as ex:
             messagebox.showerror("Erreur", str(ex))
@@ -153,43 +176,43 @@ def delete_book():
     isbn = vals[2]
     try:
         mgr.remove_book(isbn)
-        refresh_books()
         messagebox.showinfo("OK", "Livre supprimé")
     except Exception as ex:
         messagebox.showerror("Erreur", str(ex))
 
-btn_frame_books = tk.Frame(tab_books)
-btn_frame_books.pack(pady=6)
-tk.Button(btn_frame_books, text="📚 Ajouter livre", bg=PRIMARY_COLOR, fg=BUTTON_FG, command=add_book_window).pack(side="left", padx=6)
-tk.Button(btn_frame_books, text="❌ Supprimer livre", bg=DANGER_COLOR, fg=BUTTON_FG, command=delete_book).pack(side="left", padx=6)
-tk.Button(btn_frame_books, text="🔍 Rechercher", bg=BUTTON_BG, fg=BUTTON_FG, command=lambda: search_book_window()).pack(side="left", padx=6)
-
 def search_book_window():
     q = simpledialog.askstring("Recherche livre", "Titre / Auteur / ISBN :")
     if not q:
         return
-    res = mgr.search_books(q)
+    res = mgr.search_books(q, limit=50)
     txt = "\n".join([f"{b.title} — {b.author} — {b.isbn} — {'dispo' if b.disponibility else 'emprunté'}" for b in res]) or "Aucun résultat"
     messagebox.showinfo("Résultats", txt)
 
 
 
 
-tab_members = ttk.Frame(nb)
-nb.add(tab_members, text="Membres")
+def build_members_tab(tab_members):
+    global tree_members
+
+    mem_cols = ("Nom","Prénom","Email","Téléphone","Date inscription")
+    tree_members = ttk.Treeview(tab_members, columns=mem_cols, show="headings")
+    for c in mem_cols:
+        tree_members.heading(c, text=c, anchor="center")
+        tree_members.column(c, width=160, anchor="center")
+    tree_members.pack(fill="both", expand=True, padx=10, pady=10)
 
-mem_cols = ("Nom","Prénom","Email","Téléphone","Date inscription")
-tree_members = ttk.Treeview(tab_members, columns=mem_cols, show="headings")
-for c in mem_cols:
-    tree_members.heading(c, text=c, anchor="center")
-    tree_members.column(c, width=160, anchor="center")
-tree_members.pack(fill="both", expand=True, padx=10, pady=10)
+    btn_frame_mem = tk.Frame(tab_members)
+    btn_frame_mem.pack(pady=6)
+    tk.Button(btn_frame_mem, text="Ajouter membre", command=add_member_window, bg=PRIMARY_COLOR, fg=BUTTON_FG).pack(side="left", padx=6)
+    tk.Button(btn_frame_mem, text="Supprimer membre", command=delete_member, bg=DANGER_COLOR, fg=BUTTON_FG).pack(side="left", padx=6)
 
 def refresh_members():
+    if not tab_built(tab_members):
+        return
     for r in tree_members.get_children():
         tree_members.delete(r)
     for m in mgr.list_members():
-        tree_members.insert("", "end", values=format_member_row(m))
+        tree_members.insert("", "end", iid=m.email, values=format_member_row(m))
 
 def add_member_window():
     w = tk.Toplevel(app)
@@ -204,7 +227,6 @@ def add_member_window():
     def on_add():
         try:
             mgr.add_member(entries["Nom"].get(), entries["Prénom"].get(), entries["Email"].get(), entries["Téléphone"].get())
-            refresh_members()
             w.destroy()
         except Exception as ex:
             messagebox.showerror("Erreur", str(ex))
@@ -219,58 +241,68 @@ def delete_member():
     email = vals[2]
     try:
         mgr.remove_member(email)
-        refresh_members()
         messagebox.showinfo("OK", "Membre supprimé")
     except Exception as ex:
         messagebox.showerror("Erreur", str(ex))
 
-btn_frame_mem = tk.Frame(tab_members)
-btn_frame_mem.pack(pady=6)
-tk.Button(btn_frame_mem, text="Ajouter membre", command=add_member_window, bg=PRIMARY_COLOR, fg=BUTTON_FG).pack(side="left", padx=6)
-tk.Button(btn_frame_mem, text="Supprimer membre", command=delete_member, bg=DANGER_COLOR, fg=BUTTON_FG).pack(side="left", padx=6)
 
+def build_emprunts_tab(tab_emprunts):
+    global lbl_dispo, lbl_empruntes, lbl_retards, emprunts_table, tree_emprunts
+
+    frame_counters = tk.Frame(tab_emprunts)
+    frame_counters.pack(fill="x", pady=5)
 
-tab_emprunts = ttk.Frame(nb)
-nb.add(tab_emprunts, text="Emprunts")
-frame_counters = tk.Frame(tab_emprunts)
-frame_counters.pack(fill="x", pady=5)
+    lbl_dispo = tk.Label(frame_counters, text="📘 Disponibles : 0", font=("Arial", 11, "bold"), fg="#4CAF50")
+    lbl_dispo.pack(side="left", padx=20)
 
-lbl_dispo = tk.Label(frame_counters, text="📘 Disponibles : 0", font=("Arial", 11, "bold"), fg="#4CAF50")
-lbl_dispo.pack(side="left", padx=20)
+    lbl_empruntes = tk.Label(frame_counters, text="🔒 Empruntés : 0", font=("Arial", 11, "bold"), fg="#FF9800")
+    lbl_empruntes.pack(side="left", padx=20)
 
-lbl_empruntes = tk.Label(frame_counters, text="🔒 Empruntés : 0", font=("Arial", 11, "bold"), fg="#FF9800")
-lbl_empruntes.pack(side="left", padx=20)
+    lbl_retards = tk.Label(frame_counters, text="⚠️ Retards : 0", font=("Arial", 11, "bold"), fg="#E53935")
+    lbl_retards.pack(side="left", padx=20)
 
-lbl_retards = tk.Label(frame_counters, text="⚠️ Retards : 0", font=("Arial", 11, "bold"), fg="#E53935")
-lbl_retards.pack(side="left", padx=20)
 
+    emp_cols = ("ID","ISBN","Email membre","Date emprunt","Date due","Date retour","Statut")
+    emprunts_table = VirtualTable(tab_emprunts, emp_cols, width=140)
+    tree_emprunts = emprunts_table.tree
+    emprunts_table.pack(fill="both", expand=True, padx=10, pady=10)
 
-emp_cols = ("ID","ISBN","Email membre","Date emprunt","Date due","Date retour","Statut")
-tree_emprunts = ttk.Treeview(tab_emprunts, columns=emp_cols, show="headings")
-for c in emp_cols:
-    tree_emprunts.heading(c, text=c, anchor="center")
-    tree_emprunts.column(c, width=140, anchor="center")
-tree_emprunts.pack(fill="both", expand=True, padx=10, pady=10)
+    btn_frame_emp = tk.Frame(tab_emprunts)
+    btn_frame_emp.pack(pady=6)
+    tk.Button(btn_frame_emp, text="Emprunter", command=borrow_window, bg=PRIMARY_COLOR, fg=BUTTON_FG).pack(side="left", padx=6)
+    tk.Button(btn_frame_emp, text="Retour", command=return_window, bg=DANGER_COLOR, fg=BUTTON_FG).pack(side="left", padx=6)
+    tk.Button(btn_frame_emp, text="📅 Filtrer par date", command=filter_emprunts_window, bg="#FFA500", fg="white").pack(side="left", padx=6)
 
 def refresh_emprunts():
-    for r in tree_emprunts.get_children():
-        tree_emprunts.delete(r)
-    for e in mgr.emprunts.values():
-        tree_emprunts.insert("", "end", values=format_emprunt_row(e))
-    update_counters()
+    if not tab_built(tab_emprunts):
+        return
+    global emprunts_filter
+    emprunts_filter = None
+    def show(_):
+        emprunts_table.set_rows(list(mgr.emprunts), format_emprunt_row_by_id)
+        update_counters()
+    # the first call reads the whole loan history from disk
+    runner.submit("history", lambda task: mgr.load_history(), show)
+
+def format_emprunt_row_by_id(emprunt_id):
+    return format_emprunt_row(mgr.emprunts[emprunt_id])
 
 def update_counters():
-    total_dispo = sum(1 for b in mgr.books.values() if b.disponibility)
-    total_empruntes = sum(1 for b in mgr.books.values() if not b.disponibility)
-    total_retards = len(mgr.overdue_emprunts())
+    if not tab_built(tab_emprunts):
+        return
+    total_dispo = mgr.available_count()
+    total_empruntes = len(mgr.books) - total_dispo
+    total_retards = mgr.overdue_count()
 
     lbl_dispo.config(text=f"📘 Disponibles : {total_dispo}")
     lbl_empruntes.config(text=f"🔒 Empruntés : {total_empruntes}")
     lbl_retards.config(text=f"⚠️ Retards : {total_retards}")
 
 def update_book_counters():
+    if not tab_built(tab_books):
+        return
     total = len(mgr.books)
-    dispo = sum(1 for b in mgr.books.values() if b.disponibility)
+    dispo = mgr.available_count()
     empruntes = total - dispo
 
     lbl_total_books.config(text=f"📘 Total livres : {total}")
@@ -285,6 +317,7 @@ def borrow_window():
     for i,l in enumerate(labels):
         tk.Label(w, text=l).grid(row=i, column=0, padx=5, pady=5)
         if l == "Date emprunt":
+            from tkcalendar import DateEntry
             ent = DateEntry(w)
         else:
             ent = tk.Entry(w)
@@ -301,10 +334,10 @@ def borrow_window():
         try:
             res = mgr.borrow_book(isbn, email, days)
             if isinstance(res, dict) and res.get("reserved"):
-                messagebox.showinfo("Réservé", "Le livre n'est pas disponible: vous avez été ajouté(e) à la file de réservation.")
+                messagebox.showinfo("Réservé", "Le livre n'est pas disponible: vous avez été ajouté(e) à la file de réservation "
+                                    f"(position n°{res['position']}).")
             else:
                 messagebox.showinfo("OK", f"Emprunt créé. ID: {res.emprunt_id}")
-            refresh_books(); refresh_emprunts()
             w.destroy()
         except Exception as ex:
             messagebox.showerror("Erreur", str(ex))
@@ -322,16 +355,17 @@ def return_window():
             messagebox.showinfo("OK", f"Livre retourné. Date retour: {empr.date_return}")
             # if there are reservations, inform who is next
             book = mgr.books.get(empr.book_isbn)
-            if book and book.reservations:
-                next_email = book.reservations[0]
-                messagebox.showinfo("Réservation", f"Le livre est réservé au membre: {next_email}")
-            refresh_books(); refresh_emprunts()
+            if book and book.held_for:
+                next_email = book.held_for
+                messagebox.showinfo("Réservation", f"Le livre est réservé au membre: {next_email} (jusqu'au {book.hold_until})")
             w.destroy()
         except Exception as ex:
             messagebox.showerror("Erreur", str(ex))
     tk.Button(w, text="Retourner", command=on_return, bg=DANGER_COLOR, fg=BUTTON_FG).grid(row=1, column=0, columnspan=2, pady=8)
 
 def filter_emprunts_window():
+    from tkcalendar import DateEntry
+
     w = tk.Toplevel(app)
     w.title("Filtrer les emprunts par date")
     w.geometry("300x150")
@@ -345,48 +379,44 @@ def filter_emprunts_window():
     end_date.grid(row=1, column=1, padx=5, pady=5)
 
     def on_filter():
+        global emprunts_filter
         start = datetime.combine(start_date.get_date(), datetime.min.time())
         end = datetime.combine(end_date.get_date(), datetime.max.time())
     
-        for r in tree_emprunts.get_children():
-            tree_emprunts.delete(r)
-      
-        for e in mgr.emprunts.values():
-            e_date = datetime.strptime(e.date_emprunt, DATEFMT)
-            if start <= e_date <= end:
-                tree_emprunts.insert("", "end", values=format_emprunt_row(e))
+        emprunts_filter = lambda e: start <= datetime.strptime(e.date_emprunt, DATEFMT) <= end
+        keys = [e.emprunt_id for e in mgr.all_emprunts() if emprunts_filter(e)]
+        emprunts_table.set_rows(keys, format_emprunt_row_by_id)
         w.destroy()
 
     tk.Button(w, text="Filtrer", command=on_filter, bg=PRIMARY_COLOR, fg=BUTTON_FG).grid(row=2, column=0, columnspan=2, pady=10)
 
 
-btn_frame_emp = tk.Frame(tab_emprunts)
-btn_frame_emp.pack(pady=6)
-tk.Button(btn_frame_emp, text="Emprunter", command=borrow_window, bg=PRIMARY_COLOR, fg=BUTTON_FG).pack(side="left", padx=6)
-tk.Button(btn_frame_emp, text="Retour", command=return_window, bg=DANGER_COLOR, fg=BUTTON_FG).pack(side="left", padx=6)
-tk.Button(btn_frame_emp, text="📅 Filtrer par date", command=filter_emprunts_window, bg="#FFA500", fg="white").pack(side="left", padx=6)
-
 
 
 
 
+def build_reservations_tab(tab_res):
+    global tree_res
 
-tab_res = ttk.Frame(nb)
-nb.add(tab_res, text="Réservations")
+    res_cols = ("ISBN","Titre","Queue (emails)")
+    tree_res = ttk.Treeview(tab_res, columns=res_cols, show="headings")
+    for c in res_cols:
+        tree_res.heading(c, text=c, anchor="center")
+        tree_res.column(c, width=300, anchor="center")
+    tree_res.pack(fill="both", expand=True, padx=10, pady=10)
 
-res_cols = ("ISBN","Titre","Queue (emails)")
-tree_res = ttk.Treeview(tab_res, columns=res_cols, show="headings")
-for c in res_cols:
-    tree_res.heading(c, text=c, anchor="center")
-    tree_res.column(c, width=300, anchor="center")
-tree_res.pack(fill="both", expand=True, padx=10, pady=10)
+    btn_frame_res = tk.Frame(tab_res)
+    btn_frame_res.pack(pady=6)
+    tk.Button(btn_frame_res, text="Nouveau réservation", command=reserve_window, bg=PRIMARY_COLOR, fg=BUTTON_FG).pack(side="left", padx=6)
+    tk.Button(btn_frame_res, text="Refresh", command=refresh_reservations, bg=BUTTON_BG, fg=BUTTON_FG).pack(side="left", padx=6)
 
 def refresh_reservations():
+    if not tab_built(tab_res):
+        return
     for r in tree_res.get_children():
         tree_res.delete(r)
-    for b in mgr.books.values():
-        if b.reservations:
-            tree_res.insert("", "end", values=(b.isbn, b.title, ", ".join(b.reservations)))
+    for b in mgr.reserved_books():
+        tree_res.insert("", "end", iid=b.isbn, values=format_reservation_row(b))
 
 def reserve_window():
     w = tk.Toplevel(app)
@@ -397,60 +427,45 @@ def reserve_window():
     e2 = tk.Entry(w); e2.grid(row=1, column=1)
     def on_reserve():
         try:
-            mgr.reserve_book(e1.get(), e2.get())
-            messagebox.showinfo("OK","Réservation enregistrée")
-            refresh_reservations()
+            position = mgr.reserve_book(e1.get(), e2.get())
+            messagebox.showinfo("OK", f"Réservation enregistrée (position n°{position})")
             w.destroy()
         except Exception as ex:
             messagebox.showerror("Erreur", str(ex))
     tk.Button(w, text="Réserver", command=on_reserve, bg=PRIMARY_COLOR, fg=BUTTON_FG).grid(row=2, column=0, columnspan=2, pady=6)
 
-btn_frame_res = tk.Frame(tab_res)
-btn_frame_res.pack(pady=6)
-tk.Button(btn_frame_res, text="Nouveau réservation", command=reserve_window, bg=PRIMARY_COLOR, fg=BUTTON_FG).pack(side="left", padx=6)
-tk.Button(btn_frame_res, text="Refresh", command=refresh_reservations, bg=BUTTON_BG, fg=BUTTON_FG).pack(side="left", padx=6)
-
 
 
-tab_reports = ttk.Frame(nb)
-nb.add(tab_reports, text="Rapports")
+def build_reports_tab(tab_reports):
+    global txt_report
 
+    txt_report = tk.Text(tab_reports, wrap="word")
+    txt_report.pack(fill="both", expand=True, padx=10, pady=10)
 
+    btn_frame_rep = tk.Frame(tab_reports)
+    btn_frame_rep.pack(pady=6)
+    tk.Button(btn_frame_rep, text="Générer rapport", command=refresh_reports, bg=BUTTON_BG, fg=BUTTON_FG).pack(side="left", padx=6)
+    tk.Button(btn_frame_rep, text="Exporter CSV", command=export_report_csv, bg="#FFA500", fg="white").pack(side="left", padx=6)
+    tk.Button(btn_frame_rep, text="Exporter PDF", command=export_report_pdf, bg="#FF5733", fg="white").pack(side="left", padx=6)
+    tk.Button(btn_frame_rep, text="Exporter données", command=export_data_window, bg="#FFA500", fg="white").pack(side="left", padx=6)
+    tk.Button(btn_frame_rep, text="Analyse historique", command=show_loan_analytics, bg=BUTTON_BG, fg=BUTTON_FG).pack(side="left", padx=6)
 
-txt_report = tk.Text(tab_reports, wrap="word")
-txt_report.pack(fill="both", expand=True, padx=10, pady=10)
 
 
 
+def show_loan_analytics():
+    if not tab_built(tab_reports):
+        return
+    runner.submit("analytics", lambda task: analytics_lines(mgr, task.progress), lambda lines: txt_report.insert("end", "\n".join(lines)),
+                  lambda e: messagebox.showerror("Erreur", str(e)))
 
 def refresh_reports():
-    st = mgr.stats()
-    lines = []
-    lines.append(f"Total livres: {st['total_books']}")
-    lines.append(f"Total membres: {st['total_members']}")
-    lines.append(f"Total emprunts (historique): {st['total_emprunts']}")
-    lines.append("\nTop 5 livres les plus empruntés:")
-    for b in st["top_books"]:
-        lines.append(f" - {b.title} ({b.borrow_count} emprunts)")
-    lines.append("\nTop membres (par nombre d'emprunts):")
-    for email, ct in st["top_members"]:
-        member = mgr.members.get(email)
-        name = f"{member.prenom} {member.nom}" if member else email
-        lines.append(f" - {name} ({ct})")
-    lines.append("\nEmprunts en cours:")
-    for e in mgr.overdue_emprunts():
-        book = mgr.books.get(e.book_isbn)
-        member = mgr.members.get(e.member_email)
-
-        book_name = book.title if book else "???"
-        member_name = f"{member.prenom} {member.nom}" if member else e.member_email
-        lines.append(
-        f" - ID {e.emprunt_id} | Livre: {book_name} | \n"
-        f"Membre: {member_name} | Emprunté le: {e.date_emprunt} | Due: {e.date_due}\n"
-        f"Contact information :{member.phone}| {member.email}\n"
-        f"_______________________________________________________________________________________\n")
-    txt_report.delete("1.0", "end")
-    txt_report.insert("1.0", "\n".join(lines))
+    if not tab_built(tab_reports):
+        return
+    def show(lines):
+        txt_report.delete("1.0", "end")
+        txt_report.insert("1.0", "\n".join(lines))
+    runner.submit("reports", lambda task: report_lines(mgr, task.progress), show)
 
 
 def export_report_csv():
@@ -458,114 +473,74 @@ def export_report_csv():
                                              filetypes=[("CSV files", "*.csv")])
     if not file_path:
         return
-    try:
-        st = mgr.stats()
-        with open(file_path, "w", newline="", encoding="utf-8") as f:
-            writer = csv.writer(f)
-     
-            writer.writerow(["Total livres", st["total_books"]])
-            writer.writerow(["Total membres", st["total_members"]])
-            writer.writerow(["Total emprunts (historique)", st["total_emprunts"]])
-            writer.writerow([])
-
-       
-            writer.writerow(["Top 5 livres les plus empruntés"])
-            writer.writerow(["Titre","Nombre d'emprunts"])
-            for b in st["top_books"]:
-                writer.writerow([b.title, b.borrow_count])
-            writer.writerow([])
-
-        
-            writer.writerow(["Top membres (par nombre d'emprunts)"])
-            writer.writerow(["Membre","Nombre d'emprunts"])
-            for email, ct in st["top_members"]:
-                member = mgr.members.get(email)
-                name = f"{member.prenom} {member.nom}" if member else email
-                writer.writerow([name, ct])
-            writer.writerow([])
-
-       
-            writer.writerow(["Emprunts en cours"])
-            writer.writerow(["ID","Livre","Membre","Date emprunt","Date due","Contact"])
-            for e in mgr.overdue_emprunts():
-                book = mgr.books.get(e.book_isbn)
-                member = mgr.members.get(e.member_email)
-                book_name = book.title if book else "???"
-                member_name = f"{member.prenom} {member.nom}" if member else e.member_email
-                writer.writerow([e.emprunt_id, book_name, member_name, e.date_emprunt, e.date_due, f"{member.phone if member else ''} | {member.email if member else ''}"])
-        messagebox.showinfo("Succès", "Rapport exporté en CSV !")
-    except Exception as e:
-        messagebox.showerror("Erreur", str(e))
-
-
-btn_frame_rep = tk.Frame(tab_reports)
-btn_frame_rep.pack(pady=6)
-tk.Button(btn_frame_rep, text="Générer rapport", command=refresh_reports, bg=BUTTON_BG, fg=BUTTON_FG).pack(side="left", padx=6)
-tk.Button(btn_frame_rep, text="Exporter CSV", command=export_report_csv, bg="#FFA500", fg="white").pack(side="left", padx=6)
+    runner.submit("export_csv", lambda task: write_report_csv(mgr, file_path, task.progress),
+                  lambda _: messagebox.showinfo("Succès", "Rapport exporté en CSV !"),
+                  lambda e: messagebox.showerror("Erreur", str(e)))
+
+def export_data_window():
+    import export
+
+    w = tk.Toplevel(app)
+    w.title("Exporter les données")
+    tables = {"Livres": "books", "Membres": "members", "Historique des emprunts": "emprunts", "Emprunts en retard": "overdue"}
+    tk.Label(w, text="Table").grid(row=0, column=0, padx=5, pady=5)
+    table_var = tk.StringVar(value="Historique des emprunts")
+    ttk.Combobox(w, textvariable=table_var, values=list(tables), state="readonly").grid(row=0, column=1, padx=5, pady=5)
+    gzip_var = tk.BooleanVar(value=False)
+    tk.Checkbutton(w, text="Compresser (gzip)", variable=gzip_var).grid(row=1, column=0, columnspan=2)
+
+    def on_export():
+        compress = gzip_var.get()
+        file_path = filedialog.asksaveasfilename(defaultextension=".csv.gz" if compress else ".csv",
+                                                 filetypes=[("CSV files", "*.csv *.csv.gz")])
+        if not file_path:
+            return
+        table = tables[table_var.get()]
+        w.destroy()
+        runner.submit("export_" + table,
+                      lambda task: export.export_table(mgr, table, file_path, compress,
+                                                       lambda done, total: task.progress(done / max(total, 1), f"Export {table}")),
+                      lambda count: messagebox.showinfo("Succès", f"{count} lignes exportées\nChemin : {file_path}"),
+                      lambda e: messagebox.showerror("Erreur", str(e)))
+    tk.Button(w, text="Exporter", command=on_export, bg=PRIMARY_COLOR, fg=BUTTON_FG).grid(row=2, column=0, columnspan=2, pady=8)
 
 def export_report_pdf():
     file_path = filedialog.asksaveasfilename(defaultextension=".pdf",
                                              filetypes=[("PDF files", "*.pdf")])
     if not file_path:
         return
-    try:
-        report_text = txt_report.get("1.0", "end").strip()
-        if not report_text:
-            messagebox.showwarning("Avertissement", "Le rapport est vide !")
-            return
-
-       
-        c = pdfcanvas.Canvas(file_path, pagesize=A4)  
-        width, height = A4
-        c.setFont("Helvetica", 12)
-
-       
-        c.drawString(100, height - 50, "Rapport de bibliothèque")
-
-        
-        lines = report_text.split("\n")
-        y = height - 80  
-
-        for line in lines:
-            if y < 50:  
-                c.showPage()
-                c.setFont("Helvetica", 12)
-                y = height - 50
-            c.drawString(40, y, line)
-            y -= 18
-
-        c.save()  
-        messagebox.showinfo("Succès", f"Rapport exporté en PDF !\nChemin : {file_path}")
-
-    except Exception as e:
-        messagebox.showerror("Erreur", str(e))
-tk.Button(btn_frame_rep, text="Exporter PDF", command=export_report_pdf, bg="#FF5733", fg="white").pack(side="left", padx=6)
+    report_text = txt_report.get("1.0", "end").strip()
+    if not report_text:
+        messagebox.showwarning("Avertissement", "Le rapport est vide !")
+        return
+    runner.submit("export_pdf", lambda task: write_report_pdf(file_path, report_text, task.progress),
+                  lambda _: messagebox.showinfo("Succès", f"Rapport exporté en PDF !\nChemin : {file_path}"),
+                  lambda e: messagebox.showerror("Erreur", str(e)))
 
+def build_performances_tab(tab_performances):
+    global frame_graph, lbl_pred
 
-tab_performances = ttk.Frame(nb)
-nb.add(tab_performances, text="🚀 Performances")
+    frame_graph = tk.Frame(tab_performances)
+    frame_graph.pack(fill="both", expand=True, padx=10, pady=10)
 
-frame_graph = tk.Frame(tab_performances)
-frame_graph.pack(fill="both", expand=True, padx=10, pady=10)
+    lbl_pred = tk.Label(tab_performances, text="Prédiction en cours...", font=("Arial", 14, "bold"))
+    lbl_pred.pack(pady=20)
 
-lbl_pred = tk.Label(tab_performances, text="Prédiction en cours...", font=("Arial", 14, "bold"))
-lbl_pred.pack(pady=20)
+    btn_graph = tk.Button(tab_performances, text="📈 Afficher courbe des emprunts",
+                        bg="#2a6fdb", fg="white", command=show_emprunt_curve)
+    btn_graph.pack(pady=10)
 
 
 
 def show_emprunt_curve():
+    import matplotlib.pyplot as plt
+    from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+
     for widget in frame_graph.winfo_children():
         widget.destroy()
 
-    counts = {}
-    for e in mgr.emprunts.values():
-        try:
-            d = datetime.strptime(e.date_emprunt, "%Y-%m-%d")
-            key = d.strftime("%Y-%m")
-            counts[key] = counts.get(key, 0) + 1
-        except:
-            pass
-
+    # kept up to date by LibraryManager, one entry per month
+    counts = dict(mgr.loans_by_month())
     if not counts:
         lbl_pred.config(text="Pas assez de données pour afficher le graphique.")
         return
@@ -588,40 +563,54 @@ def show_emprunt_curve():
 
 
 def refresh_prediction():
-    emprunts_par_mois = {}
-
-   
-    for e in mgr.emprunts.values():
-        try:
-            d = datetime.strptime(e.date_emprunt, "%Y-%m-%d")
-            key = d.strftime("%Y-%m")     # Format YYYY-MM
-            emprunts_par_mois[key] = emprunts_par_mois.get(key, 0) + 1
-        except:
-            pass
-
+    if not tab_built(tab_performances):
+        return
+    global forecaster
+    from forecasting import DemandForecaster
 
-    dernier_mois = datetime.today().replace(day=1)
-    mois_list = [(dernier_mois - timedelta(days=30*i)).strftime("%Y-%m")
-                 for i in reversed(range(3))]
+    if forecaster is None:
+        forecaster = DemandForecaster(mgr)
+    # fitted on complete months: the first forecast is the current month, the second the next one
+    mois, prevision = forecaster.forecast_total(2)[-1]
 
-   
-    emprunts_par_mois_complete = {m: emprunts_par_mois.get(m, 0) for m in mois_list}
+    lbl_pred.config(text=f"📈 Emprunts prévus le mois prochain ({mois}) : {round(prevision)}")
 
-  
-    moyenne = sum(emprunts_par_mois_complete[m] for m in mois_list) // 3
 
+def build_stats_tab(tab_stats):
+    global stats_fig, stats_ax, stats_canvas
+    from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+    from matplotlib.figure import Figure
+    
+    stats_fig = Figure(figsize=(6,4))
+    stats_ax = stats_fig.add_subplot(111)
+    stats_canvas = FigureCanvasTkAgg(stats_fig, master=tab_stats)
+    stats_canvas.get_tk_widget().pack(fill="both", expand=True, padx=10, pady=10)
 
-    lbl_pred.config(text=f"📈 Emprunts prévus le mois prochain : {moyenne}")
+    btn_frame_stats = tk.Frame(tab_stats)
+    btn_frame_stats.pack(pady=4)
+    tk.Button(btn_frame_stats, text="Rafraîchir Statistiques", command=refresh_stats_graph, bg=BUTTON_BG, fg="white").pack(side="left", padx=6)
 
+def refresh_stats_graph():
+    if not tab_built(tab_stats):
+        return
+    runner.submit("stats", lambda task: mgr.stats(), draw_stats_graph)
 
-    
-btn_graph = tk.Button(tab_performances, text="📈 Afficher courbe des emprunts",
-                    bg="#2a6fdb", fg="white", command=show_emprunt_curve)
-btn_graph.pack(pady=10)
+def draw_stats_graph(st):
+    ax = stats_ax
+    ax.clear()
+    top_books = st["top_books"]
+    titles = [b.title if len(b.title) <= 20 else b.title[:17]+"..." for b in top_books]
+    counts = [b.borrow_count for b in top_books]
 
+    ax.bar(range(len(titles)), counts, color="#4CAF50")
+    ax.set_xticks(range(len(titles)))
+    ax.set_xticklabels(titles, rotation=45, ha='right')
 
+    ax.set_title("Top 5 livres les plus empruntés")
+    ax.set_ylabel("Nombre d'emprunts")
 
-refresh_prediction()
+    stats_fig.tight_layout()
+    stats_canvas.draw()
 
 
 def refresh_all():
@@ -633,10 +622,124 @@ def refresh_all():
     update_counters()
     update_book_counters()
     refresh_prediction()
+    refresh_stats_graph()
+
+
+forecaster = None
+
+
+# Mutations patch the rows they touched instead of rebuilding the tables, see LibraryManager.subscribe
+emprunts_filter = None
+
+def patch_tree(tree, key, values):
+    if values is None:
+        if tree.exists(key):
+            tree.delete(key)
+    elif tree.exists(key):
+        tree.item(key, values=values)
+    else:
+        tree.insert("", "end", iid=key, values=values)
+
+def patch_virtual(table, key, obj, visible):
+    if obj is None or not visible:
+        table.remove_key(key)
+    elif key in table:
+        table.update_key(key)
+    else:
+        table.add_key(key)
+
+def on_library_changes(events):
+    if events[0][0] == "reloaded":
+        # another desk's changes could not be replayed one by one
+        refresh_all()
+        return
+    for action, kind, key in events:
+        if kind == "books":
+            book = mgr.books.get(key)
+            if tab_built(tab_books):
+                patch_virtual(books_table, key, book, book is not None and book_matches_filter(book, filter_var.get()))
+            if tab_built(tab_res):
+                patch_tree(tree_res, key, format_reservation_row(book) if book and book.reservations else None)
+        elif kind == "members":
+            member = mgr.members.get(key)
+            if tab_built(tab_members):
+                patch_tree(tree_members, key, format_member_row(member) if member else None)
+        elif kind == "emprunts" and tab_built(tab_emprunts):
+            empr = mgr.emprunts.get(key)
+            visible = empr is not None and (emprunts_filter is None or emprunts_filter(empr))
+            if action == "added" or key in emprunts_table:
+                patch_virtual(emprunts_table, key, empr, visible)
+    update_counters()
+    update_book_counters()
+    if any(kind == "emprunts" and action == "added" for action, kind, _ in events):
+        refresh_prediction()
+
+mgr.subscribe(on_library_changes)
+
+# Other desks may share the data directory: pick up what they committed
+OTHER_DESKS_POLL_MS = 2000
+
+def poll_other_desks():
+    if mgr.has_external_changes():
+        mgr.refresh()
+    app.after(OTHER_DESKS_POLL_MS, poll_other_desks)
+
+app.after(OTHER_DESKS_POLL_MS, poll_other_desks)
+
+HOLD_CHECK_MS = 60000
+
+def expire_holds():
+    # the listeners update the tabs; several desks may run it, each hold expires once
+    try:
+        mgr.expire_holds()
+    except Exception as ex:
+        print(f"expire_holds: {ex!r}", file=sys.stderr)
+    app.after(HOLD_CHECK_MS, expire_holds)
+
+app.after(OTHER_DESKS_POLL_MS, expire_holds)
+
+
+tab_books = add_lazy_tab("Livres", build_books_tab, lambda: (refresh_books(filter_var.get()), update_book_counters()))
+tab_members = add_lazy_tab("Membres", build_members_tab, refresh_members)
+tab_emprunts = add_lazy_tab("Emprunts", build_emprunts_tab, refresh_emprunts)
+tab_res = add_lazy_tab("Réservations", build_reservations_tab, refresh_reservations)
+tab_reports = add_lazy_tab("Rapports", build_reports_tab, refresh_reports)
+tab_performances = add_lazy_tab("🚀 Performances", build_performances_tab, refresh_prediction)
+tab_stats = add_lazy_tab("Statistiques 📊", build_stats_tab, refresh_stats_graph)
 
 tk.Button(app, text="Refresh tout", command=refresh_all, bg="#607D8B", fg=BUTTON_FG).pack(side="bottom", pady=6)
 
 
+# Heavy work runs on worker threads; the status bar shows what is running and can cancel it.
+status_frame = tk.Frame(app)
+status_frame.pack(side="bottom", fill="x", padx=10)
+status_label = tk.Label(status_frame, text="", anchor="w")
+status_label.pack(side="left", fill="x", expand=True)
+btn_cancel = tk.Button(status_frame, text="Annuler", command=lambda: runner.cancel(), bg=DANGER_COLOR, fg=BUTTON_FG)
+status_progress = ttk.Progressbar(status_frame, length=200, mode="determinate", maximum=100)
+
+def show_task_status(tasks):
+    if not tasks:
+        status_label.config(text="")
+        status_progress.stop()
+        status_progress.pack_forget()
+        btn_cancel.pack_forget()
+        return
+    status_label.config(text=" · ".join(t.text or t.name for t in tasks))
+    fractions = [t.fraction for t in tasks if t.fraction is not None]
+    if len(fractions) == len(tasks):
+        status_progress.stop()
+        status_progress.config(mode="determinate", value=100 * min(fractions))
+    elif str(status_progress.cget("mode")) != "indeterminate":
+        status_progress.config(mode="indeterminate")
+        status_progress.start(20)
+    if not status_progress.winfo_ismapped():
+        btn_cancel.pack(side="right", padx=6)
+        status_progress.pack(side="right", pady=4)
+
+runner = TaskRunner(app, on_status=show_task_status)
+
+
 def show_overdue_startup():
     overdue = mgr.overdue_emprunts()
     if not overdue:
@@ -653,30 +756,18 @@ def show_overdue_startup():
     txt = tk.Text(w, wrap="word", font=("Arial", 10))
     txt.pack(fill="both", expand=True, padx=10, pady=10)
 
-    for e in overdue:
-        book = mgr.books.get(e.book_isbn)
-        member = mgr.members.get(e.member_email)
-
-        book_name = book.title if book else "???"
-        member_name = f"{member.prenom} {member.nom}" if member else e.member_email
-
-        txt.insert(
-            "end",
-            f"• ID emprunt : {e.emprunt_id}\n"
-            f"  Livre       : {book_name}\n"
-            f"  Membre      : {member_name}\n"
-            f"___________________________________________________\n"
-        )
+    for line in overdue_lines(mgr):
+        txt.insert("end", line)
 
     tk.Button(w, text="Fermer", command=w.destroy, bg="#607D8B", fg="white").pack(pady=10)
 
 
-refresh_all()
 app.after(500, show_overdue_startup)
 
 
 def on_quit():
-    mgr._save_all()
+    runner.shutdown()
+    mgr.close()
     app.destroy()
 
 app.protocol("WM_DELETE_WINDOW", on_quit)
@@ -739,35 +830,9 @@ tk.Button(app,
           bg="#444444",
           fg="white").pack(side="bottom", pady=4)
 
-tab_stats = ttk.Frame(nb)
-nb.add(tab_stats, text="Statistiques 📊")
-
-fig = Figure(figsize=(6,4))
-ax = fig.add_subplot(111)
-canvas = FigureCanvasTkAgg(fig, master=tab_stats)
-canvas.get_tk_widget().pack(fill="both", expand=True, padx=10, pady=10)
-
-def refresh_stats_graph():
-    ax.clear()
-    st = mgr.stats()
-    top_books = st["top_books"]
-    titles = [b.title if len(b.title) <= 20 else b.title[:17]+"..." for b in top_books]
-    counts = [b.borrow_count for b in top_books]
-
-    ax.bar(range(len(titles)), counts, color="#4CAF50")
-    ax.set_xticks(range(len(titles)))
-    ax.set_xticklabels(titles, rotation=45, ha='right')
-
-    ax.set_title("Top 5 livres les plus empruntés")
-    ax.set_ylabel("Nombre d'emprunts")
-
-    fig.tight_layout()  
-    canvas.draw()
-
-btn_frame_stats = tk.Frame(tab_stats)
-btn_frame_stats.pack(pady=4)
-tk.Button(btn_frame_stats, text="Rafraîchir Statistiques", command=refresh_stats_graph, bg=BUTTON_BG, fg="white").pack(side="left", padx=6)
-
 
-refresh_stats_graph()
+ensure_tab(nb.select())
+mark_startup("build first tab")
+if "--startup-report" in sys.argv:
+    app.after_idle(lambda: (mark_startup("first paint"), print_startup_report()))
 app.mainloop()
@@ -1,67 +1,382 @@
 
 import json
-from datetime import datetime, timedelta
-from collections import defaultdict
+from bisect import bisect_left, insort
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+import functools
+import glob
+import heapq
+import itertools
 import os
+import sys
+import threading
 import uuid
 
+from file_lock import FileLock
+from ranking import Ranking
+from reservation_queue import ReservationQueue
+from search_index import SearchIndex
+from thread_locks import KeyLocks, RWLock
+
 BOOKS_FILE = "books.json"
 MEMBERS_FILE = "members.json"
 EMPRUNTS_FILE = "emprunts.json"
+JOURNAL_FILE = "journal.jsonl"
+# loans per day, written with every snapshot of emprunts.json
+LOAN_DAYS_FILE = "loan_days.json"
+
+# number of journal records after which the snapshot files are rewritten
+COMPACT_EVERY = 1000
+# rows between two progress callbacks of a bulk import
+IMPORT_PROGRESS_EVERY = 10000
+# days a returned book is held for the first member of its reservation queue
+HOLD_DAYS = 3
 
 DATEFMT = "%Y-%m-%d"
 
 
+def parse_date(s):
+    try:
+        return date.fromisoformat(s)
+    except ValueError:
+        return datetime.strptime(s, DATEFMT).date()
+
+
 def load_json(filename):
     if not os.path.exists(filename):
         return []
     with open(filename, "r", encoding="utf-8") as f:
         try:
             return json.load(f)
-        except:
-            return []
+        except ValueError:
+            # never fall back to an empty library: that would be saved over the real data
+            raise ValueError(f"{filename} is corrupted")
+
+
+def iter_json_array(filename, chunk_size=1 << 20):
+    # yields the items of a top-level JSON array without loading the whole file
+    if not os.path.exists(filename):
+        return
+    decoder = json.JSONDecoder()
+    with open(filename, "r", encoding="utf-8") as f:
+        buf = f.read(chunk_size)
+        pos = len(buf) - len(buf.lstrip())
+        if not buf[pos:pos + 1] == "[":
+            raise ValueError(f"{filename} is corrupted")
+        pos += 1
+        while True:
+            while pos < len(buf) and (buf[pos].isspace() or buf[pos] == ","):
+                pos += 1
+            if pos < len(buf) and buf[pos] == "]":
+                return
+            try:
+                if pos == len(buf):
+                    raise ValueError("need more data")
+                item, pos = decoder.raw_decode(buf, pos)
+            except ValueError:
+                more = f.read(chunk_size)
+                if not more:
+                    raise ValueError(f"{filename} is corrupted")
+                buf = buf[pos:] + more
+                pos = 0
+                continue
+            yield item
+
+
+def mentions(filename, needles, chunk_size=1 << 20):
+    # the needles found in the raw text of a file; much faster than decoding it
+    found = set()
+    if not os.path.exists(filename) or not needles:
+        return found
+    overlap = max(len(n) for n in needles) - 1
+    with open(filename, "r", encoding="utf-8") as f:
+        tail = ""
+        while len(found) < len(needles):
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            buf = tail + chunk
+            found.update(n for n in needles if n not in found and n in buf)
+            tail = buf[-overlap:] if overlap else ""
+    return found
 
 
 def save_json(filename, data):
-    with open(filename, "w", encoding="utf-8") as f:
-        json.dump(data, f, indent=4, ensure_ascii=False)
+    # write to a temp file and rename it over the target so a crash never leaves a truncated file.
+    # data may be any iterable of rows; it is written one row at a time.
+    tmp = filename + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write("[")
+        empty = True
+        for row in data:
+            f.write("\n    " if empty else ",\n    ")
+            f.write(json.dumps(row, indent=4, ensure_ascii=False).replace("\n", "\n    "))
+            empty = False
+        f.write("]" if empty else "\n]")
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, filename)
+    fsync_dir(filename)
+
+
+def fsync_dir(filename):
+    if not hasattr(os, "O_DIRECTORY"):
+        return
+    fd = os.open(os.path.dirname(os.path.abspath(filename)), os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def append_journal(f, records):
+    # records written together share one line, so a torn write loses all of them or none.
+    # The caller fsyncs: one fsync may cover the lines of several threads.
+    line = records[0] if len(records) == 1 else {"batch": records}
+    f.write((json.dumps(line, ensure_ascii=False) + "\n").encode("utf-8"))
+    f.flush()
+
+
+def read_journal(filename, offset=0):
+    # (records, offset just past the last complete line) of a journal read from offset on
+    records = []
+    if not os.path.exists(filename):
+        return records, offset
+    with open(filename, "rb") as f:
+        f.seek(offset)
+        for line in f:
+            if not line.endswith(b"\n"):
+                # torn last line after a crash: the record was never acknowledged
+                break
+            if line.strip():
+                try:
+                    rec = json.loads(line)
+                except ValueError:
+                    break
+                if "batch" in rec:
+                    records.extend(rec["batch"])
+                else:
+                    records.append(rec)
+            offset += len(line)
+    return records, offset
+
+
+def read_version(filename, journal_file):
+    # generation of the current journal (the number its segment gets when it is rotated) and of
+    # the journal covered by the snapshot on disk. Without the file (data written before it
+    # existed) every segment is replayed, as it used to be.
+    if os.path.exists(filename):
+        with open(filename, "r", encoding="utf-8") as f:
+            return json.load(f)
+    segments = journal_segments(journal_file)
+    return {"journal": segments[-1][0] if segments else 0, "snapshot": 0}
+
+
+def write_version(filename, version):
+    tmp = filename + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(version, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, filename)
+    fsync_dir(filename)
+
+
+def journal_segments(filename):
+    # rotated journals waiting for their snapshot to hit the disk, oldest first
+    segments = []
+    for path in glob.glob(glob.escape(filename) + ".*"):
+        suffix = path[len(filename) + 1:]
+        if suffix.isdigit():
+            segments.append((int(suffix), path))
+    return sorted(segments)
+
+
+def remove_journal_segments(filename, upto):
+    for n, path in journal_segments(filename):
+        if n <= upto:
+            os.remove(path)
+
+
+class SnapshotWriter:
+    # writes are made holding lock (the data directory lock, shared with the other processes)
+    def __init__(self, lock=None):
+        self.lock = lock or threading.Lock()
+        self._pending = {}
+        self._callbacks = []
+        self._stale = None
+        self._busy = False
+        self.error = None
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name="snapshot-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, files, on_done=None, stale=None):
+        # a save queued before the previous one was written replaces it. stale() is checked under
+        # the lock just before writing: when it returns True a newer snapshot is already on disk
+        # and nothing is written.
+        with self._cond:
+            self._raise_error()
+            self._pending.update(files)
+            if on_done:
+                self._callbacks.append(on_done)
+            self._stale = stale
+            self._cond.notify_all()
+
+    def flush(self):
+        with self._cond:
+            while self._pending or self._busy:
+                self._cond.wait()
+            self._raise_error()
+
+    def _raise_error(self):
+        if self.error:
+            err, self.error = self.error, None
+            raise err
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                files, self._pending = self._pending, {}
+                callbacks, self._callbacks = self._callbacks, []
+                stale, self._stale = self._stale, None
+                self._busy = True
+            try:
+                with self.lock:
+                    if stale is None or not stale():
+                        for filename, data in files.items():
+                            save_json(filename, data)
+                        for cb in callbacks:
+                            cb()
+            except Exception as ex:
+                self.error = ex
+            finally:
+                with self._cond:
+                    self._busy = False
+                    self._cond.notify_all()
+
+
+def to_ordinal(s):
+    # dates are kept as day ordinals; a value that does not parse is kept as the raw string
+    if s is None or isinstance(s, int):
+        return s
+    try:
+        return parse_date(s).toordinal()
+    except ValueError:
+        return s
+
+
+def from_ordinal(v):
+    if isinstance(v, int):
+        # isoformat() gives DATEFMT, several times faster than strftime
+        return date.fromordinal(v).isoformat()
+    return v
+
+
+def required_fields(row, fields):
+    values = []
+    for field in fields:
+        value = str(row.get(field) or "").strip()
+        if not value:
+            raise ValueError(f"missing {field}")
+        values.append(value)
+    return values
+
+
+def month_of(day):
+    # "YYYY-MM" of a date ordinal; None for a date that did not parse
+    if not isinstance(day, int):
+        return None
+    d = date.fromordinal(day)
+    return f"{d.year:04d}-{d.month:02d}"
+
+
+def months_of(days):
+    months = {}
+    for day, count in days.items():
+        month = month_of(day)
+        if month is not None:
+            months[month] = months.get(month, 0) + count
+    return months
+
+
+def intern_key(s):
+    return sys.intern(s) if type(s) is str else s
 
 
 class Book:
-    def __init__(self, title, author, isbn, year, disponibility=True, reservations=None, borrow_count=0):
+    __slots__ = ("title", "author", "isbn", "year", "disponibility", "reservations", "borrow_count", "hold_ordinal",
+                 "held_for")
+
+    def __init__(self, title, author, isbn, year, disponibility=True, reservations=None, borrow_count=0,
+                 reservation_tiers=None, hold_until=None, held_for=None):
         self.title = title
         self.author = author
-        self.isbn = isbn
+        self.isbn = intern_key(isbn)
         self.year = year
         self.disponibility = bool(disponibility)
-        self.reservations = reservations or []  
+        self.reservations = ReservationQueue(reservations or (), reservation_tiers)
         self.borrow_count = borrow_count
+        # a returned book waits until this date for the member it is held for to take it; holds
+        # saved without the member were for the first one in the queue
+        self.hold_until = hold_until
+        self.held_for = None
+        if self.hold_ordinal is not None:
+            self.held_for = intern_key(held_for) if held_for else self.reservations.peek()
+
+    @property
+    def hold_until(self):
+        return from_ordinal(self.hold_ordinal)
+
+    @hold_until.setter
+    def hold_until(self, value):
+        self.hold_ordinal = to_ordinal(value)
 
     def to_dict(self):
-        return {
+        d = {
             "title": self.title,
             "author": self.author,
             "isbn": self.isbn,
             "year": self.year,
             "disponibility": self.disponibility,
-            "reservations": self.reservations,
+            "reservations": self.reservations.to_list(),
             "borrow_count": self.borrow_count
         }
+        tiers = self.reservations.tiers()
+        if tiers:
+            d["reservation_tiers"] = tiers
+        if self.hold_ordinal is not None:
+            d["hold_until"] = self.hold_until
+            d["held_for"] = self.held_for
+        return d
 
     @staticmethod
     def from_dict(d):
         return Book(d["title"], d["author"], d["isbn"], d.get("year", ""), d.get("disponibility", True),
-                    d.get("reservations", []), d.get("borrow_count", 0))
+                    d.get("reservations", []), d.get("borrow_count", 0), d.get("reservation_tiers"),
+                    d.get("hold_until"), d.get("held_for"))
 
 
 class Member:
+    __slots__ = ("nom", "prenom", "email", "phone", "_inscription")
+
     def __init__(self, nom, prenom, email, phone="", date_inscription=None):
         self.nom = nom
         self.prenom = prenom
-        self.email = email
+        self.email = intern_key(email)
         self.phone = phone
         self.date_inscription = date_inscription or datetime.today().strftime(DATEFMT)
 
+    @property
+    def date_inscription(self):
+        return from_ordinal(self._inscription)
+
+    @date_inscription.setter
+    def date_inscription(self, value):
+        self._inscription = to_ordinal(value)
+
     def to_dict(self):
         return {
             "nom": self.nom,
@@ -77,14 +392,41 @@ class Member:
 
 
 class Emprunt:
+    __slots__ = ("emprunt_id", "book_isbn", "member_email", "emprunt_ordinal", "due_ordinal", "return_ordinal",
+                 "status")
+
     def __init__(self, emprunt_id, book_isbn, member_email, date_emprunt, date_due, date_return=None, status="ongoing"):
         self.emprunt_id = emprunt_id
-        self.book_isbn = book_isbn
-        self.member_email = member_email
+        self.book_isbn = intern_key(book_isbn)
+        self.member_email = intern_key(member_email)
         self.date_emprunt = date_emprunt
         self.date_due = date_due
         self.date_return = date_return
-        self.status = status  
+        self.status = intern_key(status)
+
+    @property
+    def date_emprunt(self):
+        return from_ordinal(self.emprunt_ordinal)
+
+    @date_emprunt.setter
+    def date_emprunt(self, value):
+        self.emprunt_ordinal = to_ordinal(value)
+
+    @property
+    def date_due(self):
+        return from_ordinal(self.due_ordinal)
+
+    @date_due.setter
+    def date_due(self, value):
+        self.due_ordinal = to_ordinal(value)
+
+    @property
+    def date_return(self):
+        return from_ordinal(self.return_ordinal)
+
+    @date_return.setter
+    def date_return(self, value):
+        self.return_ordinal = to_ordinal(value)
 
     def to_dict(self):
         return {
@@ -105,179 +447,1065 @@ class Emprunt:
         if self.status != "ongoing":
             return False
         today = datetime.today().date()
-        due = datetime.strptime(self.date_due, DATEFMT).date()
-        return due < today
+        due = self.due_ordinal
+        if not isinstance(due, int):
+            due = parse_date(due).toordinal()
+        return due < today.toordinal()
+
+
+RECORD_TYPES = {"books": Book, "members": Member, "emprunts": Emprunt}
+
+
+class JsonStorage:
+    # Several processes may share the files. Every change is made holding the lock file and after
+    # reading what the others appended to the journal since (read_new); the version file says
+    # which journal generation is current and which one the snapshot on disk covers.
+    # Threads of one process append through append() then sync(): lines are written in order
+    # under _io_lock and one fsync covers every line written before it (group commit).
+    def __init__(self, books_file=BOOKS_FILE, members_file=MEMBERS_FILE, emprunts_file=EMPRUNTS_FILE,
+                 journal_file=JOURNAL_FILE, loan_days_file=LOAN_DAYS_FILE):
+        self.files = {"books": books_file, "members": members_file, "emprunts": emprunts_file,
+                      "loan_days": loan_days_file}
+        self.journal_file = journal_file
+        self.version_file = journal_file + ".version"
+        self._lock = FileLock(journal_file + ".lock")
+        self._journal_size = 0
+        # how far this process has read: journal generation and byte offset in it, and the
+        # lock.taken it was read under
+        self._generation = 0
+        self._offset = 0
+        self._read_under = None
+        self._journal = None   # open for appending
+        self._written = 0      # lines appended by this process, and how many of them are fsynced
+        self._synced = 0
+        self.fsyncs = 0        # for bench.py: lines written / fsyncs is the group commit factor
+        # lock order: _sync_lock, then _io_lock, then _version_lock
+        self._sync_lock = threading.Lock()
+        self._io_lock = threading.Lock()
+        self._version_lock = threading.Lock()
+        self._writer = SnapshotWriter(self._lock)
+
+    def lock(self):
+        return self._lock
+
+    def _version(self):
+        return read_version(self.version_file, self.journal_file)
+
+    def load(self):
+        # the caller holds the lock until it has consumed the snapshot["emprunts"] stream
+        with self._sync_lock, self._io_lock:
+            self._close_journal()
+            version = self._version()
+            snapshot = {kind: load_json(filename) for kind, filename in self.files.items() if kind != "emprunts"}
+            snapshot["emprunts"] = self.iter_emprunts()
+            # mutations made since the last snapshot that reached the disk
+            records = []
+            for n, path in journal_segments(self.journal_file):
+                if n > version["snapshot"]:
+                    records.extend(read_journal(path)[0])
+            journal, self._offset = read_journal(self.journal_file)
+            self._generation = version["journal"]
+            self._journal_size = len(journal)
+            self._read_under = self._lock.taken
+        return snapshot, records + journal
+
+    def has_new(self):
+        # cheap check, without the lock, for records committed by other processes
+        size = os.path.getsize(self.journal_file) if os.path.exists(self.journal_file) else 0
+        return size != self._offset or self._version()["journal"] != self._generation
+
+    def read_new(self):
+        # records committed by other processes since this one last read or wrote, in order; None
+        # when they can no longer be read one by one (a rotated journal was folded into a newer
+        # snapshot and removed) and everything must be loaded again. Called holding the lock, and
+        # never at the same time as append.
+        if self._read_under == self._lock.taken:
+            # the lock was not released since: nobody else wrote
+            return []
+        self._read_under = self._lock.taken
+        current = self._version()["journal"]
+        records = []
+        if self._generation < current:
+            # another process rotated the journal: stop appending to the old one
+            with self._sync_lock, self._io_lock:
+                self._close_journal()
+        while self._generation < current:
+            segment = f"{self.journal_file}.{self._generation + 1}"
+            if not os.path.exists(segment):
+                return None
+            records.extend(read_journal(segment, self._offset)[0])
+            self._generation += 1
+            self._offset = 0
+            self._journal_size = 0
+        with self._io_lock:
+            journal, self._offset = read_journal(self.journal_file, self._offset)
+            self._journal_size += len(journal)
+        return records + journal
+
+    def iter_emprunts(self):
+        return iter_json_array(self.files["emprunts"])
+
+    def find_emprunts(self, emprunt_ids):
+        # {id: row} for the given loans of the snapshot. The file is only decoded when one of the
+        # ids is in it, and up to the last one found.
+        filename = self.files["emprunts"]
+        needles = {json.dumps(i, ensure_ascii=False): i for i in emprunt_ids}
+        wanted = {needles[n] for n in mentions(filename, list(needles))}
+        found = {}
+        if wanted:
+            for e in iter_json_array(filename):
+                if e["emprunt_id"] in wanted:
+                    found[e["emprunt_id"]] = e
+                    if len(found) == len(wanted):
+                        break
+        return found
+
+    def append(self, records):
+        # called holding the lock, after read_new. Returns the ticket to pass to sync().
+        with self._io_lock:
+            if self._journal is None:
+                self._journal = open(self.journal_file, "ab")
+            # anything past the offset is the torn tail of a write by a process that crashed:
+            # cut it so the new line does not follow it
+            if os.fstat(self._journal.fileno()).st_size > self._offset:
+                self._journal.truncate(self._offset)
+            append_journal(self._journal, records)
+            self._offset = self._journal.tell()
+            self._journal_size += len(records)
+            self._written += 1
+            return self._written
+
+    def sync(self, ticket):
+        # returns once the line of that ticket is on disk; a thread that waited here while
+        # another one fsynced usually finds its line already covered
+        with self._sync_lock:
+            if self._synced >= ticket:
+                return
+            with self._io_lock:
+                written = self._written
+                f = self._journal
+            if f is not None:
+                os.fsync(f.fileno())
+                self.fsyncs += 1
+            self._synced = written
+
+    def _close_journal(self):
+        # with _sync_lock and _io_lock held
+        if self._journal is not None:
+            os.fsync(self._journal.fileno())
+            self._journal.close()
+            self._journal = None
+        self._synced = self._written
+
+    def needs_compaction(self):
+        return self._journal_size >= COMPACT_EVERY
+
+    def compact(self, snapshot):
+        if not self._journal_size and not os.path.exists(self.journal_file) and not journal_segments(self.journal_file):
+            # the snapshot on disk is already current
+            return
+        self._write_snapshot(snapshot)
+
+    def bulk_write(self, records, snapshot):
+        # a bulk import goes straight into one snapshot instead of the journal: the files are
+        # replaced atomically, so either every imported record is on disk or none is
+        self._write_snapshot(snapshot)
+        self._writer.flush()
+
+    def _write_snapshot(self, snapshot):
+        # the journal is rotated aside and only deleted once the snapshot that covers it is on disk
+        with self._sync_lock, self._io_lock, self._version_lock:
+            self._close_journal()
+            version = self._version()
+            generation = version["journal"] + 1
+            if os.path.exists(self.journal_file):
+                os.replace(self.journal_file, f"{self.journal_file}.{generation}")
+            write_version(self.version_file, {"journal": generation, "snapshot": version["snapshot"]})
+            self._generation = generation
+            self._offset = 0
+            self._journal_size = 0
+        data = snapshot()
+        self._writer.submit({self.files[kind]: rows for kind, rows in data.items()},
+                            lambda: self._snapshot_written(generation),
+                            lambda: self._version()["snapshot"] >= generation)
+
+    def _snapshot_written(self, generation):
+        with self._version_lock:
+            write_version(self.version_file, {"journal": self._version()["journal"], "snapshot": generation})
+        remove_journal_segments(self.journal_file, generation)
+
+    def close(self):
+        self._writer.flush()
+        with self._sync_lock, self._io_lock:
+            self._close_journal()
+
+
+def directory_storage(directory):
+    # the JSON files of another data directory than the current one
+    return JsonStorage(*(os.path.join(directory, name) for name in
+                         (BOOKS_FILE, MEMBERS_FILE, EMPRUNTS_FILE, JOURNAL_FILE, LOAN_DAYS_FILE)))
+
+
+def exclusive(method):
+    # Mutations hold the storage lock for the whole check-then-write and start by applying what
+    # other processes committed since, so they decide on the current state, never on a stale one.
+    @functools.wraps(method)
+    def locked(self, *args, **kwargs):
+        with self.storage.lock():
+            self._catch_up()
+            return method(self, *args, **kwargs)
+    return locked
 
 
 class LibraryManager:
-    def __init__(self):
-        self.books = {}   
-        self.members = {} 
-        self.emprunts = {} 
+    # Thread-safe. Readers share self._lock; every change to the tables, indexes and aggregates is
+    # made holding it for writing (see _mutation). The borrow/return/reserve state of a book is
+    # checked holding that book's lock in self._book_locks, then applied under the write lock, so
+    # desk operations on different books only wait for each other while memory is updated and
+    # their fsyncs are shared.
+    def __init__(self, storage=None):
+        self._listeners = []
+        self._lock = RWLock()
+        self._book_locks = KeyLocks()
+        self._history_lock = threading.Lock()
+        self.storage = storage or JsonStorage()
+        self._reset()
         self._load_all()
 
+    def _reset(self):
+        self.books = {}
+        self.members = {}
+        self.emprunts = {}
+        # secondary indexes over self.emprunts: isbn -> {id: emprunt}, email -> {id: emprunt}, open loans
+        self._loans_by_book = {}
+        self._loans_by_member = {}
+        self._open_loans = {}
+        # open loans sorted by (due ordinal, insertion seq, id) so overdue loans are a prefix
+        self._due_index = []
+        self._due_keys = {}
+        self._due_seq = itertools.count()
+        self._search_index = SearchIndex()
+        self._unavailable = set()
+        # email -> {isbn: None} of the queues the member waits in, and the books with a queue,
+        # both in the order the reservations were made
+        self._reservations_by_member = {}
+        self._reserved_books = {}
+        # (hold_until ordinal, isbn) of the held books, a heap: entries whose book was taken or
+        # held again since are skipped when they come out. Books an older version held without a
+        # date, or left available with a queue, get a hold from the next expire_holds().
+        self._holds = []
+        self._undated_holds = set()
+        # running aggregates for stats(): books by borrow_count, members by number of loans
+        self._book_ranking = Ranking()
+        self._member_ranking = Ranking()
+        # loans per day (date ordinal, or the raw value of a date that does not parse) and per "YYYY-MM"
+        self._loan_days = {}
+        self._loan_months = {}
+        # returned loans are only built when a history view asks for them (see load_history);
+        # until then they are only counted
+        self._history_loaded = False
+        self._history_size = 0
+        self._history_dropped = set()
+
     # Persistence
     def _load_all(self):
-        for b in load_json(BOOKS_FILE):
-            book = Book.from_dict(b)
-            self.books[book.isbn] = book
+        # the lock keeps other processes from replacing the snapshot while it is streamed
+        with self.storage.lock():
+            self._load_locked()
 
-        for m in load_json(MEMBERS_FILE):
+    def _load_locked(self):
+        snapshot, records = self.storage.load()
+        for b in snapshot["books"]:
+            self._put_book(Book.from_dict(b))
+
+        for m in snapshot["members"]:
             member = Member.from_dict(m)
             self.members[member.email] = member
 
-        for e in load_json(EMPRUNTS_FILE):
-            empr = Emprunt.from_dict(e)
-            self.emprunts[empr.emprunt_id] = empr
+        # the per-day histogram saved with the snapshot spares parsing every loan date, unless it
+        # does not match the loans (missing file, or a crash between the two writes)
+        persisted = snapshot.get("loan_days")
+        for row in persisted or ():
+            day = to_ordinal(row["day"])
+            self._loan_days[day] = self._loan_days.get(day, 0) + row["count"]
+        in_journal = {rec["key"] for rec in records if rec["kind"] == "emprunts"}
+        known = set()
+        streamed = 0
+        for e in snapshot["emprunts"]:
+            streamed += 1
+            self._member_ranking.add(e["member_email"])
+            if not persisted:
+                day = to_ordinal(e["date_emprunt"])
+                self._loan_days[day] = self._loan_days.get(day, 0) + 1
+            if e["emprunt_id"] in in_journal:
+                known.add(e["emprunt_id"])
+            if e.get("status", "ongoing") == "ongoing":
+                self._put_emprunt(Emprunt.from_dict(e))
+            elif e["emprunt_id"] not in in_journal:
+                self._history_size += 1
+        if persisted and sum(self._loan_days.values()) != streamed:
+            self._loan_days = {}
+            for e in self.storage.iter_emprunts():
+                day = to_ordinal(e["date_emprunt"])
+                self._loan_days[day] = self._loan_days.get(day, 0) + 1
+        self._loan_months = months_of(self._loan_days)
+
+        for rec in records:
+            if rec["kind"] == "emprunts" and rec["data"] is not None and rec["key"] not in known:
+                known.add(rec["key"])
+                self._count_loan(rec["data"]["member_email"], to_ordinal(rec["data"]["date_emprunt"]))
+            self._apply(rec)
+        for isbn in self._reserved_books:
+            if self._undated_hold(self.books[isbn]):
+                self._undated_holds.add(isbn)
+
+    # Other processes sharing the storage
+    def _catch_up(self):
+        # called holding the storage lock
+        events = []
+        with self._lock.write():
+            records = self.storage.read_new()
+            if records is None:
+                self._reset()
+                self._load_all()
+                events.append(("reloaded", None, None))
+                records = ()
+            for rec in records:
+                existed = rec["key"] in getattr(self, rec["kind"])
+                if rec["kind"] == "emprunts" and rec["data"] is not None and not existed:
+                    self._count_loan(rec["data"]["member_email"], to_ordinal(rec["data"]["date_emprunt"]))
+                self._apply(rec)
+                action = "removed" if rec["data"] is None else "updated" if existed else "added"
+                events.append((action, rec["kind"], rec["key"]))
+        if events:
+            self._notify(events)
+
+    def has_external_changes(self):
+        # cheap enough to poll: no lock, no parsing
+        return self.storage.has_new()
+
+    def refresh(self):
+        # applies the changes committed by other processes; listeners get them as usual, or a
+        # single ("reloaded", None, None) when everything had to be loaded again
+        with self.storage.lock():
+            self._catch_up()
+
+    def load_history(self):
+        # the GUI may load the history from a worker thread while the Tk thread asks for it too
+        with self._history_lock:
+            if self._history_loaded:
+                return
+            # parsed without the lock, which is only taken to insert them
+            history = [Emprunt.from_dict(e) for e in self.storage.iter_emprunts()]
+            with self._lock.write():
+                for empr in history:
+                    if empr.emprunt_id in self.emprunts or empr.emprunt_id in self._history_dropped:
+                        continue
+                    self._put_emprunt(empr)
+                self._history_loaded = True
+                self._history_size = 0
+                self._history_dropped = set()
+
+    def _load_loans(self, emprunt_ids):
+        # the returned loans among these ids, read from storage one by one rather than with the
+        # whole history: a mistyped id must not page millions of loans in
+        with self._history_lock:
+            if self._history_loaded:
+                return
+            with self._lock.read():
+                missing = [i for i in emprunt_ids if i not in self.emprunts and i not in self._history_dropped]
+            if not missing:
+                return
+            found = self.storage.find_emprunts(missing)
+            with self._lock.write():
+                for emprunt_id, row in found.items():
+                    if emprunt_id in self.emprunts or emprunt_id in self._history_dropped:
+                        continue
+                    self._put_emprunt(Emprunt.from_dict(row))
+                    self._history_size -= 1
+
+    def all_emprunts(self):
+        self.load_history()
+        with self._lock.read():
+            return list(self.emprunts.values())
+
+    def _apply(self, rec):
+        if rec["kind"] == "books":
+            if rec["data"] is None:
+                self._drop_book(rec["key"])
+            else:
+                self._put_book(Book.from_dict(rec["data"]))
+            return
+        if rec["kind"] == "emprunts":
+            if rec["data"] is None:
+                self._drop_emprunt(rec["key"])
+            else:
+                self._put_emprunt(Emprunt.from_dict(rec["data"]))
+            return
+        table = getattr(self, rec["kind"])
+        if rec["data"] is None:
+            table.pop(rec["key"], None)
+        else:
+            table[rec["key"]] = RECORD_TYPES[rec["kind"]].from_dict(rec["data"])
+
+    def _put_book(self, book):
+        old = self.books.get(book.isbn)
+        if old is not None and old is not book:
+            self._unindex_reservations(old)
+        self.books[book.isbn] = book
+        if old is not book:
+            for email in book.reservations:
+                self._reservations_by_member.setdefault(email, {})[book.isbn] = None
+            if book.reservations:
+                self._reserved_books[book.isbn] = None
+            if isinstance(book.hold_ordinal, int):
+                heapq.heappush(self._holds, (book.hold_ordinal, book.isbn))
+        self._index_book(book)
+
+    def _drop_book(self, isbn):
+        book = self.books.pop(isbn, None)
+        if book is not None:
+            self._unindex_reservations(book)
+        self._search_index.remove(isbn)
+        self._unavailable.discard(isbn)
+        self._book_ranking.remove(isbn)
+
+    # Reservation queues: changed only through these, which keep the member index up to date
+    def _reserve(self, book, member_email, tier=0):
+        book.reservations.push(member_email, tier)
+        self._reservations_by_member.setdefault(member_email, {})[book.isbn] = None
+        self._reserved_books[book.isbn] = None
+
+    def _unreserve(self, book, member_email=None):
+        # the given member, or the one served next
+        if member_email is None:
+            member_email = book.reservations.popleft()
+        else:
+            book.reservations.remove(member_email)
+        isbns = self._reservations_by_member.get(member_email)
+        if isbns is not None:
+            isbns.pop(book.isbn, None)
+            if not isbns:
+                del self._reservations_by_member[member_email]
+        if not book.reservations:
+            self._reserved_books.pop(book.isbn, None)
+        return member_email
+
+    def _hold(self, book, deadline):
+        # for the member served next; members who reserve later wait behind this one, whatever
+        # their tier
+        book.hold_ordinal = deadline
+        book.held_for = book.reservations.peek()
+        heapq.heappush(self._holds, (deadline, book.isbn))
+
+    def _pass_hold(self, book, today):
+        # the member a book was held for left the queue: hold it for the next one, or free it
+        if book.reservations:
+            self._hold(book, today + HOLD_DAYS)
+        else:
+            book.hold_ordinal = book.held_for = None
+            book.disponibility = True
+
+    def _undated_hold(self, book):
+        # also a book left available with a queue, which only its first member could take
+        return (bool(book.reservations) and not isinstance(book.hold_ordinal, int)
+                and not self._open_loans_of_book(book.isbn))
+
+    def _unindex_reservations(self, book):
+        for email in book.reservations:
+            isbns = self._reservations_by_member.get(email)
+            if isbns is not None:
+                isbns.pop(book.isbn, None)
+                if not isbns:
+                    del self._reservations_by_member[email]
+        self._reserved_books.pop(book.isbn, None)
+
+    def _index_book(self, book):
+        self._search_index.add(book)
+        self._book_ranking.set(book.isbn, book.borrow_count)
+        if book.disponibility:
+            self._unavailable.discard(book.isbn)
+        else:
+            self._unavailable.add(book.isbn)
+
+    def available_count(self):
+        with self._lock.read():
+            return len(self.books) - len(self._unavailable)
+
+    # Loan indexes
+    def _put_emprunt(self, empr):
+        self.emprunts[empr.emprunt_id] = empr
+        self._index_emprunt(empr)
+
+    def _drop_emprunt(self, emprunt_id):
+        empr = self.emprunts.pop(emprunt_id, None)
+        if not self._history_loaded:
+            self._history_dropped.add(emprunt_id)
+        if empr is None:
+            return
+        self._count_loan(empr.member_email, empr.emprunt_ordinal, -1)
+        for index, key in ((self._loans_by_book, empr.book_isbn), (self._loans_by_member, empr.member_email)):
+            loans = index.get(key)
+            if loans is not None:
+                loans.pop(emprunt_id, None)
+                if not loans:
+                    del index[key]
+        self._open_loans.pop(emprunt_id, None)
+        self._index_due(empr, drop=True)
+
+    def _index_emprunt(self, empr):
+        # idempotent: also called after a status change to refresh the open-loans index
+        self._loans_by_book.setdefault(empr.book_isbn, {})[empr.emprunt_id] = empr
+        self._loans_by_member.setdefault(empr.member_email, {})[empr.emprunt_id] = empr
+        if empr.status == "ongoing":
+            self._open_loans[empr.emprunt_id] = empr
+        else:
+            self._open_loans.pop(empr.emprunt_id, None)
+        self._index_due(empr)
+
+    def _count_loan(self, member_email, day, delta=1):
+        # aggregates over every loan ever made, loaded or not: stats() and the loan time series
+        self._member_ranking.add(member_email, delta)
+        for counts, key in ((self._loan_days, day), (self._loan_months, month_of(day))):
+            if key is None:
+                continue
+            count = counts.get(key, 0) + delta
+            if count > 0:
+                counts[key] = count
+            else:
+                counts.pop(key, None)
+
+    def _index_due(self, empr, drop=False):
+        key = self._due_keys.pop(empr.emprunt_id, None)
+        if key is not None:
+            del self._due_index[bisect_left(self._due_index, key)]
+        if drop or empr.status != "ongoing":
+            return
+        seq = key[1] if key is not None else next(self._due_seq)
+        due = empr.due_ordinal
+        if not isinstance(due, int):
+            due = parse_date(due).toordinal()
+        key = (due, seq, empr.emprunt_id)
+        insort(self._due_index, key)
+        self._due_keys[empr.emprunt_id] = key
+
+    def _open_loans_of_book(self, isbn):
+        return [e for e in self._loans_by_book.get(isbn, {}).values() if e.status == "ongoing"]
+
+    def _open_loans_of_member(self, email):
+        return [e for e in self._loans_by_member.get(email, {}).values() if e.status == "ongoing"]
+
+    @contextmanager
+    def _mutation(self):
+        # Yields a list to fill with the changes made, as (action, kind, key, obj) with action
+        # "added", "updated" or "removed" and obj None for a removed record. Memory is changed and
+        # the changes journaled under the write lock, so the journal is in the order the threads
+        # changed memory; the fsync and the listeners come after it is released.
+        changes = []
+        with self._lock.write():
+            yield changes
+            if changes:
+                records = [{"kind": kind, "key": key, "data": obj.to_dict() if obj is not None else None}
+                           for _, kind, key, obj in changes]
+                ticket = self.storage.append(records)
+                for action, kind, key, obj in changes:
+                    if kind == "books" and obj is not None:
+                        self._index_book(obj)
+        if not changes:
+            return
+        self.storage.sync(ticket)
+        if self.storage.needs_compaction():
+            self._compact_if_needed()
+        self._notify([(action, kind, key) for action, kind, key, _ in changes])
+
+    # Change feed: listeners get a list of (action, kind, key) after every committed mutation
+    def subscribe(self, listener):
+        self._listeners.append(listener)
+
+    def unsubscribe(self, listener):
+        self._listeners.remove(listener)
+
+    def _notify(self, events):
+        for listener in list(self._listeners):
+            listener(events)
+
+    def emprunt_rows(self):
+        # every loan as a dict, without loading the history: returned loans still on disk are
+        # streamed from the previous snapshot
+        with self._lock.read():
+            emprunts = [e.to_dict() for e in self.emprunts.values()]
+            if self._history_loaded:
+                return emprunts
+            skip = set(self.emprunts) | self._history_dropped
+        history = (e for e in self.storage.iter_emprunts() if e["emprunt_id"] not in skip)
+        return itertools.chain(history, emprunts)
+
+    def _snapshot(self):
+        return {
+            "books": [b.to_dict() for b in self.books.values()],
+            "members": [m.to_dict() for m in self.members.values()],
+            "emprunts": self.emprunt_rows(),
+            "loan_days": [{"day": from_ordinal(day), "count": count} for day, count in self._loan_days.items()],
+        }
+
+    @exclusive
+    def compact(self):
+        with self._lock.write():
+            self.storage.compact(self._snapshot)
+
+    @exclusive
+    def _compact_if_needed(self):
+        # several threads may find the journal full at once; only the first one compacts
+        with self._lock.write():
+            if self.storage.needs_compaction():
+                self.storage.compact(self._snapshot)
 
-    def _save_all(self):
-        save_json(BOOKS_FILE, [b.to_dict() for b in self.books.values()])
-        save_json(MEMBERS_FILE, [m.to_dict() for m in self.members.values()])
-        save_json(EMPRUNTS_FILE, [e.to_dict() for e in self.emprunts.values()])
+    def close(self):
+        self.compact()
+        self.storage.close()
 
+    @exclusive
     def add_book(self, title, author, isbn, year):
-        if isbn in self.books:
-            raise ValueError("ISBN already exists")
-        book = Book(title, author, isbn, year, True, [])
-        self.books[isbn] = book
-        self._save_all()
+        with self._mutation() as changes:
+            if isbn in self.books:
+                raise ValueError("ISBN already exists")
+            book = Book(title, author, isbn, year, True, [])
+            self._put_book(book)
+            changes.append(("added", "books", isbn, book))
         return book
 
+    @exclusive
     def remove_book(self, isbn_or_title):
-        to_remove = None
-        if isbn_or_title in self.books:
-            to_remove = self.books[isbn_or_title]
-        else:
-            for b in list(self.books.values()):
-                if b.title.lower() == isbn_or_title.lower():
-                    to_remove = b
-                    break
-        if not to_remove:
-            raise KeyError("Book not found")
-        for e in self.emprunts.values():
-            if e.book_isbn == to_remove.isbn and e.status == "ongoing":
+        with self._mutation() as changes:
+            to_remove = None
+            if isbn_or_title in self.books:
+                to_remove = self.books[isbn_or_title]
+            else:
+                for b in list(self.books.values()):
+                    if b.title.lower() == isbn_or_title.lower():
+                        to_remove = b
+                        break
+            if not to_remove:
+                raise KeyError("Book not found")
+            if self._open_loans_of_book(to_remove.isbn):
                 raise ValueError("Book currently borrowed; cannot remove")
-        del self.books[to_remove.isbn]
-        self._save_all()
+            self._drop_book(to_remove.isbn)
+            changes.append(("removed", "books", to_remove.isbn, None))
 
-    def search_books(self, query):
-        q = query.lower()
-        results = []
-        for b in self.books.values():
-            if q in b.title.lower() or q in b.author.lower() or q in b.isbn.lower():
-                results.append(b)
-        return results
+    def search_books(self, query, mode="index", limit=None):
+        # mode "substring" keeps the original case-insensitive substring scan, in catalogue order
+        with self._lock.read():
+            if mode == "substring":
+                q = query.lower()
+                results = []
+                for b in self.books.values():
+                    if q in b.title.lower() or q in b.author.lower() or q in b.isbn.lower():
+                        results.append(b)
+                return results[:limit] if limit is not None else results
+            if mode != "index":
+                raise ValueError(f"Unknown search mode: {mode}")
+            isbns = self._search_index.search(query, limit)
+            if isbns is None:
+                # nothing to match on (empty or punctuation-only query): everything matches, as before
+                books = list(self.books.values())
+                return books[:limit] if limit is not None else books
+            return [self.books[isbn] for isbn in isbns]
+
+    # Bulk import: rows are (line, dict) pairs, None for a line that could not be read. Every row is
+    # checked against the library and the rest of the batch before anything is written, then the
+    # accepted ones are stored in a single write. Returns (number imported, [(line, reason)]); with
+    # strict=True nothing is imported when any row is rejected.
+    def import_books(self, rows, strict=False, progress=None):
+        def build(row):
+            title, author, isbn = required_fields(row, ("title", "author", "isbn"))
+            return isbn, Book(title, author, isbn, str(row.get("year") or "").strip(), True, [])
+        return self._import("books", rows, build, strict, progress)
+
+    def import_members(self, rows, strict=False, progress=None):
+        def build(row):
+            nom, prenom, email = required_fields(row, ("nom", "prenom", "email"))
+            return email, Member(nom, prenom, email, str(row.get("phone") or "").strip(),
+                                 row.get("date_inscription") or None)
+        return self._import("members", rows, build, strict, progress)
+
+    def _import(self, kind, rows, build, strict, progress):
+        # rows are read and built without any lock; keys already in the library are rejected
+        # under the locks, just before the write (see _store_import)
+        accepted = {}
+        rejects = []
+        for n, (line, row) in enumerate(rows, 1):
+            if progress and n % IMPORT_PROGRESS_EVERY == 0:
+                progress(n)
+            try:
+                if row is None:
+                    raise ValueError("unreadable row")
+                key, obj = build(row)
+                if key in accepted:
+                    raise ValueError(f"duplicate key {key}")
+            except ValueError as ex:
+                rejects.append((line, str(ex)))
+                continue
+            accepted[key] = (line, obj)
+        return self._store_import(kind, accepted, rejects, strict)
+
+    @exclusive
+    def _store_import(self, kind, accepted, rejects, strict):
+        table = getattr(self, kind)
+        with self._lock.write():
+            for key in [key for key in accepted if key in table]:
+                rejects.append((accepted.pop(key)[0], f"duplicate key {key}"))
+            rejects.sort()
+            if not accepted or (strict and rejects):
+                return 0, rejects
+            for key, (_, obj) in accepted.items():
+                if kind == "books":
+                    self._put_book(obj)
+                else:
+                    table[key] = obj
+            records = [{"kind": kind, "key": key, "data": obj.to_dict()} for key, (_, obj) in accepted.items()]
+            self.storage.bulk_write(records, self._snapshot)
+        self._notify([("added", kind, key) for key in accepted])
+        return len(accepted), rejects
 
+    @exclusive
     def add_member(self, nom, prenom, email, phone=""):
-        if email in self.members:
-            raise ValueError("Member with this email already exists")
-        member = Member(nom, prenom, email, phone)
-        self.members[email] = member
-        self._save_all()
+        with self._mutation() as changes:
+            if email in self.members:
+                raise ValueError("Member with this email already exists")
+            member = Member(nom, prenom, email, phone)
+            self.members[email] = member
+            changes.append(("added", "members", email, member))
         return member
 
+    @exclusive
     def remove_member(self, email):
-        if email not in self.members:
-            raise KeyError("Member not found")
-        for e in self.emprunts.values():
-            if e.member_email == email and e.status == "ongoing":
+        # the member leaves every reservation queue too
+        with self._lock.read():
+            isbns = list(self._reservations_by_member.get(email, ()))
+        with self._book_locks.hold(isbns), self._mutation() as changes:
+            if email not in self.members:
+                raise KeyError("Member not found")
+            if self._open_loans_of_member(email):
                 raise ValueError("Member has ongoing emprunts; cannot remove")
-        del self.members[email]
-        self._save_all()
+            del self.members[email]
+            today = datetime.today().date().toordinal()
+            for isbn in list(self._reservations_by_member.get(email, ())):
+                book = self.books[isbn]
+                held = book.hold_ordinal is not None and book.held_for == email
+                self._unreserve(book, email)
+                if held:
+                    self._pass_hold(book, today)
+                changes.append(("updated", "books", isbn, book))
+            changes.append(("removed", "members", email, None))
 
     def list_members(self):
-        return list(self.members.values())
+        with self._lock.read():
+            return list(self.members.values())
     def borrow_book(self, book_isbn, member_email, days=14):
-        if book_isbn not in self.books:
-            raise KeyError("Book does not exist")
-        if member_email not in self.members:
-            raise KeyError("Member does not exist")
-        book = self.books[book_isbn]
-        if not book.disponibility:
-            if member_email in book.reservations:
-                raise ValueError("Member already in reservation queue")
-            book.reservations.append(member_email)
-            self._save_all()
-            return {"reserved": True}
-        if book.reservations:
-            if book.reservations[0] != member_email:
-                raise ValueError("Book reserved to another member")
-            book.reservations.pop(0)
-
-        borrow_id = str(uuid.uuid4())
-        date_emprunt = datetime.today().strftime(DATEFMT)
-        date_due = (datetime.today() + timedelta(days=days)).strftime(DATEFMT)
-        empr = Emprunt(borrow_id, book_isbn, member_email, date_emprunt, date_due, None, "ongoing")
-        self.emprunts[borrow_id] = empr
-        book.disponibility = False
-        book.borrow_count = int(book.borrow_count) + 1
-        self._save_all()
-        return empr
+        result = self.borrow_many([(book_isbn, member_email)], days)[0]
+        if isinstance(result, Exception):
+            raise result
+        return result
 
     def return_book(self, emprunt_id):
-        if emprunt_id not in self.emprunts:
-            raise KeyError("Emprunt not found")
-        empr = self.emprunts[emprunt_id]
-        if empr.status != "ongoing":
-            raise ValueError("Emprunt already closed")
-        empr.date_return = datetime.today().strftime(DATEFMT)
-        empr.status = "returned"
-        book = self.books.get(empr.book_isbn)
-        if not book:
-            raise KeyError("Book record missing")
-        if book.reservations:
-            book.disponibility = False
-        else:
-            book.disponibility = True
-        self._save_all()
-        return empr
-
-    def reserve_book(self, book_isbn, member_email):
-        if book_isbn not in self.books:
-            raise KeyError("Book does not exist")
-        if member_email not in self.members:
-            raise KeyError("Member does not exist")
-        book = self.books[book_isbn]
-        if member_email in book.reservations:
-            raise ValueError("Already reserved")
-        book.reservations.append(member_email)
-        self._save_all()
-
-    def overdue_emprunts(self):
-        return [e for e in self.emprunts.values() if e.is_overdue()]
+        result = self.return_many([emprunt_id])[0]
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def _vanished(self, book, member_email):
+        # a book or member removed by another thread between the check and the write
+        if self.books.get(book.isbn) is not book:
+            return KeyError("Book does not exist")
+        if member_email is not None and member_email not in self.members:
+            return KeyError("Member does not exist")
+        return None
+
+    # Batch desk operations. Items are checked in order against the library as the earlier items
+    # leave it, then applied together and persisted in one journal write. Each item gets its
+    # result or the KeyError/ValueError that rejects it; with atomic=True one rejected item
+    # cancels the whole batch and the other items get None.
+    @exclusive
+    def borrow_many(self, items, days=14, atomic=True):
+        # items are (isbn, email); a book borrowed earlier in the batch is reserved by later items
+        items = list(items)
+        with self._book_locks.hold(isbn for isbn, _ in items):
+            with self._lock.read():
+                plan = self._plan_borrows(items)
+            if atomic and any(error for _, _, _, error in plan):
+                return [error for _, _, _, error in plan]
+
+            date_emprunt = datetime.today().strftime(DATEFMT)
+            date_due = (datetime.today() + timedelta(days=days)).strftime(DATEFMT)
+            with self._mutation() as changes:
+                for i, (action, book, member_email, error) in enumerate(plan):
+                    gone = action and self._vanished(book, member_email)
+                    if gone:
+                        plan[i] = (None, None, None, gone)
+                if atomic and any(error for _, _, _, error in plan):
+                    return [error for _, _, _, error in plan]
+                results = []
+                updated = {}
+                for action, book, member_email, error in plan:
+                    if error:
+                        results.append(error)
+                        continue
+                    if book.isbn not in updated:
+                        updated[book.isbn] = ("updated", "books", book.isbn, book)
+                        changes.append(updated[book.isbn])
+                    if action == "reserve":
+                        self._reserve(book, member_email)
+                        results.append({"reserved": True, "position": book.reservations.position(member_email)})
+                        continue
+                    if member_email in book.reservations:
+                        self._unreserve(book, member_email)
+                    book.hold_ordinal = book.held_for = None
+                    empr = Emprunt(str(uuid.uuid4()), book.isbn, member_email, date_emprunt, date_due, None, "ongoing")
+                    self._put_emprunt(empr)
+                    self._count_loan(member_email, empr.emprunt_ordinal)
+                    book.disponibility = False
+                    book.borrow_count = int(book.borrow_count) + 1
+                    changes.append(("added", "emprunts", empr.emprunt_id, empr))
+                    results.append(empr)
+        return results
+
+    def _plan_borrows(self, items):
+        plan = []
+        # isbn -> [disponibility, member served from the queue, members queued] as the batch
+        # leaves the book: once it is borrowed the batch can only add to its queue
+        shadow = {}
+        for book_isbn, member_email in items:
+            try:
+                if book_isbn not in self.books:
+                    raise KeyError("Book does not exist")
+                if member_email not in self.members:
+                    raise KeyError("Member does not exist")
+                book = self.books[book_isbn]
+                # a held book can only be taken by the member it is held for, an available one by
+                # the first member of its queue
+                state = shadow.setdefault(book_isbn, [book.disponibility or book.hold_ordinal is not None, None, set()])
+                if book.hold_ordinal is not None:
+                    takes = state[0] and book.held_for == member_email
+                else:
+                    takes = state[0] and (not book.reservations or book.reservations.peek() == member_email)
+                if state[0] and not takes and book.disponibility:
+                    raise ValueError("Book reserved to another member")
+                if not takes:
+                    if (member_email in book.reservations and member_email != state[1]) or member_email in state[2]:
+                        raise ValueError("Member already in reservation queue")
+                    state[2].add(member_email)
+                    plan.append(("reserve", book, member_email, None))
+                    continue
+                if book.reservations:
+                    state[1] = member_email
+                state[0] = False
+                plan.append(("borrow", book, member_email, None))
+            except (KeyError, ValueError) as ex:
+                plan.append((None, None, None, ex))
+        return plan
+
+    @exclusive
+    def return_many(self, emprunt_ids, atomic=True):
+        emprunt_ids = list(emprunt_ids)
+        self._load_loans(emprunt_ids)
+        with self._lock.read():
+            isbns = [self.emprunts[i].book_isbn for i in emprunt_ids if i in self.emprunts]
+        with self._book_locks.hold(isbns):
+            plan = []
+            seen = set()
+            with self._lock.read():
+                for emprunt_id in emprunt_ids:
+                    try:
+                        if emprunt_id not in self.emprunts:
+                            raise KeyError("Emprunt not found")
+                        empr = self.emprunts[emprunt_id]
+                        if empr.status != "ongoing" or emprunt_id in seen:
+                            raise ValueError("Emprunt already closed")
+                        if empr.book_isbn not in self.books:
+                            raise KeyError("Book record missing")
+                        seen.add(emprunt_id)
+                        plan.append((empr, None))
+                    except (KeyError, ValueError) as ex:
+                        plan.append((None, ex))
+            if atomic and any(error for _, error in plan):
+                return [error for _, error in plan]
+
+            date_return = datetime.today().strftime(DATEFMT)
+            today = to_ordinal(date_return)
+            with self._mutation() as changes:
+                plan = [(None, KeyError("Book record missing")) if empr and empr.book_isbn not in self.books
+                        else (empr, error) for empr, error in plan]
+                if atomic and any(error for _, error in plan):
+                    return [error for _, error in plan]
+                results = []
+                updated = set()
+                for empr, error in plan:
+                    if error:
+                        results.append(error)
+                        continue
+                    empr.date_return = date_return
+                    empr.status = "returned"
+                    self._index_emprunt(empr)
+                    book = self.books[empr.book_isbn]
+                    # a returned book with a reservation queue is held for the first member in it
+                    book.disponibility = not book.reservations
+                    if book.reservations:
+                        self._hold(book, today + HOLD_DAYS)
+                    changes.append(("updated", "emprunts", empr.emprunt_id, empr))
+                    if book.isbn not in updated:
+                        updated.add(book.isbn)
+                        changes.append(("updated", "books", book.isbn, book))
+                    results.append(empr)
+        return results
+
+    @exclusive
+    def reserve_book(self, book_isbn, member_email, tier=0):
+        # members of a higher tier are served before those of lower ones; returns the position
+        # in the queue, 1 for the member served next
+        with self._book_locks.hold([book_isbn]), self._mutation() as changes:
+            if book_isbn not in self.books:
+                raise KeyError("Book does not exist")
+            if member_email not in self.members:
+                raise KeyError("Member does not exist")
+            book = self.books[book_isbn]
+            if member_email in book.reservations:
+                raise ValueError("Already reserved")
+            self._reserve(book, member_email, tier)
+            if book.disponibility:
+                # an available book is held at once, so the queue cannot block it for good
+                book.disponibility = False
+                self._hold(book, datetime.today().date().toordinal() + HOLD_DAYS)
+            changes.append(("updated", "books", book_isbn, book))
+            return book.reservations.position(member_email)
+
+    @exclusive
+    def cancel_reservation(self, book_isbn, member_email):
+        with self._book_locks.hold([book_isbn]), self._mutation() as changes:
+            book = self.books.get(book_isbn)
+            if book is None:
+                raise KeyError("Book does not exist")
+            if member_email not in book.reservations:
+                raise KeyError("Not in the reservation queue")
+            self._unreserve(book, member_email)
+            if book.hold_ordinal is not None and book.held_for == member_email:
+                self._pass_hold(book, datetime.today().date().toordinal())
+            changes.append(("updated", "books", book_isbn, book))
+
+    # Hold expiry, meant to run periodically (service.py, the GUI, `cli.py expire-holds`): the first
+    # member of a held book's queue who has not taken it by its hold_until date leaves the queue,
+    # and the book is held for the next member or becomes available. All of it is written at once.
+    # Costs the number of expired holds, not a pass over the catalogue. Returns
+    # [(isbn, member dropped, member the book is now held for)], either member possibly None.
+    def expire_holds(self, today=None):
+        today = (today or datetime.today().date()).toordinal()
+        with self._lock.read():
+            idle = not self._undated_holds and not (self._holds and self._holds[0][0] < today)
+        if idle and not self.storage.has_new():
+            return []
+        return self._expire_holds(today)
+
+    @exclusive
+    def _expire_holds(self, today):
+        with self._lock.write():
+            due = []
+            while self._holds and self._holds[0][0] < today:
+                due.append(heapq.heappop(self._holds))
+            undated, self._undated_holds = self._undated_holds, set()
+        results = []
+        with self._book_locks.hold([isbn for _, isbn in due] + list(undated)), self._mutation() as changes:
+            for isbn in undated:
+                book = self.books.get(isbn)
+                if book is not None and self._undated_hold(book):
+                    # the member it was held for gets the full delay from now
+                    book.disponibility = False
+                    self._hold(book, today + HOLD_DAYS)
+                    results.append((isbn, None, book.held_for))
+                    changes.append(("updated", "books", isbn, book))
+            for deadline, isbn in due:
+                book = self.books.get(isbn)
+                if book is None or book.hold_ordinal != deadline:
+                    # taken, removed or held again since
+                    continue
+                no_show = book.held_for
+                if no_show in book.reservations:
+                    self._unreserve(book, no_show)
+                self._pass_hold(book, today)
+                results.append((isbn, no_show, book.held_for))
+                changes.append(("updated", "books", isbn, book))
+        return results
+
+    def reservation_position(self, book_isbn, member_email):
+        # 1 for the member served next, None when not waiting for that book
+        with self._lock.read():
+            book = self.books.get(book_isbn)
+            return book.reservations.position(member_email) if book else None
+
+    def reservations_of(self, member_email):
+        # [(book, position)] for every queue the member waits in
+        with self._lock.read():
+            return [(self.books[isbn], self.books[isbn].reservations.position(member_email))
+                    for isbn in self._reservations_by_member.get(member_email, ())]
+
+    def reserved_books(self):
+        # the books with a reservation queue
+        with self._lock.read():
+            return [self.books[isbn] for isbn in self._reserved_books]
+
+    def overdue_emprunts(self, today=None):
+        with self._lock.read():
+            end = self._overdue_end(today)
+            # same order as a scan of self.emprunts
+            keys = sorted(self._due_index[:end], key=lambda k: k[1])
+            return [self._open_loans[k[2]] for k in keys]
+
+    def overdue_count(self, today=None):
+        with self._lock.read():
+            return self._overdue_end(today)
+
+    def _overdue_end(self, today):
+        today = (today or datetime.today().date()).toordinal()
+        return bisect_left(self._due_index, (today,))
 
     def current_emprunts(self):
-        return [e for e in self.emprunts.values() if e.status == "ongoing"]
+        with self._lock.read():
+            return list(self._open_loans.values())
 
     def emprunts_by_member(self, member_email):
-        return [e for e in self.emprunts.values() if e.member_email == member_email]
+        self.load_history()
+        with self._lock.read():
+            return list(self._loans_by_member.get(member_email, {}).values())
 
     def book_status(self, isbn):
-        b = self.books.get(isbn)
-        if not b:
-            return None
-        borrowed_by = None
-        for e in self.emprunts.values():
-            if e.book_isbn == isbn and e.status == "ongoing":
-                borrowed_by = e.member_email
-                break
-        return {
-            "book": b,
-            "available": b.disponibility,
-            "borrowed_by": borrowed_by,
-            "reservations": list(b.reservations)
-        }
+        with self._lock.read():
+            b = self.books.get(isbn)
+            if not b:
+                return None
+            ongoing = self._open_loans_of_book(isbn)
+            borrowed_by = ongoing[0].member_email if ongoing else None
+            return {
+                "book": b,
+                "available": b.disponibility,
+                "borrowed_by": borrowed_by,
+                "reservations": list(b.reservations)
+            }
+
+    def loans_by_month(self):
+        # [("YYYY-MM", count)] in month order; loans whose date does not parse are left out
+        with self._lock.read():
+            return sorted(self._loan_months.items())
+
+    def loans_by_day(self):
+        with self._lock.read():
+            return sorted((from_ordinal(day), count) for day, count in self._loan_days.items() if isinstance(day, int))
 
     def stats(self):
-        total_books = len(self.books)
-        total_members = len(self.members)
-        total_emprunts = len(self.emprunts)
-        top_books = sorted(self.books.values(), key=lambda x: x.borrow_count, reverse=True)[:5]
-        count_by_member = defaultdict(int)
-        for e in self.emprunts.values():
-            count_by_member[e.member_email] += 1
-        top_members = sorted(count_by_member.items(), key=lambda x: x[1], reverse=True)[:5]
-        currently_borrowed = [e for e in self.emprunts.values() if e.status == "ongoing"]
+        with self._lock.read():
+            total_books = len(self.books)
+            total_members = len(self.members)
+            total_emprunts = len(self.emprunts) + self._history_size
+            top_books = [self.books[isbn] for isbn, _ in self._book_ranking.top(5)]
+            top_members = self._member_ranking.top(5)
+            currently_borrowed = list(self._open_loans.values())
         return {
             "total_books": total_books,
             "total_members": total_members,
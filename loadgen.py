@@ -0,0 +1,144 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+from bench import temp_library
+
+# operation -> share of the requests: mostly catalogue traffic, some desk operations
+MIX = {"search": 0.45, "status": 0.25, "stats": 0.05, "borrow": 0.15, "return": 0.10}
+
+
+class Client:
+    # one keep-alive HTTP/1.1 connection
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.reader = self.writer = None
+
+    async def request(self, method, path, body=None):
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        data = json.dumps(body).encode("utf-8") if body is not None else b""
+        self.writer.write(f"{method} {path} HTTP/1.1\r\nHost: {self.host}\r\n"
+                          f"Content-Type: application/json\r\nContent-Length: {len(data)}\r\n\r\n".encode("latin-1") + data)
+        await self.writer.drain()
+        status = int((await self.reader.readline()).split()[1])
+        length = 0
+        while True:
+            line = await self.reader.readline()
+            if line in (b"\r\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            if name.strip().lower() == "content-length":
+                length = int(value)
+        return status, json.loads(await self.reader.readexactly(length))
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+
+async def client_loop(host, port, number, books, deadline, latencies, seed):
+    rng = random.Random(seed)
+    email = f"member{number}@example.com"
+    loans = []
+    client = Client(host, port)
+    ops, weights = zip(*MIX.items())
+    try:
+        while time.perf_counter() < deadline:
+            op = rng.choices(ops, weights)[0]
+            if op == "return" and not loans:
+                op = "borrow"
+            t0 = time.perf_counter()
+            if op == "search":
+                # a title and a number as typed in the catalogue: one or two digits match that
+                # number, three are a prefix of a few to a few hundred
+                prefix = str(rng.randrange(books))[:rng.randint(1, 3)]
+                await client.request("GET", f"/books?q=book+{prefix}&limit=20")
+            elif op == "status":
+                await client.request("GET", f"/books/ISBN_{rng.randrange(books)}")
+            elif op == "stats":
+                await client.request("GET", "/stats")
+            elif op == "borrow":
+                status, payload = await client.request("POST", "/borrow",
+                                                       {"isbn": f"ISBN_{rng.randrange(books)}", "email": email})
+                if status == 200 and "emprunt" in payload:
+                    loans.append(payload["emprunt"]["emprunt_id"])
+            else:
+                await client.request("POST", "/return", {"emprunt_id": loans.pop(rng.randrange(len(loans)))})
+            latencies.setdefault(op, []).append(time.perf_counter() - t0)
+    finally:
+        client.close()
+
+
+def percentile(sorted_values, p):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * p / 100))]
+
+
+async def run(host, port, clients, duration, books):
+    latencies = {}
+    deadline = time.perf_counter() + duration
+    t0 = time.perf_counter()
+    await asyncio.gather(*(client_loop(host, port, i, books, deadline, latencies, i) for i in range(clients)))
+    return latencies, time.perf_counter() - t0
+
+
+def report(latencies, elapsed, clients):
+    total = sum(len(v) for v in latencies.values())
+    print(f"{total} requests from {clients} clients in {elapsed:.1f} s: {total / elapsed:.0f} requests/s")
+    print(f"  {'operation':<10} {'count':>8} {'p50 ms':>8} {'p99 ms':>8}")
+    for op in list(MIX) + ["all"]:
+        values = sorted(v for vs in latencies.values() for v in vs) if op == "all" else sorted(latencies.get(op, []))
+        if values:
+            print(f"  {op:<10} {len(values):8d} {percentile(values, 50) * 1000:8.2f} {percentile(values, 99) * 1000:8.2f}")
+
+
+async def wait_for_port(host, port, proc, timeout=60):
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError("the service exited")
+        try:
+            _, writer = await asyncio.open_connection(host, port)
+            writer.close()
+            return
+        except OSError:
+            await asyncio.sleep(0.1)
+    raise RuntimeError("the service did not start")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load generator for service.py on a synthetic library")
+    parser.add_argument("--books", type=int, default=10000)
+    parser.add_argument("--members", type=int, default=1000)
+    parser.add_argument("--clients", type=int, default=32, help="concurrent keep-alive connections")
+    parser.add_argument("--duration", type=float, default=10, help="seconds")
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args(argv)
+    if args.clients > args.members:
+        parser.error("need at least one member per client")
+
+    host = "127.0.0.1"
+    with tempfile.TemporaryDirectory() as directory:
+        print(f"Building {args.books} books and {args.members} members...", file=sys.stderr)
+        temp_library(directory, args.books, args.members).close()
+        service = os.path.join(os.path.dirname(os.path.abspath(__file__)), "service.py")
+        proc = subprocess.Popen([sys.executable, service, "--data", directory, "--host", host, "--port", str(args.port)],
+                                stdout=subprocess.DEVNULL)
+        try:
+            asyncio.run(wait_for_port(host, args.port, proc))
+            latencies, elapsed = asyncio.run(run(host, args.port, args.clients, args.duration, args.books))
+        finally:
+            proc.terminate()
+            proc.wait()
+    report(latencies, elapsed, args.clients)
+
+
+if __name__ == "__main__":
+    main()
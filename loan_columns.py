@@ -0,0 +1,194 @@
+import threading
+import weakref
+from array import array
+from contextlib import contextmanager
+
+from library import Emprunt, intern_key, to_ordinal
+
+# date_return column value for a loan that is still open
+NO_DATE = 0
+
+
+class LoanColumns:
+    def __init__(self):
+        self.ids = []
+        self.book_codes = array("I")
+        self.member_codes = array("I")
+        self.status_codes = array("B")
+        self.date_emprunt = array("i")
+        self.date_due = array("i")
+        self.date_return = array("i")
+        # code -> value tables for the repeated strings
+        self.books = []
+        self.members = []
+        self.statuses = []
+        self._codes = ({}, {}, {})
+        # loans left out because a date is missing or does not parse
+        self.skipped = 0
+
+    @classmethod
+    def from_emprunts(cls, emprunts):
+        cols = cls()
+        for e in emprunts:
+            cols.append(e)
+        return cols
+
+    @classmethod
+    def from_dicts(cls, dicts):
+        cols = cls()
+        for d in dicts:
+            cols.append_row(d)
+        return cols
+
+    def _code(self, table, codes, value):
+        code = codes.get(value)
+        if code is None:
+            code = codes[value] = len(table)
+            table.append(intern_key(value))
+        return code
+
+    def _dates(self, emprunt, due, returned):
+        # None when a loan cannot be counted: no date of loan or due date, or one that does not parse
+        if type(emprunt) is not int or type(due) is not int or returned is not None and type(returned) is not int:
+            self.skipped += 1
+            return None
+        return emprunt, due, NO_DATE if returned is None else returned
+
+    def _add(self, emprunt_id, isbn, email, status, dates):
+        book_codes, member_codes, status_codes = self._codes
+        self.ids.append(emprunt_id)
+        self.book_codes.append(self._code(self.books, book_codes, isbn))
+        self.member_codes.append(self._code(self.members, member_codes, email))
+        self.status_codes.append(self._code(self.statuses, status_codes, status))
+        self.date_emprunt.append(dates[0])
+        self.date_due.append(dates[1])
+        self.date_return.append(dates[2])
+
+    def append(self, e):
+        # False when the loan was skipped
+        dates = self._dates(e.emprunt_ordinal, e.due_ordinal, e.return_ordinal)
+        if dates is None:
+            return False
+        self._add(e.emprunt_id, e.book_isbn, e.member_email, e.status, dates)
+        return True
+
+    def append_row(self, d):
+        # a loan as saved (see Emprunt.to_dict), without building an Emprunt
+        dates = self._dates(to_ordinal(d["date_emprunt"]), to_ordinal(d["date_due"]), to_ordinal(d.get("date_return")))
+        if dates is None:
+            return False
+        self._add(d["emprunt_id"], d["book_isbn"], d["member_email"], d.get("status", "ongoing"), dates)
+        return True
+
+    def set(self, i, e):
+        # row i becomes e, typically an open loan that was returned; False when e has a bad date
+        dates = self._dates(e.emprunt_ordinal, e.due_ordinal, e.return_ordinal)
+        if dates is None:
+            return False
+        self.status_codes[i] = self._code(self.statuses, self._codes[2], e.status)
+        self.date_emprunt[i], self.date_due[i], self.date_return[i] = dates
+        return True
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, i):
+        date_return = self.date_return[i]
+        return Emprunt(self.ids[i], self.books[self.book_codes[i]], self.members[self.member_codes[i]],
+                       self.date_emprunt[i], self.date_due[i], None if date_return == NO_DATE else date_return,
+                       self.statuses[self.status_codes[i]])
+
+    def __iter__(self):
+        for i in range(len(self.ids)):
+            yield self[i]
+
+    def to_dicts(self):
+        for e in self:
+            yield e.to_dict()
+
+
+_histories = weakref.WeakKeyDictionary()
+_histories_lock = threading.Lock()
+
+
+class LoanHistory:
+    # The LoanColumns of every loan of a manager, built on first use and then kept up to date from
+    # its change feed, so an analysis does not read the whole history again each time.
+
+    def __init__(self, mgr):
+        self._mgr = weakref.ref(mgr)
+        self._lock = threading.Lock()
+        self._changes_lock = threading.Lock()
+        self._changed = []     # ids of the loans changed since the columns were brought up to date
+        self._stale = True     # the columns must be built again
+        self._cols = None
+        self._open = {}        # emprunt_id -> row of the loans open in the columns
+        mgr.subscribe(self._on_changes)
+
+    @classmethod
+    def of(cls, mgr):
+        with _histories_lock:
+            history = _histories.get(mgr)
+            if history is None:
+                history = _histories[mgr] = cls(mgr)
+            return history
+
+    def _on_changes(self, events):
+        with self._changes_lock:
+            for action, kind, key in events:
+                if action == "reloaded" or action == "removed" and kind == "emprunts":
+                    # a row cannot be taken out of the columns
+                    self._stale = True
+                elif kind == "emprunts":
+                    self._changed.append(key)
+
+    @contextmanager
+    def columns(self):
+        # the up-to-date columns, which do not change until the block ends
+        with self._lock:
+            built = False
+            while True:
+                with self._changes_lock:
+                    changed, self._changed = self._changed, []
+                    stale, self._stale = self._stale, False
+                if stale:
+                    self._build()
+                    built = True
+                elif self._update(changed, built):
+                    break
+                else:
+                    self._stale = True
+            yield self._cols
+
+    def _build(self):
+        cols = LoanColumns()
+        open_rows = {}
+        for d in self._mgr().emprunt_rows():
+            if cols.append_row(d) and d.get("status", "ongoing") == "ongoing":
+                open_rows[d["emprunt_id"]] = len(cols) - 1
+        self._cols, self._open = cols, open_rows
+
+    def _update(self, changed, built):
+        # False when the columns must be built again. Right after a build, a change may already be
+        # in the columns or not.
+        cols = self._cols
+        emprunts = self._mgr().emprunts
+        for key in dict.fromkeys(changed):
+            e = emprunts.get(key)
+            if e is None:
+                continue
+            row = self._open.get(key)
+            if row is not None:
+                if not cols.set(row, e):
+                    return False
+            elif built and key in cols.ids:
+                continue
+            elif cols.append(e):
+                row = len(cols) - 1
+            else:
+                continue
+            if e.status == "ongoing":
+                self._open[key] = row
+            else:
+                self._open.pop(key, None)
+        return True
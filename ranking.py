@@ -0,0 +1,73 @@
+import itertools
+import threading
+from bisect import bisect_left, insort
+
+# changed keys are re-sorted one by one below this count, otherwise the order is rebuilt in one pass
+MERGE_THRESHOLD = 64
+
+
+class Ranking:
+    # Counts kept sorted by decreasing value, ties in first-insertion order, so top(k) is a slice.
+    # Updates are O(1); the sorted order catches up on the next top().
+
+    def __init__(self):
+        self._counts = {}
+        self._seqs = {}
+        self._order = []      # (-count, seq, key)
+        self._entries = {}    # key -> its tuple in _order
+        self._dirty = set()
+        self._seq = itertools.count()
+        self._merge_lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._counts)
+
+    def __contains__(self, key):
+        return key in self._counts
+
+    def get(self, key, default=0):
+        return self._counts.get(key, default)
+
+    def set(self, key, count):
+        if self._counts.get(key) == count:
+            return
+        if key not in self._seqs:
+            self._seqs[key] = next(self._seq)
+        self._counts[key] = count
+        self._dirty.add(key)
+
+    def add(self, key, delta=1):
+        # a key whose count drops to zero leaves the ranking
+        count = self._counts.get(key, 0) + delta
+        if count > 0:
+            self.set(key, count)
+        else:
+            self.remove(key)
+
+    def remove(self, key):
+        if key in self._counts:
+            del self._counts[key]
+            del self._seqs[key]
+            self._dirty.add(key)
+
+    def top(self, k):
+        # top() may be called by several readers at once (LibraryManager's read lock)
+        with self._merge_lock:
+            self._merge()
+            return [(key, -neg) for neg, _, key in self._order[:k]]
+
+    def _merge(self):
+        if not self._dirty:
+            return
+        if len(self._dirty) > MERGE_THRESHOLD:
+            self._order = sorted((-count, self._seqs[key], key) for key, count in self._counts.items())
+            self._entries = {entry[2]: entry for entry in self._order}
+        else:
+            for key in self._dirty:
+                old = self._entries.pop(key, None)
+                if old is not None:
+                    del self._order[bisect_left(self._order, old)]
+                if key in self._counts:
+                    entry = self._entries[key] = (-self._counts[key], self._seqs[key], key)
+                    insort(self._order, entry)
+        self._dirty = set()
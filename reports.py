@@ -0,0 +1,172 @@
+import csv
+from itertools import islice
+
+# rows between two progress callbacks
+PROGRESS_EVERY = 1000
+# members of a reservation queue shown in a table cell before "(+N)"
+RESERVATIONS_SHOWN = 5
+
+
+def format_book_row(book):
+    dispo_text = f"{book.disponibility} {'✔️' if book.disponibility else '❌'}"
+    return (
+        book.title,
+        book.author,
+        book.isbn,
+        book.year,
+        dispo_text,
+        book.borrow_count,
+        reservations_text(book.reservations)
+    )
+
+
+def reservations_text(reservations):
+    # a long waiting list shows the members served next and how many follow them
+    text = ", ".join(islice(reservations, RESERVATIONS_SHOWN))
+    if len(reservations) > RESERVATIONS_SHOWN:
+        text += f" (+{len(reservations) - RESERVATIONS_SHOWN})"
+    return text
+
+
+def format_member_row(member):
+    return (member.nom, member.prenom, member.email, member.phone, member.date_inscription)
+
+
+def format_emprunt_row(e):
+    return (e.emprunt_id, e.book_isbn, e.member_email, e.date_emprunt, e.date_due, e.date_return or "", e.status)
+
+
+def format_reservation_row(book):
+    return (book.isbn, book.title, reservations_text(book.reservations))
+
+
+def member_name(mgr, email):
+    member = mgr.members.get(email)
+    return f"{member.prenom} {member.nom}" if member else email
+
+
+def book_title(mgr, isbn):
+    book = mgr.books.get(isbn)
+    return book.title if book else "???"
+
+
+def _each(items, progress, text):
+    # progress(fraction, text) is called every PROGRESS_EVERY items
+    for i, item in enumerate(items):
+        if progress and i % PROGRESS_EVERY == 0:
+            progress(i / len(items), text)
+        yield item
+
+
+def report_lines(mgr, progress=None):
+    st = mgr.stats()
+    lines = []
+    lines.append(f"Total livres: {st['total_books']}")
+    lines.append(f"Total membres: {st['total_members']}")
+    lines.append(f"Total emprunts (historique): {st['total_emprunts']}")
+    lines.append("\nTop 5 livres les plus empruntés:")
+    for b in st["top_books"]:
+        lines.append(f" - {b.title} ({b.borrow_count} emprunts)")
+    lines.append("\nTop membres (par nombre d'emprunts):")
+    for email, ct in st["top_members"]:
+        lines.append(f" - {member_name(mgr, email)} ({ct})")
+    lines.append("\nEmprunts en cours:")
+    for e in _each(mgr.overdue_emprunts(), progress, "Rapport"):
+        member = mgr.members.get(e.member_email)
+        lines.append(
+        f" - ID {e.emprunt_id} | Livre: {book_title(mgr, e.book_isbn)} | \n"
+        f"Membre: {member_name(mgr, e.member_email)} | Emprunté le: {e.date_emprunt} | Due: {e.date_due}\n"
+        f"Contact information :{member.phone if member else ''}| {e.member_email}\n"
+        f"_______________________________________________________________________________________\n")
+    return lines
+
+
+def overdue_lines(mgr):
+    lines = []
+    for e in mgr.overdue_emprunts():
+        lines.append(
+            f"• ID emprunt : {e.emprunt_id}\n"
+            f"  Livre       : {book_title(mgr, e.book_isbn)}\n"
+            f"  Membre      : {member_name(mgr, e.member_email)}\n"
+            f"___________________________________________________\n"
+        )
+    return lines
+
+
+def analytics_lines(mgr, progress=None):
+    # numpy is only needed for this report
+    from analytics import LoanArrays
+
+    if progress:
+        progress(None, "Chargement de l'historique")
+    arrays = LoanArrays.from_manager(mgr)
+    lines = [f"\nAnalyse de l'historique ({len(arrays)} emprunts):"]
+    if arrays.skipped:
+        lines.append(f"{arrays.skipped} emprunts ignorés (date illisible)")
+    delays = arrays.return_delay_percentiles()
+    if delays:
+        lines.append("Retard au retour (jours, négatif = en avance): " +
+                     ", ".join(f"p{p} {v:.0f}" for p, v in delays.items()))
+    durations = arrays.durations()
+    if len(durations):
+        lines.append(f"Durée moyenne d'un emprunt: {durations.mean():.1f} jours")
+    lines.append("Taux de retard par mois (12 derniers mois):")
+    for month, rate, total in arrays.overdue_rate_by_month()[-12:]:
+        lines.append(f" - {month}: {rate:.0%} de {total} emprunts")
+    return lines
+
+
+def write_report_csv(mgr, file_path, progress=None):
+    st = mgr.stats()
+    with open(file_path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+
+        writer.writerow(["Total livres", st["total_books"]])
+        writer.writerow(["Total membres", st["total_members"]])
+        writer.writerow(["Total emprunts (historique)", st["total_emprunts"]])
+        writer.writerow([])
+
+        writer.writerow(["Top 5 livres les plus empruntés"])
+        writer.writerow(["Titre","Nombre d'emprunts"])
+        for b in st["top_books"]:
+            writer.writerow([b.title, b.borrow_count])
+        writer.writerow([])
+
+        writer.writerow(["Top membres (par nombre d'emprunts)"])
+        writer.writerow(["Membre","Nombre d'emprunts"])
+        for email, ct in st["top_members"]:
+            writer.writerow([member_name(mgr, email), ct])
+        writer.writerow([])
+
+        writer.writerow(["Emprunts en cours"])
+        writer.writerow(["ID","Livre","Membre","Date emprunt","Date due","Contact"])
+        for e in _each(mgr.overdue_emprunts(), progress, "Export CSV"):
+            member = mgr.members.get(e.member_email)
+            writer.writerow([e.emprunt_id, book_title(mgr, e.book_isbn), member_name(mgr, e.member_email),
+                             e.date_emprunt, e.date_due, f"{member.phone if member else ''} | {member.email if member else ''}"])
+
+
+def write_report_pdf(file_path, report_text, progress=None):
+    from reportlab.lib.pagesizes import A4
+    from reportlab.pdfgen import canvas as pdfcanvas
+
+    c = pdfcanvas.Canvas(file_path, pagesize=A4)
+    width, height = A4
+    c.setFont("Helvetica", 12)
+
+    c.drawString(100, height - 50, "Rapport de bibliothèque")
+
+    lines = report_text.split("\n")
+    y = height - 80
+
+    for i, line in enumerate(lines):
+        if y < 50:
+            if progress:
+                progress(i / len(lines), "Export PDF")
+            c.showPage()
+            c.setFont("Helvetica", 12)
+            y = height - 50
+        c.drawString(40, y, line)
+        y -= 18
+
+    c.save()
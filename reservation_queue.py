@@ -0,0 +1,115 @@
+from bisect import bisect_left, insort
+from collections import deque
+
+
+class ReservationQueue:
+    # The members waiting for a book. A higher tier is served before every lower one; inside a tier
+    # members are served in the order they reserved. Adding, serving, cancelling, membership and
+    # "you are #37" are O(1) or O(log n) per tier, never a walk of the queue.
+    # Saved as the plain list of emails in serving order, plus {email: tier} for the members not
+    # in tier 0 (see Book.to_dict).
+
+    def __init__(self, emails=(), tiers=None):
+        self._entries = {}     # email -> (tier, seq)
+        self._queues = {}      # tier -> deque of (seq, email), cancelled entries included until served
+        self._cancelled = {}   # tier -> sorted seqs of the cancelled entries still in its deque
+        self._live = {}        # tier -> members waiting in it
+        self._order = []       # tiers, highest first
+        for email in emails:
+            # a list saved by an older version may name a member twice: the first place counts
+            if email not in self._entries:
+                self.push(email, (tiers or {}).get(email, 0))
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, email):
+        return email in self._entries
+
+    def __iter__(self):
+        # in serving order
+        for tier in self._order:
+            for seq, email in self._queues[tier]:
+                if self._entries.get(email) == (tier, seq):
+                    yield email
+
+    def __repr__(self):
+        return f"ReservationQueue({list(self)!r})"
+
+    def push(self, email, tier=0):
+        if email in self._entries:
+            raise ValueError("Already reserved")
+        queue = self._queues.get(tier)
+        if queue is None:
+            queue = self._queues[tier] = deque()
+            self._cancelled[tier] = []
+            self._live[tier] = 0
+            self._order.insert(bisect_left([-t for t in self._order], -tier), tier)
+        # seqs are consecutive inside a tier, so an entry's index in the deque is seq - first seq
+        seq = queue[-1][0] + 1 if queue else 0
+        queue.append((seq, email))
+        self._entries[email] = (tier, seq)
+        self._live[tier] += 1
+
+    def peek(self):
+        # the member served next, or None
+        if not self._order:
+            return None
+        return self._queues[self._order[0]][0][1]
+
+    def popleft(self):
+        if not self._order:
+            raise IndexError("pop from an empty reservation queue")
+        tier = self._order[0]
+        _, email = self._queues[tier].popleft()
+        del self._entries[email]
+        self._left(tier)
+        return email
+
+    def remove(self, email):
+        tier, seq = self._entries.pop(email)
+        queue = self._queues[tier]
+        if queue[-1][0] == seq:
+            queue.pop()
+        elif queue[0][0] != seq:
+            # left in place until it reaches the front
+            insort(self._cancelled[tier], seq)
+        else:
+            queue.popleft()
+        self._left(tier)
+
+    def _left(self, tier):
+        self._live[tier] -= 1
+        if not self._live[tier]:
+            del self._queues[tier], self._cancelled[tier], self._live[tier]
+            self._order.remove(tier)
+            return
+        queue = self._queues[tier]
+        cancelled = self._cancelled[tier]
+        # the front entry is always a waiting member
+        while cancelled and queue[0][0] == cancelled[0]:
+            queue.popleft()
+            del cancelled[0]
+
+    def position(self, email):
+        # 1 for the member served next, None when not in the queue
+        entry = self._entries.get(email)
+        if entry is None:
+            return None
+        tier, seq = entry
+        ahead = 0
+        for t in self._order:
+            if t == tier:
+                break
+            ahead += self._live[t]
+        queue = self._queues[tier]
+        return ahead + seq - queue[0][0] - bisect_left(self._cancelled[tier], seq) + 1
+
+    def tier(self, email):
+        return self._entries[email][0]
+
+    def to_list(self):
+        return list(self)
+
+    def tiers(self):
+        return {email: tier for email, (tier, _) in self._entries.items() if tier}
@@ -0,0 +1,232 @@
+import heapq
+import itertools
+import re
+import threading
+import unicodedata
+from bisect import bisect_left, insort
+from operator import itemgetter
+
+TOKEN_RE = re.compile(r"\w+")
+
+# field weights used to rank results: a hit in the title beats a hit in the author name
+TITLE_WEIGHT = 3
+AUTHOR_WEIGHT = 2
+ISBN_WEIGHT = 1
+EXACT_BONUS = 1
+
+# new tokens are inserted one by one below this count, otherwise merged in one pass
+MERGE_THRESHOLD = 64
+# with a limit, a query term stands for the first vocabulary tokens it starts, in alphabetical
+# order, up to this many tokens or until they cover this many books (or the limit, if larger)
+MAX_EXPANSION = 256
+MAX_EXPANSION_BOOKS = 5000
+# postings at least this long keep a copy in rank order, so a search with a limit reads only the
+# start of it
+RANKED_MIN = 1000
+
+
+def fold(text):
+    # lowercase and strip accents so "Misérables" and "miserables" match
+    text = str(text).casefold()
+    if text.isascii():
+        return text
+    text = unicodedata.normalize("NFKD", text)
+    return "".join(c for c in text if not unicodedata.combining(c))
+
+
+def tokenize(text):
+    return TOKEN_RE.findall(fold(text))
+
+
+class SearchIndex:
+    def __init__(self):
+        self._postings = {}   # token -> {isbn: weight}
+        self._vocab = []      # sorted tokens, for prefix ranges
+        self._fresh = []      # tokens added since the last search, not yet in _vocab
+        self._docs = {}       # isbn -> (title, author, tokens)
+        self._ranked = {}     # token -> sorted [(-weight, title, isbn)], long postings only, made on demand
+        self._merge_lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._docs)
+
+    def _doc_tokens(self, title, author, isbn):
+        weights = {}
+        for field, weight in ((title, TITLE_WEIGHT), (author, AUTHOR_WEIGHT), (isbn, ISBN_WEIGHT)):
+            for tok in tokenize(field):
+                weights[tok] = max(weights.get(tok, 0), weight)
+        # the ISBN without separators, so "9782070" finds "978-2-07-036822-8"
+        compact_isbn = "".join(tokenize(isbn))
+        if compact_isbn:
+            weights.setdefault(compact_isbn, ISBN_WEIGHT)
+        return weights
+
+    def add(self, book):
+        doc = self._docs.get(book.isbn)
+        if doc is not None:
+            if doc[0] == book.title and doc[1] == book.author:
+                return
+            self.remove(book.isbn)
+        weights = self._doc_tokens(book.title, book.author, book.isbn)
+        for tok, weight in weights.items():
+            posting = self._postings.get(tok)
+            if posting is None:
+                posting = self._postings[tok] = {}
+                self._fresh.append(tok)
+            posting[book.isbn] = weight
+            ranked = self._ranked.get(tok)
+            if ranked is not None:
+                insort(ranked, (-weight, book.title, book.isbn))
+        self._docs[book.isbn] = (book.title, book.author, tuple(weights))
+
+    def remove(self, isbn):
+        doc = self._docs.pop(isbn, None)
+        if doc is None:
+            return
+        for tok in doc[2]:
+            posting = self._postings[tok]
+            weight = posting.pop(isbn, None)
+            ranked = self._ranked.get(tok)
+            if ranked is not None and weight is not None:
+                del ranked[bisect_left(ranked, (-weight, doc[0], isbn))]
+            if not posting:
+                del self._postings[tok]
+                self._ranked.pop(tok, None)
+                vocab = self._sorted_vocab()
+                del vocab[bisect_left(vocab, tok)]
+
+    def _sorted_vocab(self):
+        # searches may run in parallel (LibraryManager's read lock): the first one merges
+        with self._merge_lock:
+            if self._fresh:
+                if len(self._fresh) < MERGE_THRESHOLD:
+                    for tok in self._fresh:
+                        insort(self._vocab, tok)
+                else:
+                    # two sorted runs: timsort merges them in linear time
+                    self._fresh.sort()
+                    self._vocab = sorted(itertools.chain(self._vocab, self._fresh))
+                self._fresh = []
+            return self._vocab
+
+    def _expand(self, term, limit=None):
+        # {token: bonus} for the tokens a query term matches: the term itself and the tokens it
+        # starts. Without a limit every such token counts, so no match is ever left out.
+        vocab = self._sorted_vocab()
+        i = bisect_left(vocab, term)
+        if limit is None:
+            end, max_books = len(vocab), None
+        else:
+            end, max_books = min(i + MAX_EXPANSION, len(vocab)), max(MAX_EXPANSION_BOOKS, limit)
+        tokens = {}
+        books = 0
+        for j in range(i, end):
+            tok = vocab[j]
+            if not tok.startswith(term):
+                break
+            tokens[tok] = EXACT_BONUS if tok == term else 0
+            if max_books is not None:
+                books += len(self._postings[tok])
+                if books >= max_books:
+                    break
+        return tokens
+
+    def _ranked_posting(self, tok):
+        ranked = self._ranked.get(tok)
+        if ranked is None:
+            title = lambda isbn: self._docs[isbn][0]
+            ranked = sorted((-weight, title(isbn), isbn) for isbn, weight in self._postings[tok].items())
+            if len(ranked) >= RANKED_MIN:
+                self._ranked[tok] = ranked
+        return ranked
+
+    def _score(self, isbn, score, filters):
+        # score plus the best match of the book for every other term, None if one does not match
+        tokens = None
+        for tokens_of_term in filters:
+            if len(tokens_of_term) == 1:
+                (tok, bonus), = tokens_of_term.items()
+                weight = self._postings[tok].get(isbn)
+                if weight is None:
+                    return None
+                score += weight + bonus
+                continue
+            if tokens is None:
+                tokens = self._docs[isbn][2]
+            best = 0
+            for tok in tokens:
+                bonus = tokens_of_term.get(tok)
+                if bonus is not None:
+                    best = max(best, self._postings[tok][isbn] + bonus)
+            if not best:
+                return None
+            score += best
+        return score
+
+    def search(self, query, limit=None):
+        # every query term must start a token of the book (see MAX_EXPANSION); best scores first,
+        # then by title
+        terms = set(tokenize(query))
+        if not terms:
+            return None
+        expansions = sorted((self._expand(term, limit) for term in terms),
+                            key=lambda tokens: sum(len(self._postings[tok]) for tok in tokens))
+        # the term with the fewest books gives the candidates, the others filter them
+        driver, filters = expansions[0], expansions[1:]
+        size = sum(len(self._postings[tok]) for tok in driver)
+        if not size:
+            return []
+        if limit is not None and size >= RANKED_MIN:
+            return self._search_ranked(driver, filters, limit)
+        scores = {}
+        for tok, bonus in driver.items():
+            for isbn, weight in self._postings[tok].items():
+                score = weight + bonus
+                if score > scores.get(isbn, 0):
+                    scores[isbn] = score
+        ranked = []
+        for isbn, score in scores.items():
+            score = self._score(isbn, score, filters)
+            if score is not None:
+                ranked.append((-score, self._docs[isbn][0], isbn))
+        ranked = sorted(ranked) if limit is None else heapq.nsmallest(limit, ranked)
+        return [isbn for _, _, isbn in ranked]
+
+    def _search_ranked(self, driver, filters, limit):
+        # Candidates come in the driver's rank order; the best `limit` are kept. A candidate scores at
+        # most its driver score plus the best possible match of each other term, so once that bound
+        # cannot beat the last result kept, no later candidate can.
+        bound = len(filters) * (max(TITLE_WEIGHT, AUTHOR_WEIGHT, ISBN_WEIGHT) + EXACT_BONUS)
+        if len(driver) == 1:
+            # one token: its bonus is the same for every candidate, added below rather than to each
+            (tok, shift), = driver.items()
+            candidates = self._ranked_posting(tok)
+        else:
+            shift = 0
+            candidates = heapq.merge(*[((neg - bonus, title, isbn) for neg, title, isbn in self._ranked_posting(tok))
+                                       for tok, bonus in driver.items()])
+        bound += shift
+        for tokens_of_term in filters:
+            if len(tokens_of_term) == 1:
+                # drops the candidates without the term's token before the loop below sees them
+                posting = self._postings[next(iter(tokens_of_term))]
+                candidates, keys = itertools.tee(candidates)
+                candidates = itertools.compress(candidates, map(posting.__contains__, map(itemgetter(2), keys)))
+        best = []   # sorted (-score, title, isbn), at most limit of them
+        seen = set()
+        for neg, title, isbn in candidates:
+            if len(best) == limit and (neg - bound, title, isbn) >= best[-1]:
+                break
+            if isbn in seen:
+                continue
+            seen.add(isbn)
+            score = self._score(isbn, shift - neg, filters)
+            if score is None:
+                continue
+            key = (-score, title, isbn)
+            if len(best) < limit:
+                insort(best, key)
+            elif key < best[-1]:
+                insort(best, key)
+                best.pop()
+        return [isbn for _, _, isbn in best]
@@ -0,0 +1,314 @@
+import argparse
+import asyncio
+import json
+import signal
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, unquote, urlsplit
+
+from library import LibraryManager, directory_storage
+
+# threads running LibraryManager calls, so the event loop never waits on a lock or an fsync
+WORKERS = 8
+# most borrow or return requests written in one batch
+MAX_BATCH = 256
+MAX_BODY = 1 << 20
+SEARCH_LIMIT = 20
+# seconds between two runs of expire_holds
+HOLD_CHECK_SECONDS = 60
+
+STATUS_TEXT = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+               409: "Conflict", 413: "Payload Too Large", 500: "Internal Server Error"}
+
+
+class BadRequest(Exception):
+    status = 400
+
+
+class TooLarge(BadRequest):
+    status = 413
+
+
+class DeskBatcher:
+    # Borrow and return requests that arrive while a batch is being written are written together
+    # in the next one: one borrow_many/return_many call, one journal line, one fsync. Requests keep
+    # their arrival order, so two borrows of the same book in a batch behave as if sent one by one.
+
+    def __init__(self, mgr, executor):
+        self.mgr = mgr
+        self.executor = executor
+        self._queues = {}    # ("borrow", days) or ("return",) -> [(item, future)]
+        self._running = set()
+
+    async def borrow(self, isbn, email, days):
+        return await self._submit(("borrow", days), (isbn, email))
+
+    async def return_loan(self, emprunt_id):
+        return await self._submit(("return",), emprunt_id)
+
+    def _submit(self, key, item):
+        future = asyncio.get_running_loop().create_future()
+        self._queues.setdefault(key, []).append((item, future))
+        if key not in self._running:
+            self._running.add(key)
+            asyncio.ensure_future(self._drain(key))
+        return future
+
+    async def _drain(self, key):
+        loop = asyncio.get_running_loop()
+        queue = self._queues[key]
+        try:
+            while queue:
+                batch = queue[:MAX_BATCH]
+                del queue[:MAX_BATCH]
+                items = [item for item, _ in batch]
+                try:
+                    if key[0] == "borrow":
+                        results = await loop.run_in_executor(
+                            self.executor, lambda: self.mgr.borrow_many(items, key[1], atomic=False))
+                    else:
+                        results = await loop.run_in_executor(
+                            self.executor, lambda: self.mgr.return_many(items, atomic=False))
+                except Exception as ex:
+                    for _, future in batch:
+                        if not future.done():
+                            future.set_exception(ex)
+                    continue
+                for (_, future), result in zip(batch, results):
+                    if not future.done():
+                        future.set_result(result)
+        finally:
+            self._running.discard(key)
+
+
+def book_json(book):
+    return book.to_dict()
+
+
+def loan_result(result):
+    # a borrow_many/return_many result as (status, payload)
+    if isinstance(result, KeyError):
+        return 404, {"error": result.args[0] if result.args else str(result)}
+    if isinstance(result, ValueError):
+        return 409, {"error": str(result)}
+    if isinstance(result, dict):
+        return 200, result
+    return 200, {"emprunt": result.to_dict()}
+
+
+def required(body, *fields):
+    values = []
+    for field in fields:
+        value = body.get(field)
+        if not isinstance(value, str) or not value:
+            raise BadRequest(f"missing {field}")
+        values.append(value)
+    return values
+
+
+class LibraryService:
+    # GET  /books?q=...&limit=N   search_books
+    # GET  /books/<isbn>          book_status
+    # GET  /stats                 totals, top books and members
+    # POST /borrow   {"isbn", "email", "days"?}
+    # POST /return   {"emprunt_id"}
+    # POST /reserve  {"isbn", "email", "tier"?}
+    # Answers are JSON; a missing book, member or loan is a 404, a refused operation a 409.
+
+    def __init__(self, mgr, workers=WORKERS):
+        self.mgr = mgr
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="library")
+        self.batcher = DeskBatcher(mgr, self.executor)
+
+    def _call(self, fn, *args):
+        return asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+
+    async def route(self, method, path, query, body):
+        parts = [unquote(p) for p in path.strip("/").split("/")]
+        if method == "GET" and parts == ["books"]:
+            q = query.get("q", [""])[0]
+            try:
+                limit = int(query.get("limit", [SEARCH_LIMIT])[0])
+            except ValueError:
+                raise BadRequest("limit must be a number")
+            if limit < 1:
+                raise BadRequest("limit must be at least 1")
+            books = await self._call(lambda: self.mgr.search_books(q, limit=limit))
+            return 200, [book_json(b) for b in books]
+        if method == "GET" and len(parts) == 2 and parts[0] == "books":
+            status = await self._call(self.mgr.book_status, parts[1])
+            if status is None:
+                return 404, {"error": "Book not found"}
+            return 200, dict(status, book=book_json(status["book"]))
+        if method == "GET" and parts == ["stats"]:
+            return 200, await self._call(self.stats)
+        if method == "POST" and parts == ["borrow"]:
+            isbn, email = required(body, "isbn", "email")
+            days = body.get("days", 14)
+            if not isinstance(days, int) or isinstance(days, bool) or days < 1:
+                raise BadRequest("days must be a positive number")
+            return loan_result(await self.batcher.borrow(isbn, email, days))
+        if method == "POST" and parts == ["return"]:
+            emprunt_id, = required(body, "emprunt_id")
+            return loan_result(await self.batcher.return_loan(emprunt_id))
+        if method == "POST" and parts == ["reserve"]:
+            isbn, email = required(body, "isbn", "email")
+            tier = body.get("tier", 0)
+            if not isinstance(tier, int) or isinstance(tier, bool):
+                raise BadRequest("tier must be a number")
+            try:
+                position = await self._call(self.mgr.reserve_book, isbn, email, tier)
+            except (KeyError, ValueError) as ex:
+                return loan_result(ex)
+            return 200, {"reserved": True, "position": position}
+        if parts[0] in ("books", "stats", "borrow", "return", "reserve"):
+            return 405, {"error": f"{method} not allowed here"}
+        return 404, {"error": "Unknown path"}
+
+    def stats(self):
+        st = self.mgr.stats()
+        return {
+            "total_books": st["total_books"],
+            "total_members": st["total_members"],
+            "total_emprunts": st["total_emprunts"],
+            "available": self.mgr.available_count(),
+            "ongoing": len(st["currently_borrowed"]),
+            "overdue": self.mgr.overdue_count(),
+            "top_books": [{"isbn": b.isbn, "title": b.title, "borrow_count": b.borrow_count} for b in st["top_books"]],
+            "top_members": [{"email": email, "count": count} for email, count in st["top_members"]],
+        }
+
+    async def handle(self, reader, writer):
+        # one connection, HTTP/1.1 with keep-alive
+        try:
+            while True:
+                try:
+                    request = await read_request(reader)
+                except BadRequest as ex:
+                    await send(writer, ex.status, {"error": str(ex)}, False)
+                    return
+                if request is None:
+                    return
+                method, target, body, keep_alive = request
+                url = urlsplit(target)
+                try:
+                    status, payload = await self.route(method, url.path, parse_qs(url.query), body)
+                except BadRequest as ex:
+                    status, payload = ex.status, {"error": str(ex)}
+                except Exception as ex:
+                    print(f"{method} {target}: {ex!r}", file=sys.stderr)
+                    status, payload = 500, {"error": "internal error"}
+                await send(writer, status, payload, keep_alive)
+                if not keep_alive:
+                    return
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except asyncio.CancelledError:
+            # idle keep-alive connections are cancelled when the server stops
+            pass
+        finally:
+            writer.close()
+
+    async def expire_holds_forever(self):
+        while True:
+            try:
+                for isbn, no_show, held_for in await self._call(self.mgr.expire_holds):
+                    print(f"hold on {isbn} expired for {no_show}, now held for {held_for}", file=sys.stderr)
+            except Exception as ex:
+                print(f"expire_holds: {ex!r}", file=sys.stderr)
+            await asyncio.sleep(HOLD_CHECK_SECONDS)
+
+    def close(self):
+        self.executor.shutdown()
+        self.mgr.close()
+
+
+async def read_request(reader):
+    # (method, target, JSON body or {}, keep-alive) or None when the client closed the connection
+    line = await reader.readline()
+    if not line:
+        return None
+    try:
+        method, target, version = line.decode("latin-1").split()
+    except ValueError:
+        raise BadRequest("malformed request line")
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    try:
+        length = int(headers.get("content-length") or 0)
+    except ValueError:
+        raise BadRequest("malformed Content-Length")
+    if length < 0:
+        raise BadRequest("malformed Content-Length")
+    if length > MAX_BODY:
+        raise TooLarge("body too large")
+    body = {}
+    if length:
+        try:
+            body = json.loads(await reader.readexactly(length))
+        except ValueError:
+            raise BadRequest("body is not JSON")
+        if not isinstance(body, dict):
+            raise BadRequest("body must be a JSON object")
+    connection = headers.get("connection", "").lower()
+    keep_alive = connection != "close" if version == "HTTP/1.1" else connection == "keep-alive"
+    return method.upper(), target, body, keep_alive
+
+
+async def send(writer, status, payload, keep_alive):
+    data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+    writer.write(f"HTTP/1.1 {status} {STATUS_TEXT.get(status, '')}\r\n"
+                 f"Content-Type: application/json; charset=utf-8\r\n"
+                 f"Content-Length: {len(data)}\r\n"
+                 f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode("latin-1") + data)
+    await writer.drain()
+
+
+async def serve(mgr, host="127.0.0.1", port=8080, ready=None):
+    service = LibraryService(mgr)
+    server = await asyncio.start_server(service.handle, host, port)
+    try:
+        # SIGTERM stops it like Ctrl-C: pending writes are flushed and the snapshot saved
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, server.close)
+    except (NotImplementedError, AttributeError):
+        # Windows
+        pass
+    if ready:
+        ready(server.sockets[0].getsockname()[1])
+    holds = asyncio.ensure_future(service.expire_holds_forever())
+    try:
+        async with server:
+            await server.serve_forever()
+    except asyncio.CancelledError:
+        pass
+    finally:
+        holds.cancel()
+        service.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="HTTP/JSON service over the library")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--data", metavar="DIR", help="data directory (default: the current one)")
+    parser.add_argument("--sqlite", metavar="DB", help="use a SQLite database instead of the JSON files")
+    args = parser.parse_args(argv)
+    if args.sqlite:
+        from sqlite_storage import SqliteStorage
+        mgr = LibraryManager(SqliteStorage(args.sqlite))
+    else:
+        mgr = LibraryManager(directory_storage(args.data) if args.data else None)
+    try:
+        asyncio.run(serve(mgr, args.host, args.port,
+                          lambda port: print(f"Listening on http://{args.host}:{port}", flush=True)))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
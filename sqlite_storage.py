@@ -0,0 +1,270 @@
+import json
+import sqlite3
+import sys
+import threading
+from datetime import datetime
+
+from file_lock import FileLock
+from library import LibraryManager, JsonStorage, DATEFMT, COMPACT_EVERY
+
+DB_FILE = "library.db"
+# changes kept for the other processes to catch up on; one further behind loads everything again
+CHANGES_KEPT = 10 * COMPACT_EVERY
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS books (
+    isbn TEXT PRIMARY KEY,
+    title TEXT NOT NULL,
+    author TEXT NOT NULL,
+    year,
+    disponibility INTEGER NOT NULL,
+    reservations TEXT NOT NULL,
+    borrow_count INTEGER NOT NULL,
+    reservation_tiers TEXT,
+    hold_until TEXT,
+    held_for TEXT
+);
+CREATE TABLE IF NOT EXISTS members (
+    email TEXT PRIMARY KEY,
+    nom TEXT NOT NULL,
+    prenom TEXT NOT NULL,
+    phone TEXT,
+    date_inscription TEXT
+);
+CREATE TABLE IF NOT EXISTS emprunts (
+    emprunt_id TEXT PRIMARY KEY,
+    book_isbn TEXT NOT NULL,
+    member_email TEXT NOT NULL,
+    date_emprunt TEXT NOT NULL,
+    date_due TEXT NOT NULL,
+    date_return TEXT,
+    status TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_emprunts_book ON emprunts(book_isbn);
+CREATE INDEX IF NOT EXISTS idx_emprunts_member ON emprunts(member_email);
+CREATE INDEX IF NOT EXISTS idx_emprunts_status_due ON emprunts(status, date_due);
+CREATE INDEX IF NOT EXISTS idx_books_borrow_count ON books(borrow_count);
+CREATE TABLE IF NOT EXISTS changes (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    record TEXT NOT NULL
+);
+"""
+
+BOOK_COLS = ("isbn", "title", "author", "year", "disponibility", "reservations", "borrow_count", "reservation_tiers",
+             "hold_until", "held_for")
+MEMBER_COLS = ("email", "nom", "prenom", "phone", "date_inscription")
+EMPRUNT_COLS = ("emprunt_id", "book_isbn", "member_email", "date_emprunt", "date_due", "date_return", "status")
+
+TABLES = {
+    "books": ("isbn", BOOK_COLS),
+    "members": ("email", MEMBER_COLS),
+    "emprunts": ("emprunt_id", EMPRUNT_COLS),
+}
+
+
+def book_to_row(d):
+    return (d["isbn"], d["title"], d["author"], d.get("year", ""), int(bool(d.get("disponibility", True))),
+            json.dumps(d.get("reservations", []), ensure_ascii=False), int(d.get("borrow_count", 0)),
+            json.dumps(d["reservation_tiers"], ensure_ascii=False) if d.get("reservation_tiers") else None,
+            d.get("hold_until"), d.get("held_for"))
+
+
+def book_from_row(row):
+    d = dict(zip(BOOK_COLS, row))
+    d["disponibility"] = bool(d["disponibility"])
+    d["reservations"] = json.loads(d["reservations"])
+    tiers = d.pop("reservation_tiers")
+    if tiers:
+        d["reservation_tiers"] = json.loads(tiers)
+    for column in ("hold_until", "held_for"):
+        if d[column] is None:
+            del d[column]
+    return d
+
+
+def to_row(kind, d):
+    if kind == "books":
+        return book_to_row(d)
+    return tuple(d.get(c) for c in TABLES[kind][1])
+
+
+def from_row(kind, row):
+    if kind == "books":
+        return book_from_row(row)
+    return dict(zip(TABLES[kind][1], row))
+
+
+class SqliteStorage:
+    def __init__(self, path=DB_FILE):
+        self.path = path
+        # shared by the threads of LibraryManager; _conn_lock keeps their transactions apart
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn_lock = threading.RLock()
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=FULL")
+        self.conn.executescript(SCHEMA)
+        # databases made before reservation tiers and holds
+        columns = {row[1] for row in self.conn.execute("PRAGMA table_info(books)")}
+        for column in ("reservation_tiers", "hold_until", "held_for"):
+            if column not in columns:
+                self.conn.execute(f"ALTER TABLE books ADD COLUMN {column} TEXT")
+        self._lock = FileLock(path + ".lock")
+        # last change this process has applied, and the lock.taken it was read under
+        self._seq = 0
+        self._read_under = None
+
+    # storage interface used by LibraryManager
+    def lock(self):
+        return self._lock
+
+    def _last_seq(self):
+        with self._conn_lock:
+            return self.conn.execute("SELECT COALESCE(MAX(seq), 0) FROM changes").fetchone()[0]
+
+    def load(self):
+        self._seq = self._last_seq()
+        self._read_under = self._lock.taken
+        snapshot = {}
+        for kind in ("books", "members"):
+            cur = self.conn.execute(f"SELECT {', '.join(TABLES[kind][1])} FROM {kind}")
+            snapshot[kind] = [from_row(kind, row) for row in cur]
+        snapshot["emprunts"] = self.iter_emprunts()
+        return snapshot, []
+
+    def iter_emprunts(self):
+        cur = self.conn.execute(f"SELECT {', '.join(EMPRUNT_COLS)} FROM emprunts")
+        return (from_row("emprunts", row) for row in cur)
+
+    def find_emprunts(self, emprunt_ids):
+        ids = list(emprunt_ids)
+        found = {}
+        with self._conn_lock:
+            # older SQLite builds allow 999 parameters per statement
+            for i in range(0, len(ids), 500):
+                part = ids[i:i + 500]
+                for row in self.conn.execute(f"SELECT {', '.join(EMPRUNT_COLS)} FROM emprunts "
+                                             f"WHERE emprunt_id IN ({', '.join('?' * len(part))})", part):
+                    found[row[0]] = from_row("emprunts", row)
+        return found
+
+    def has_new(self):
+        return self._last_seq() != self._seq
+
+    def read_new(self):
+        # same contract as JsonStorage.read_new, from the changes table
+        if self._read_under == self._lock.taken:
+            return []
+        self._read_under = self._lock.taken
+        with self._conn_lock:
+            rows = self.conn.execute("SELECT seq, record FROM changes WHERE seq > ? ORDER BY seq", (self._seq,)).fetchall()
+        if rows and rows[0][0] != self._seq + 1:
+            return None
+        records = []
+        for seq, record in rows:
+            records.extend(json.loads(record))
+            self._seq = seq
+        return records
+
+    def append(self, records):
+        with self._conn_lock, self.conn:
+            for rec in records:
+                self._write(rec["kind"], rec["key"], rec["data"])
+            cur = self.conn.execute("INSERT INTO changes (record) VALUES (?)", (json.dumps(records, ensure_ascii=False),))
+            self._seq = cur.lastrowid
+
+    def sync(self, ticket):
+        # every transaction is durable when append returns
+        pass
+
+    def _write(self, kind, key, data):
+        pk, cols = TABLES[kind]
+        if data is None:
+            self.conn.execute(f"DELETE FROM {kind} WHERE {pk} = ?", (key,))
+        else:
+            self.conn.execute(f"INSERT OR REPLACE INTO {kind} ({', '.join(cols)}) VALUES ({', '.join('?' * len(cols))})",
+                              to_row(kind, data))
+
+    def bulk_write(self, records, snapshot):
+        # one transaction for the whole import
+        self.append(records)
+
+    def needs_compaction(self):
+        return False
+
+    def compact(self, snapshot):
+        # every write already lands in its row, only the change log is trimmed
+        with self._conn_lock, self.conn:
+            self.conn.execute("DELETE FROM changes WHERE seq <= ?", (self._last_seq() - CHANGES_KEPT,))
+
+    def close(self):
+        self.conn.close()
+
+    def import_snapshot(self, snapshot):
+        with self._conn_lock, self.conn:
+            for kind, rows in snapshot.items():
+                if kind not in TABLES:
+                    # derived data such as loan_days is recomputed from the emprunts table
+                    continue
+                cols = TABLES[kind][1]
+                self.conn.executemany(
+                    f"INSERT OR REPLACE INTO {kind} ({', '.join(cols)}) VALUES ({', '.join('?' * len(cols))})",
+                    (to_row(kind, d) for d in rows))
+
+    # indexed queries, usable without loading the whole library in memory
+    def _emprunts(self, where, params):
+        cur = self.conn.execute(f"SELECT {', '.join(EMPRUNT_COLS)} FROM emprunts WHERE {where}", params)
+        return [from_row("emprunts", row) for row in cur]
+
+    def overdue_emprunts(self, today=None):
+        today = today or datetime.today().strftime(DATEFMT)
+        return self._emprunts("status = 'ongoing' AND date_due < ? ORDER BY date_due", (today,))
+
+    def current_emprunts(self):
+        return self._emprunts("status = 'ongoing'", ())
+
+    def emprunts_by_member(self, member_email):
+        return self._emprunts("member_email = ?", (member_email,))
+
+    def book_status(self, isbn):
+        row = self.conn.execute(f"SELECT {', '.join(BOOK_COLS)} FROM books WHERE isbn = ?", (isbn,)).fetchone()
+        if not row:
+            return None
+        book = book_from_row(row)
+        ongoing = self.conn.execute(
+            "SELECT member_email FROM emprunts WHERE book_isbn = ? AND status = 'ongoing' LIMIT 1", (isbn,)).fetchone()
+        return {
+            "book": book,
+            "available": book["disponibility"],
+            "borrowed_by": ongoing[0] if ongoing else None,
+            "reservations": list(book["reservations"])
+        }
+
+    def stats(self, top=5):
+        count = lambda sql: self.conn.execute(sql).fetchone()[0]
+        top_books = [book_from_row(row) for row in self.conn.execute(
+            f"SELECT {', '.join(BOOK_COLS)} FROM books ORDER BY borrow_count DESC LIMIT ?", (top,))]
+        top_members = self.conn.execute(
+            "SELECT member_email, COUNT(*) AS n FROM emprunts GROUP BY member_email ORDER BY n DESC LIMIT ?",
+            (top,)).fetchall()
+        return {
+            "total_books": count("SELECT COUNT(*) FROM books"),
+            "total_members": count("SELECT COUNT(*) FROM members"),
+            "total_emprunts": count("SELECT COUNT(*) FROM emprunts"),
+            "top_books": top_books,
+            "top_members": top_members,
+            "currently_borrowed": self.current_emprunts()
+        }
+
+
+def migrate_json_to_sqlite(db_path=DB_FILE, json_storage=None):
+    # loading through LibraryManager also replays the pending journal
+    mgr = LibraryManager(json_storage or JsonStorage())
+    storage = SqliteStorage(db_path)
+    storage.import_snapshot(mgr._snapshot())
+    return storage
+
+
+if __name__ == "__main__":
+    path = sys.argv[1] if len(sys.argv) > 1 else DB_FILE
+    migrate_json_to_sqlite(path).close()
+    print(f"Migrated JSON data into {path}")
@@ -0,0 +1,112 @@
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# how often the Tk thread collects finished tasks
+POLL_MS = 50
+
+
+class TaskCancelled(Exception):
+    pass
+
+
+class Task:
+    def __init__(self, name, fn, on_done, on_error):
+        self.name = name
+        self.fn = fn
+        self.on_done = on_done
+        self.on_error = on_error
+        # fraction None means the task cannot tell how far along it is
+        self.fraction = None
+        self.text = ""
+        self._cancelled = threading.Event()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def progress(self, fraction=None, text=""):
+        # called from the worker; a cancelled task stops at its next progress report
+        if self.cancelled:
+            raise TaskCancelled(self.name)
+        self.fraction = fraction
+        self.text = text
+
+
+class TaskRunner:
+    # Runs fn(task) on a worker thread and calls on_done(result) / on_error(exc) back on the Tk
+    # thread. Widgets must only be touched in the callbacks, never inside fn.
+
+    def __init__(self, app, workers=2, on_status=None):
+        self.app = app
+        self.on_status = on_status
+        self.running = {}
+        self.pending = {}
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="gui-task")
+        self._results = queue.Queue()
+        self._polling = False
+
+    def submit(self, name, fn, on_done=None, on_error=None):
+        # Repeated clicks are coalesced: while a task with this name runs, only the last request
+        # is kept and it starts once the running one has finished.
+        if name in self.running:
+            self.pending[name] = (fn, on_done, on_error)
+            return self.running[name]
+        task = Task(name, fn, on_done, on_error)
+        self.running[name] = task
+        self._pool.submit(self._run, task)
+        self._status()
+        if not self._polling:
+            self._polling = True
+            self.app.after(POLL_MS, self._poll)
+        return task
+
+    def cancel(self, name=None):
+        for task_name in [name] if name else list(self.running):
+            self.pending.pop(task_name, None)
+            if task_name in self.running:
+                self.running[task_name].cancel()
+
+    def shutdown(self):
+        self.cancel()
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+    def _run(self, task):
+        try:
+            self._results.put((task, task.fn(task), None))
+        except BaseException as ex:
+            self._results.put((task, None, ex))
+
+    def _poll(self):
+        while True:
+            try:
+                task, result, error = self._results.get_nowait()
+            except queue.Empty:
+                break
+            del self.running[task.name]
+            self._finish(task, result, error)
+            if task.name in self.pending:
+                self.submit(task.name, *self.pending.pop(task.name))
+        self._status()
+        if self.running:
+            self.app.after(POLL_MS, self._poll)
+        else:
+            self._polling = False
+
+    def _finish(self, task, result, error):
+        if task.cancelled or isinstance(error, TaskCancelled):
+            return
+        if error is None:
+            if task.on_done:
+                task.on_done(result)
+        elif task.on_error:
+            task.on_error(error)
+        else:
+            self.app.report_callback_exception(type(error), error, error.__traceback__)
+
+    def _status(self):
+        if self.on_status:
+            self.on_status(list(self.running.values()))
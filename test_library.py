@@ -0,0 +1,346 @@
+import csv
+import gzip
+import os
+import random
+from datetime import date, timedelta
+
+import pytest
+
+from library import HOLD_DAYS, LibraryManager, directory_storage
+from bulk_import import import_file
+from export import EMPRUNT_HEADER, export_table
+from forecasting import DemandForecaster, month_index
+from search_index import fold, tokenize
+
+BOOKS = 200
+MEMBERS = 15
+
+
+def library(directory):
+    mgr = LibraryManager(directory_storage(str(directory)))
+    mgr.import_books((i, {"title": f"Book {i}", "author": "Author", "isbn": f"ISBN_{i}"}) for i in range(BOOKS))
+    mgr.import_members((i, {"nom": "Nom", "prenom": "Prenom", "email": f"member{i}@example.com"})
+                       for i in range(MEMBERS))
+    return mgr
+
+
+def random_desk(mgr, rnd, steps):
+    # borrows (some of them reservations), returns one by one and in batches, a few removals
+    for _ in range(steps):
+        open_ids = [e.emprunt_id for e in mgr.current_emprunts()]
+        isbn = f"ISBN_{rnd.randrange(BOOKS)}"
+        email = f"member{rnd.randrange(MEMBERS)}@example.com"
+        roll = rnd.random()
+        try:
+            if roll < 0.5:
+                mgr.borrow_book(isbn, email, days=rnd.randrange(-20, 20))
+            elif roll < 0.6:
+                mgr.borrow_many([(isbn, email), (f"ISBN_{rnd.randrange(BOOKS)}", email)], atomic=False)
+            elif roll < 0.8 and open_ids:
+                mgr.return_book(rnd.choice(open_ids))
+            elif roll < 0.9 and open_ids:
+                mgr.return_many(rnd.sample(open_ids, min(3, len(open_ids))) + ["no-such-loan"], atomic=False)
+            elif roll < 0.95:
+                mgr.remove_book(isbn)
+            elif roll < 0.99:
+                mgr.remove_member(email)
+        except (KeyError, ValueError):
+            pass
+
+
+def check_indexes(mgr):
+    # every loan index against a rescan of mgr.emprunts
+    by_book, by_member, open_loans = {}, {}, {}
+    for eid, e in mgr.emprunts.items():
+        by_book.setdefault(e.book_isbn, set()).add(eid)
+        by_member.setdefault(e.member_email, set()).add(eid)
+        if e.status == "ongoing":
+            open_loans[eid] = e
+    assert {isbn: set(loans) for isbn, loans in mgr._loans_by_book.items()} == by_book
+    assert {email: set(loans) for email, loans in mgr._loans_by_member.items()} == by_member
+    for index in (mgr._loans_by_book, mgr._loans_by_member):
+        for loans in index.values():
+            assert all(e is mgr.emprunts[eid] for eid, e in loans.items())
+    assert mgr._open_loans == open_loans
+    # sorted by due date, then in the order the loans were indexed
+    assert mgr._due_index == sorted(mgr._due_keys.values())
+    assert sorted((due, eid) for due, _, eid in mgr._due_index) == sorted((e.due_ordinal, eid) for eid, e in open_loans.items())
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_loan_indexes_match_a_rescan(tmp_path, seed):
+    rnd = random.Random(seed)
+    mgr = library(tmp_path)
+    for _ in range(6):
+        random_desk(mgr, rnd, 40)
+        check_indexes(mgr)
+    assert mgr.current_emprunts()
+
+    # loaded again: open loans only, then with the history
+    mgr = LibraryManager(directory_storage(str(tmp_path)))
+    check_indexes(mgr)
+    random_desk(mgr, rnd, 40)
+    check_indexes(mgr)
+    mgr.load_history()
+    check_indexes(mgr)
+
+    mgr.compact()
+    mgr = LibraryManager(directory_storage(str(tmp_path)))
+    mgr.load_history()
+    check_indexes(mgr)
+
+
+def test_loan_indexes_follow_another_process(tmp_path):
+    rnd = random.Random(7)
+    mgr = library(tmp_path)
+    other = LibraryManager(directory_storage(str(tmp_path)))
+    random_desk(other, rnd, 80)
+    mgr.refresh()
+    check_indexes(mgr)
+    assert set(mgr._open_loans) == set(other._open_loans)
+
+
+def check_stats(mgr):
+    # stats() against the full computation over every loan, loaded or still on disk
+    rows = list(mgr.emprunt_rows())
+    counts = {}
+    for d in rows:
+        counts[d["member_email"]] = counts.get(d["member_email"], 0) + 1
+    st = mgr.stats()
+    assert st["total_books"] == len(mgr.books)
+    assert st["total_members"] == len(mgr.members)
+    assert st["total_emprunts"] == len(rows)
+    # ties may come in any order: the counts must be the top ones and belong to their keys
+    assert [b.borrow_count for b in st["top_books"]] == sorted((b.borrow_count for b in mgr.books.values()),
+                                                              reverse=True)[:5]
+    assert all(mgr.books[b.isbn] is b for b in st["top_books"])
+    assert [ct for _, ct in st["top_members"]] == sorted(counts.values(), reverse=True)[:5]
+    assert all(counts[email] == ct for email, ct in st["top_members"])
+    assert {e.emprunt_id for e in st["currently_borrowed"]} == {d["emprunt_id"] for d in rows
+                                                               if d["status"] == "ongoing"}
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_stats_match_the_full_computation(tmp_path, seed):
+    rnd = random.Random(seed)
+    mgr = library(tmp_path)
+    check_stats(mgr)
+    for _ in range(4):
+        random_desk(mgr, rnd, 50)
+        check_stats(mgr)
+
+    # returned loans only counted until the history is loaded
+    mgr = LibraryManager(directory_storage(str(tmp_path)))
+    check_stats(mgr)
+    random_desk(mgr, rnd, 50)
+    check_stats(mgr)
+    mgr.load_history()
+    check_stats(mgr)
+
+    mgr.compact()
+    check_stats(mgr)
+    mgr = LibraryManager(directory_storage(str(tmp_path)))
+    check_stats(mgr)
+    random_desk(mgr, rnd, 50)
+    check_stats(mgr)
+
+    other = LibraryManager(directory_storage(str(tmp_path)))
+    random_desk(other, rnd, 50)
+    mgr.refresh()
+    check_stats(mgr)
+
+
+WORDS = ["Roman", "Rome", "Hugo", "Balzac", "Voyage", "Nuit", "Jardin", "Guerre", "Paix", "Mer", "Temps", "Antique",
+         "Victor", "Honore", "Zola", "Emile", "Les", "La"]
+
+
+def test_index_search_finds_what_the_substring_scan_finds(tmp_path):
+    rnd = random.Random(3)
+    mgr = LibraryManager(directory_storage(str(tmp_path)))
+    # enough books on one token to reach the expansion caps of a search with a limit
+    mgr.import_books((i, {"title": f"Roman {i}", "author": "Victor Hugo", "isbn": f"R{i:05d}"}) for i in range(6000))
+    mgr.import_books((i, {"title": " ".join(rnd.sample(WORDS, 3)), "author": " ".join(rnd.sample(WORDS, 2)),
+                          "isbn": f"ISBN-{i:04d}"}) for i in range(300))
+    mgr.add_book("Rome antique", "Honore de Balzac", "X-1", "1900")
+    # the index matches the start of words: compare on the queries found nowhere else
+    text = " ".join(f"{b.title} {b.author} {b.isbn}".lower() for b in mgr.books.values())
+    queries = {word.lower()[:n] for word in WORDS + ["isbn", "x"] for n in range(1, len(word) + 1)}
+    queries = [q for q in sorted(queries) if text.count(q) == sum(tok.startswith(q) for tok in tokenize(text))]
+    assert {"ro", "rom", "hu", "ba"} <= set(queries)
+    for q in queries:
+        expected = {b.isbn for b in mgr.search_books(q, mode="substring")}
+        assert {b.isbn for b in mgr.search_books(q)} == expected, q
+        assert {b.isbn for b in mgr.search_books(q, limit=len(expected) + 10)} == expected, q
+        limited = mgr.search_books(q, limit=10)
+        assert len(limited) == min(10, len(expected)) and {b.isbn for b in limited} <= expected, q
+    assert "X-1" in {b.isbn for b in mgr.search_books("rom")}
+
+
+def test_reserving_an_available_book_holds_it_until_expiry(tmp_path):
+    mgr = library(tmp_path)
+    assert mgr.reserve_book("ISBN_1", "member1@example.com") == 1
+    book = mgr.books["ISBN_1"]
+    assert not book.disponibility and book.held_for == "member1@example.com"
+    # anyone else joins the queue
+    assert mgr.borrow_book("ISBN_1", "member2@example.com") == {"reserved": True, "position": 2}
+
+    # not collected in time: the next member gets the book, then nobody
+    after = date.today() + timedelta(days=HOLD_DAYS + 1)
+    assert mgr.expire_holds(after) == [("ISBN_1", "member1@example.com", "member2@example.com")]
+    assert mgr.expire_holds(after) == []
+    assert mgr.expire_holds(after + timedelta(days=HOLD_DAYS + 1)) == [("ISBN_1", "member2@example.com", None)]
+    assert book.disponibility and not book.reservations and book.held_for is None
+    assert mgr.borrow_book("ISBN_1", "member3@example.com").member_email == "member3@example.com"
+
+    # the state survives a reload
+    mgr = LibraryManager(directory_storage(str(tmp_path)))
+    assert not mgr.books["ISBN_1"].disponibility and not mgr.books["ISBN_1"].reservations
+
+
+def test_held_book_goes_to_its_member(tmp_path):
+    mgr = library(tmp_path)
+    loan = mgr.borrow_book("ISBN_2", "member1@example.com")
+    assert mgr.borrow_book("ISBN_2", "member2@example.com") == {"reserved": True, "position": 1}
+    mgr.return_book(loan.emprunt_id)
+    book = mgr.books["ISBN_2"]
+    assert book.held_for == "member2@example.com"
+    assert mgr.expire_holds(date.today()) == []
+    assert mgr.borrow_book("ISBN_2", "member3@example.com") == {"reserved": True, "position": 2}
+    assert mgr.borrow_book("ISBN_2", "member2@example.com").member_email == "member2@example.com"
+    assert book.hold_ordinal is None and list(book.reservations) == ["member3@example.com"]
+
+
+def test_a_book_left_available_with_a_queue_gets_a_hold(tmp_path):
+    # saved that way by an older version
+    mgr = library(tmp_path)
+    mgr.reserve_book("ISBN_3", "member1@example.com")
+    book = mgr.books["ISBN_3"]
+    book.disponibility, book.hold_ordinal, book.held_for = True, None, None
+    # compacts, and waits for the snapshot to be written
+    mgr.close()
+    mgr = LibraryManager(directory_storage(str(tmp_path)))
+    today = date.today()
+    assert mgr.expire_holds(today) == [("ISBN_3", None, "member1@example.com")]
+    assert mgr.expire_holds(today + timedelta(days=HOLD_DAYS + 1)) == [("ISBN_3", "member1@example.com", None)]
+    assert mgr.books["ISBN_3"].disponibility
+
+
+def test_import_reads_rows_without_the_storage_lock(tmp_path):
+    mgr = library(tmp_path)
+    held = []
+
+    def rows():
+        for i in range(3):
+            held.append(mgr.storage.lock()._holders)
+            yield i, {"title": f"New {i}", "author": "Author", "isbn": f"NEW_{i}"}
+
+    assert mgr.import_books(rows()) == (3, [])
+    assert held == [0, 0, 0]
+    assert mgr.import_books([(1, {"title": "Again", "author": "Author", "isbn": "NEW_0"})]) == \
+        (0, [(1, "duplicate key NEW_0")])
+
+
+def test_title_forecasts_follow_the_catalogue(tmp_path):
+    mgr = library(tmp_path)
+    forecaster = DemandForecaster(mgr)
+    mgr.add_book("Les Misérables", "Victor Hugo", "LM-1", "1862")
+    mgr.add_book("LES MISERABLES", "Victor Hugo", "LM-2", "1862")
+    for isbn, email in (("LM-1", "member1@example.com"), ("LM-2", "member2@example.com"), ("ISBN_1", "member3@example.com")):
+        mgr.return_book(mgr.borrow_book(isbn, email).emprunt_id)
+    next_month = date.today().replace(day=28) + timedelta(days=7)
+
+    def check():
+        for title in ("les misérables", "Book 1"):
+            # a rescan of the catalogue and every loan
+            isbns = {isbn for isbn, b in mgr.books.items() if fold(b.title) == fold(title)}
+            expected = {}
+            for d in mgr.emprunt_rows():
+                if d["book_isbn"] in isbns:
+                    month = month_index(date.fromisoformat(d["date_emprunt"]))
+                    expected[month] = expected.get(month, 0) + 1
+            assert forecaster._counts(("title", fold(title))) == expected
+            fresh = DemandForecaster(mgr)
+            assert forecaster.forecast_title(title, 2, next_month) == fresh.forecast_title(title, 2, next_month)
+            fresh.close()
+
+    check()
+    assert sum(forecaster._counts(("title", fold("Les miserables"))).values()) == 2
+    mgr.remove_book("LM-2")
+    mgr.add_book("Les misérables", "Victor Hugo", "LM-3", "1862")
+    mgr.return_book(mgr.borrow_book("LM-3", "member4@example.com").emprunt_id)
+    check()
+    assert sum(forecaster._counts(("title", fold("Les miserables"))).values()) == 2
+
+
+def state(mgr):
+    # everything a reload must give back
+    return ({isbn: b.to_dict() for isbn, b in mgr.books.items()},
+            {email: m.to_dict() for email, m in mgr.members.items()},
+            sorted((d["emprunt_id"], sorted(d.items())) for d in mgr.emprunt_rows()))
+
+
+def test_replay_after_a_crash(tmp_path):
+    # the manager is never closed: what it acknowledged must come back from the journal
+    rnd = random.Random(11)
+    mgr = library(tmp_path)
+    random_desk(mgr, rnd, 60)
+    mgr.reserve_book("ISBN_5", "member5@example.com")
+    before = state(mgr)
+    assert os.path.getsize(tmp_path / "journal.jsonl")
+    assert state(LibraryManager(directory_storage(str(tmp_path)))) == before
+
+    # a write torn by the crash is dropped, and cut off by the next write
+    with open(tmp_path / "journal.jsonl", "ab") as f:
+        f.write(b'{"kind": "books", "key": "ISBN_1", "data": {"title": "Tor')
+    mgr = LibraryManager(directory_storage(str(tmp_path)))
+    assert state(mgr) == before
+    loan = mgr.borrow_book("ISBN_7", "member7@example.com")
+    after = state(mgr)
+    assert state(LibraryManager(directory_storage(str(tmp_path)))) == after
+    assert loan.emprunt_id in {d["emprunt_id"] for d in LibraryManager(directory_storage(str(tmp_path))).emprunt_rows()}
+
+
+def test_replay_across_journal_rotations(tmp_path):
+    # enough records to compact (and rotate the journal) several times, reloaded without waiting
+    # for the last snapshot to be written
+    rnd = random.Random(12)
+    mgr = library(tmp_path)
+    for _ in range(5):
+        random_desk(mgr, rnd, 300)
+        assert state(LibraryManager(directory_storage(str(tmp_path)))) == state(mgr)
+    mgr.close()
+    assert not [name for name in os.listdir(tmp_path) if name.startswith("journal.jsonl.") and name[14:].isdigit()]
+    assert state(LibraryManager(directory_storage(str(tmp_path)))) == state(mgr)
+
+
+def test_export_then_import_gives_the_same_catalogue(tmp_path):
+    rnd = random.Random(13)
+    (tmp_path / "a").mkdir()
+    (tmp_path / "b").mkdir()
+    mgr = library(tmp_path / "a")
+    mgr.add_book("Paroles, poèmes", 'Jacques "Prévert"', "978-2-07-036822-8", "1946")
+    mgr.add_member("Nom, composé", "Éloïse", "eloise@example.com", "+33 1 23 45 67 89")
+    random_desk(mgr, rnd, 60)
+    assert export_table(mgr, "books", str(tmp_path / "books.csv")) == len(mgr.books)
+    assert export_table(mgr, "members", str(tmp_path / "members.csv.gz")) == len(mgr.members)
+    assert export_table(mgr, "emprunts", str(tmp_path / "emprunts.csv")) == mgr.stats()["total_emprunts"]
+    with gzip.open(tmp_path / "members.csv.gz", "rt", encoding="utf-8") as f:
+        assert next(csv.reader(f))[0] == "email"
+    with open(tmp_path / "emprunts.csv", encoding="utf-8", newline="") as f:
+        rows = list(csv.reader(f))
+    assert rows[0] == EMPRUNT_HEADER
+    assert sorted(rows[1:]) == sorted([str(d.get(c) or "") for c in EMPRUNT_HEADER] for d in mgr.emprunt_rows())
+
+    other = LibraryManager(directory_storage(str(tmp_path / "b")))
+    assert import_file(other, "books", str(tmp_path / "books.csv")) == (len(mgr.books), [])
+    assert import_file(other, "members", str(tmp_path / "members.csv.gz")) == (len(mgr.members), [])
+    fields = ("title", "author", "isbn", "year")
+    assert {isbn: [getattr(b, f) for f in fields] for isbn, b in other.books.items()} == \
+        {isbn: [getattr(b, f) for f in fields] for isbn, b in mgr.books.items()}
+    assert {email: m.to_dict() for email, m in other.members.items()} == \
+        {email: m.to_dict() for email, m in mgr.members.items()}
+
+    # the same file again: every row is already there
+    imported, rejects = import_file(other, "books", str(tmp_path / "books.csv"))
+    assert imported == 0 and len(rejects) == len(mgr.books)
+    assert state(LibraryManager(directory_storage(str(tmp_path / "b")))) == state(other)
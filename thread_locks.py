@@ -0,0 +1,109 @@
+import threading
+from contextlib import contextmanager
+
+
+class RWLock:
+    # Many readers or one writer. Waiting writers go first so a stream of readers cannot starve
+    # them. A thread that holds the lock may take it again: for reading while it reads or writes,
+    # for writing while it writes (but not for writing while it only reads).
+
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writer = None
+        self._writers_waiting = 0
+        self._local = threading.local()
+
+    def _depths(self):
+        local = self._local
+        if not hasattr(local, "reads"):
+            local.reads = 0
+            local.writes = 0
+        return local
+
+    @contextmanager
+    def read(self):
+        depths = self._depths()
+        if depths.reads or depths.writes:
+            depths.reads += 1
+            try:
+                yield
+            finally:
+                depths.reads -= 1
+            return
+        with self._cond:
+            while self._writer is not None or self._writers_waiting:
+                self._cond.wait()
+            self._readers += 1
+        depths.reads = 1
+        try:
+            yield
+        finally:
+            depths.reads = 0
+            with self._cond:
+                self._readers -= 1
+                if not self._readers:
+                    self._cond.notify_all()
+
+    @contextmanager
+    def write(self):
+        depths = self._depths()
+        if depths.writes:
+            depths.writes += 1
+            try:
+                yield
+            finally:
+                depths.writes -= 1
+            return
+        if depths.reads:
+            raise RuntimeError("cannot take the write lock while holding the read lock")
+        me = threading.get_ident()
+        with self._cond:
+            self._writers_waiting += 1
+            try:
+                while self._writer is not None or self._readers:
+                    self._cond.wait()
+            finally:
+                self._writers_waiting -= 1
+            self._writer = me
+        depths.writes = 1
+        try:
+            yield
+        finally:
+            depths.writes = 0
+            with self._cond:
+                self._writer = None
+                self._cond.notify_all()
+
+
+class KeyLocks:
+    # One mutex per key, made on demand and dropped once no thread holds or waits for it.
+
+    def __init__(self):
+        self._mutex = threading.Lock()
+        self._locks = {}   # key -> [lock, threads holding or waiting]
+
+    @contextmanager
+    def hold(self, keys):
+        # the keys are locked in sorted order, so two threads never wait on each other
+        keys = sorted(set(keys))
+        with self._mutex:
+            entries = []
+            for key in keys:
+                entry = self._locks.setdefault(key, [threading.Lock(), 0])
+                entry[1] += 1
+                entries.append(entry)
+        held = []
+        try:
+            for entry in entries:
+                entry[0].acquire()
+                held.append(entry)
+            yield
+        finally:
+            for entry in reversed(held):
+                entry[0].release()
+            with self._mutex:
+                for key, entry in zip(keys, entries):
+                    entry[1] -= 1
+                    if not entry[1]:
+                        del self._locks[key]
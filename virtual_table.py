@@ -0,0 +1,146 @@
+import tkinter as tk
+from tkinter import ttk
+
+# rows formatted ahead of and behind the viewport so short scrolls don't call row_fn again
+BUFFER_ROWS = 20
+
+
+class VirtualTable:
+    # A Treeview that only holds items for the rows on screen. The table is a list of keys and a
+    # row_fn(key) -> values; rows are formatted when they scroll into view.
+
+    def __init__(self, parent, columns, width=140, rowheight=25):
+        self.frame = tk.Frame(parent)
+        self.tree = ttk.Treeview(self.frame, columns=columns, show="headings", selectmode="browse")
+        for c in columns:
+            self.tree.heading(c, text=c, anchor="center")
+            self.tree.column(c, width=width, anchor="center")
+        self.scrollbar = ttk.Scrollbar(self.frame, orient="vertical", command=self._on_scrollbar)
+        self.tree.pack(side="left", fill="both", expand=True)
+        self.scrollbar.pack(side="right", fill="y")
+
+        self.rowheight = rowheight
+        self.keys = []
+        self._keyset = set()
+        self.row_fn = None
+        self.offset = 0
+        self.visible = 1
+        self.selected_key = None
+        self._items = []
+        self._cache = {}
+
+        self.tree.bind("<Configure>", self._on_resize)
+        self.tree.bind("<MouseWheel>", lambda e: self.scroll(-1 if e.delta > 0 else 1))
+        self.tree.bind("<Button-4>", lambda e: self.scroll(-1))
+        self.tree.bind("<Button-5>", lambda e: self.scroll(1))
+        self.tree.bind("<<TreeviewSelect>>", self._on_select)
+
+    def pack(self, **kw):
+        self.frame.pack(**kw)
+
+    def set_rows(self, keys, row_fn):
+        self.keys = keys
+        self._keyset = set(keys)
+        self.row_fn = row_fn
+        self._cache = {}
+        self.offset = max(0, min(self.offset, len(self.keys) - self.visible))
+        self.render()
+
+    def __contains__(self, key):
+        return key in self._keyset
+
+    # Incremental updates: only the Treeview item showing the key, if any, is touched.
+    def add_key(self, key):
+        if key in self._keyset:
+            self.update_key(key)
+            return
+        self.keys.append(key)
+        self._keyset.add(key)
+        if len(self.keys) <= self.offset + self.visible:
+            self.render()
+        else:
+            self._update_scrollbar()
+
+    def update_key(self, key):
+        self._cache.pop(key, None)
+        window = self.keys[self.offset:self.offset + len(self._items)]
+        if key in window:
+            self.tree.item(self._items[window.index(key)], values=self._row(key))
+
+    def remove_key(self, key):
+        if key not in self._keyset:
+            return
+        self.keys.remove(key)
+        self._keyset.discard(key)
+        self._cache.pop(key, None)
+        if key == self.selected_key:
+            self.selected_key = None
+        self.offset = max(0, min(self.offset, len(self.keys) - self.visible))
+        self.render()
+
+    def scroll(self, rows):
+        self.scroll_to(self.offset + rows)
+
+    def scroll_to(self, offset):
+        offset = max(0, min(offset, len(self.keys) - self.visible))
+        if offset != self.offset:
+            self.offset = offset
+            self.render()
+
+    def _on_scrollbar(self, *args):
+        if args[0] == "moveto":
+            self.scroll_to(int(float(args[1]) * len(self.keys)))
+        elif args[0] == "scroll":
+            step = self.visible if args[2] == "pages" else 1
+            self.scroll(int(args[1]) * step)
+
+    def _on_resize(self, event):
+        # the heading takes about one row
+        visible = max(1, event.height // self.rowheight - 1)
+        if visible != self.visible:
+            self.visible = visible
+            self.offset = max(0, min(self.offset, len(self.keys) - self.visible))
+            self.render()
+
+    def _on_select(self, event):
+        sel = self.tree.selection()
+        if sel and sel[0] in self._items:
+            self.selected_key = self.keys[self.offset + self._items.index(sel[0])]
+
+    def _row(self, key):
+        values = self._cache.get(key)
+        if values is None:
+            values = self._cache[key] = self.row_fn(key)
+        return values
+
+    def render(self):
+        window = self.keys[self.offset:self.offset + self.visible]
+        while len(self._items) < len(window):
+            self._items.append(self.tree.insert("", "end"))
+        while len(self._items) > len(window):
+            self.tree.delete(self._items.pop())
+
+        selected = []
+        for iid, key in zip(self._items, window):
+            self.tree.item(iid, values=self._row(key))
+            if key == self.selected_key:
+                selected.append(iid)
+        self.tree.selection_set(selected)
+
+        # keep only the formatted rows around the viewport
+        lo = max(0, self.offset - BUFFER_ROWS)
+        hi = self.offset + self.visible + BUFFER_ROWS
+        keep = self.keys[lo:hi]
+        if len(self._cache) > 2 * len(keep):
+            self._cache = {k: self._cache[k] for k in keep if k in self._cache}
+        for k in keep:
+            self._row(k)
+
+        self._update_scrollbar()
+
+    def _update_scrollbar(self):
+        total = len(self.keys)
+        if total:
+            self.scrollbar.set(self.offset / total, min(1.0, (self.offset + len(self._items)) / total))
+        else:
+            self.scrollbar.set(0, 1)